@@ -1,70 +1,162 @@
 from langgraph.graph import StateGraph, END
-from planner import planner_node
-from optimistic import optimistic_node
-from realistic import realistic_node
-from state import AgentState, initialize_state, ConversationEntry
-from typing import Dict, Any, Union
+from langchain.schema.runnable import RunnableLambda
+from planner import planner_node,planner_node_async
+from optimistic import optimistic_node,optimistic_node_async
+from realistic import realistic_node,realistic_node_async
+from research import research_node,research_node_async
+from response_cache import cached_node,cached_node_async
+import optimistic
+import realistic
+import planner
+from state import AgentState, dropped_update
+from streaming import SentenceSegmenter, SPEAK_TAG
+from topic_classifier import classify_topic,classify_topic_async
+from session_memory import DEFAULT_SESSION
+from scheduling import schedule_agents,resume_deferred
+from ensemble import ensemble_node,ensemble_node_async,pending_personas,SINGLE_CALL
+from telemetry import traced_node,start_trace,span,set_topic
+from deadline import turn_deadline,within,time_left,AGENT_RESERVE_MS
+import memory
+import memory_store
+from background import run_sync
+from typing import Dict, Any, Union, List, Optional, Callable
 import traceback
-import uuid
+import inspect
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+
+AGENT_NODES=["optimist","realist","planner"]
+#topics whose agents must run one after another in select_next order
+SEQUENTIAL_TOPICS:set=set()
 
 workflow=StateGraph(AgentState)
 
-workflow.add_node("planner",planner_node)
-workflow.add_node("relaistic",realistic_node)
-workflow.add_node("optimistic",optimistic_node)
+#each agent runs its blocking variant under invoke and its asyncio variant under ainvoke
+#with RESPONSE_CACHE=1 each agent answers near-duplicate questions from the semantic cache; fallbacks are never cached
+#every node runs in a telemetry span of the turn's trace
+#under ainvoke an agent still running at the turn deadline is dropped from the answer with its fallback confidence
+PLANNER_SKIP=(planner.FALLBACK_RESPONSE,planner.ERROR_RESPONSE)
+REALIST_SKIP=(realistic.FALLBACK_RESPONSE,)
+OPTIMIST_SKIP=(optimistic.FALLBACK_RESPONSE,optimistic.EMPTY_RESPONSE)
+
+def deadline_node(agent:str,node_async:Callable,fallback_confidence:float)->Callable:
+    async def run(state:AgentState)->Dict[str,Any]:
+        try:
+            return await within(node_async(state),time_left(reserve_ms=AGENT_RESERVE_MS),agent)
+        except TimeoutError:
+            print(f"{agent} missed the turn deadline, answering without it")
+            return dropped_update(agent,fallback_confidence)
+    return run
+
+def agent_node(agent:str,node:Callable,node_async:Callable,skip:tuple,fallback_confidence:float)->RunnableLambda:
+    return RunnableLambda(
+        traced_node(agent,cached_node(agent,node,skip),agent=agent),
+        afunc=traced_node(agent,cached_node_async(agent,deadline_node(agent,node_async,fallback_confidence),skip),agent=agent)
+    )
+
+workflow.add_node("planner",agent_node("planner",planner_node,planner_node_async,PLANNER_SKIP,planner.ERROR_CONFIDENCE))
+workflow.add_node("realist",agent_node("realist",realistic_node,realistic_node_async,REALIST_SKIP,realistic.FALLBACK_CONFIDENCE))
+workflow.add_node("optimist",agent_node("optimist",optimistic_node,optimistic_node_async,OPTIMIST_SKIP,optimistic.FALLBACK_CONFIDENCE))
+
+INTRO="Hi! I'm here with my colleagues to discuss any topic you'd like. What would you like us to explore together?"
+CAREER_CLOSING="Would you like to explore more specific aspects of either the internship or project path?"
+GENERAL_CLOSING="Would you like to go deeper into any of those points?"
+
+#the topic is classified here, once per turn, and every later node reads state.topic_type
+#the scheduler then decides which agents run; a "go deeper" follow-up instead resumes the agents held back last turn
+def system_intro_node(state:AgentState)->Dict[str,Any]:
+    update={"active_agent":"system","final_response":INTRO}
+    resumed=resume_deferred(state.user_input,state.session_id or DEFAULT_SESSION)
+    if resumed:
+        update.update(resumed)
+    else:
+        if not state.topic_type:
+            #in single-call mode an unsure topic is left to the generation call, which classifies it too
+            update["topic_type"]=classify_topic(state.user_input,use_llm=not SINGLE_CALL)
+        update.update(schedule_agents(state.user_input,update.get("topic_type") or state.topic_type,state.session_id or DEFAULT_SESSION))
+    set_topic(update.get("topic_type") or state.topic_type)
+    return update
 
-def system_intro_node(state:AgentState)->AgentState:
-    new_state=AgentState(**state.dict())
-    new_state.active_agent="system"
-    new_state.final_response="Hi! I'm here with my colleagues to discuss any topic you'd like. What would you like us to explore together?"
-    return new_state
+async def system_intro_node_async(state:AgentState)->Dict[str,Any]:
+    update={"active_agent":"system","final_response":INTRO}
+    resumed=resume_deferred(state.user_input,state.session_id or DEFAULT_SESSION)
+    if resumed:
+        update.update(resumed)
+    else:
+        if not state.topic_type:
+            update["topic_type"]=await classify_topic_async(state.user_input,use_llm=not SINGLE_CALL)
+        update.update(schedule_agents(state.user_input,update.get("topic_type") or state.topic_type,state.session_id or DEFAULT_SESSION))
+    set_topic(update.get("topic_type") or state.topic_type)
+    return update
     
-workflow.add_node("system_intro",system_intro_node)
+workflow.add_node("system_intro",RunnableLambda(traced_node("system_intro",system_intro_node),afunc=traced_node("system_intro",system_intro_node_async)))
+workflow.add_node("research",RunnableLambda(traced_node("research",research_node),afunc=traced_node("research",research_node_async)))
+workflow.add_node("ensemble",RunnableLambda(traced_node("ensemble",ensemble_node),afunc=traced_node("ensemble",ensemble_node_async)))
 workflow.set_entry_point("system_intro")
 
+def runs_concurrently(state:AgentState)->bool:
+    return state.is_concurrent and state.topic_type not in SEQUENTIAL_TOPICS
+
+#still to run this turn: no answer yet, and not left out by the scheduler or the deadline
+def needs_turn(state:AgentState,agent:str)->bool:
+    return not getattr(state,f"{agent}_response") and agent not in state.dropped_agents
+
+#fan-out: every agent starts from the same input state
+def route_agents(state:AgentState)->Union[str,List[str]]:
+    try:
+        if not state.user_input.strip():
+            return END
+        if runs_concurrently(state):
+            pending=[agent for agent in AGENT_NODES if needs_turn(state,agent)]
+            return pending or END
+        return select_next(state)
+    except Exception as e:
+        print(f"Error in route_agents: {str(e)}")
+        traceback.print_exc()
+        return END
+
+#with GENERATION_MODE=single_call one call answers for every pending agent first; whoever it leaves out runs on its own
+def route_generation(state:AgentState)->Union[str,List[str]]:
+    if SINGLE_CALL and state.user_input.strip() and pending_personas(state):
+        return "ensemble"
+    return route_agents(state)
+
 #handoff logic
 def select_next(state:AgentState)->str:
     try:
         if not state.user_input.strip():
             return END
-        if state.active_agent=="system":
-            if not state.topic_type:
-                if "internship" in state.user_input.lower() or "job" in state.user_input.lower():
-                    state.topic_type="career"
-                elif "study" in state.user_input.lower() or "course" in state.user_input.lower():
-                    state.topic_type="education"
-                elif any(tech in state.user_input.lower() for tech in ["programming", "software", "technology", "code"]):
-                    state.topic_type="technical"
-                else:
-                    state.topic_type="career"  
-            
-            if not state.optimist_response:
+        #fan-in: concurrent agents finish in the same step and the reducers merge them
+        if runs_concurrently(state):
+            return END
+        if state.active_agent=="system" and state.topic_type not in {"career","education","technical"}:
+            if needs_turn(state,"optimist"):
                 return "optimist"
-            if not state.realist_response:
+            if needs_turn(state,"realist"):
                 return "realist"
-            if not state.planner_response:
+            if needs_turn(state,"planner"):
                 return "planner"
             
         if state.topic_type=="career":
-            if not state.optimist_response:
+            if needs_turn(state,"optimist"):
                 return "optimist"
-            elif not state.realist_response:
+            elif needs_turn(state,"realist"):
                 return "realist"
-            elif not state.planner_response:
+            elif needs_turn(state,"planner"):
                 return "planner"
         elif state.topic_type=="education":
-            if not state.realist_response:
+            if needs_turn(state,"realist"):
                 return "realist"
-            elif not state.optimist_response:
+            elif needs_turn(state,"optimist"):
                 return "optimist"
-            elif not state.planner_response:
+            elif needs_turn(state,"planner"):
                 return "planner"
         elif state.topic_type=="technical":
-            if not state.planner_response:
+            if needs_turn(state,"planner"):
                 return "planner"
-            elif not state.realist_response:
+            elif needs_turn(state,"realist"):
                 return "realist"
-            elif not state.optimist_response:
+            elif needs_turn(state,"optimist"):
                 return "optimist"
 
         return END
@@ -72,10 +164,13 @@ def select_next(state:AgentState)->str:
         print(f"Error in select_next: {str(e)}")
         traceback.print_exc()
         return END
-    
-for node in ["system_intro","planner","realist","optimistic"]:
-    workflow.add_transition(node,select_next,{
-        "system_intro":"system_intro",
+
+#one shared search stage feeds every agent
+workflow.add_edge("system_intro","research")
+workflow.add_conditional_edges("research",route_generation,["ensemble"]+AGENT_NODES+[END])
+workflow.add_conditional_edges("ensemble",route_agents,AGENT_NODES+[END])
+for node in AGENT_NODES:
+    workflow.add_conditional_edges(node,select_next,{
             "planner":"planner",
             "realist":"realist",
             "optimist":"optimist",
@@ -84,11 +179,13 @@ for node in ["system_intro","planner","realist","optimistic"]:
 
 app=workflow.compile()
 
-def create_initial_state(user_input:str,is_voice:bool=False)->AgentState:
+#session_id scopes short-term memory; callers serving several users must pass their own
+def create_initial_state(user_input:str,is_voice:bool=False,concurrent:bool=True,session_id:Optional[str]=None)->AgentState:
     return AgentState(
         user_input=user_input,
         is_voice_input=is_voice,
-        session_id=str(uuid.uuid4()),
+        is_concurrent=concurrent,
+        session_id=session_id or DEFAULT_SESSION,
         active_agent=None,
         final_response=None,
         topic_type=None,
@@ -108,77 +205,226 @@ def extract_final_state(result:Union[Dict[str, Any],AgentState])->AgentState:
     try:
         if isinstance(result,AgentState):
             return result
+        #graph output is made of channel values the reducers already merged, so it is not validated again
         if isinstance(result,dict):
             if len(result)==1:
                 inner=next(iter(result.values()))
-                return inner if isinstance(inner,AgentState) else AgentState(**inner)
-            return AgentState(**result)
+                return inner if isinstance(inner,AgentState) else AgentState.model_construct(**inner)
+            return AgentState.model_construct(**result)
         raise ValueError(f"Unexpected result structure type: {type(result)}")
     except Exception as e:
         print(f"Error extracting final state: {str(e)}")
         raise
 
-def run_conversation(user_input:str, is_voice:bool=False)->AgentState:
+def format_final_response(result_state:AgentState)->AgentState:
+    if result_state.dropped_agents and not result_state.response_buffer:
+        #every agent missed the deadline; the planner's fallback still gives the user something to answer
+        result_state.planner_response=planner.FALLBACK_RESPONSE
+        result_state.response_buffer={"planner":planner.FALLBACK_RESPONSE}
+    if not result_state.final_response:
+        lines=[]
+        
+        if not result_state.conversation_history:
+            lines.append('**System**:"Hi! I\'m here with my colleagues to discuss any topic you\'d like. What would you like us to explore together?"')
+        #to bold the sender
+        lines.append(f'**User**: "{result_state.user_input.strip()}"')
+
+        agent_configs = {
+            "optimist":("Optimist Agent","in a hopeful tone"),
+            "realist":("Realist Agent","in a factual tone"),
+            "planner":("Planner Agent","in a strategic tone")
+        }
+
+        for agent_type, response in result_state.response_buffer.items():
+            if response and agent_type in agent_configs:
+                agent_icon,tone=agent_configs[agent_type]
+                lines.append(f'**{agent_icon}** *({tone})*: "{response.strip()}"')
+
+        closing=CAREER_CLOSING if result_state.topic_type=="career" else GENERAL_CLOSING
+        lines.append(f'**System**:"{closing}"')
+        result_state.final_response="\n\n".join(lines)
+        result_state.active_agent="system"
+    return result_state
+
+def invalid_input_state(user_input,is_voice:bool)->AgentState:
+    return AgentState(
+        user_input=str(user_input),
+        final_response="I didn't receive valid input. Could you try again?",
+        active_agent="system",
+        is_voice_input=is_voice
+    )
+
+def prepare_initial_state(user_input:str,is_voice:bool,concurrent:bool,session_id:Optional[str]=None)->AgentState:
+    return create_initial_state(user_input, is_voice, concurrent, session_id)
+
+def workflow_error_state(user_input:str,is_voice:bool)->AgentState:
+    return AgentState(
+        user_input=user_input,
+        is_voice_input=is_voice,
+        final_response="I'm sorry, I had trouble processing that. For questions about internships or projects, I can help you weigh the pros and cons. Would you like to try again?",
+        active_agent="system"
+    )
+
+def conversation_error_state(user_input,is_voice:bool)->AgentState:
+    return AgentState(
+        user_input=str(user_input),
+        is_voice_input=is_voice,
+        final_response="I encountered an issue, but I'm here to help. Could you try rephrasing your question about internships or projects?",
+        active_agent="system"
+    )
+
+#each turn is one trace under one deadline; the returned state carries its trace_id for telemetry.get_trace
+#the wrapped entry points take session_id by keyword only, so it cannot also arrive through *args
+def conversation_turn(run:Callable)->Callable:
+    @wraps(run)
+    async def run_turn(user_input, *args, session_id:Optional[str]=None, **kwargs)->AgentState:
+        with start_trace(session_id or DEFAULT_SESSION) as trace, turn_deadline():
+            result_state=await run(user_input,*args,session_id=session_id,**kwargs)
+            result_state.trace_id=trace.trace_id
+            return result_state
+    return run_turn
+
+@conversation_turn
+async def run_conversation_async(user_input:str, is_voice:bool=False, concurrent:bool=True, *, session_id:Optional[str]=None)->AgentState:
+    try:
+        if not user_input or not isinstance(user_input,str):
+            return invalid_input_state(user_input,is_voice)
+        initial_state=prepare_initial_state(user_input, is_voice, concurrent, session_id)
+
+        try:
+            with span("workflow"):
+                #hard stop at the deadline; the agents give up AGENT_RESERVE_MS before it, so it only fires if a node ignores its slice
+                result=await within(app.ainvoke(initial_state),time_left(),"workflow")
+            result_state=extract_final_state(result)
+        except Exception as e:
+            print(f"Workflow error: {str(e)}")
+            print(traceback.format_exc())
+            return workflow_error_state(user_input,is_voice)
+
+        return format_final_response(result_state)
+
+    except Exception as e:
+        print(f"Error in run_conversation: {str(e)}")
+        print(traceback.format_exc())
+        return conversation_error_state(user_input,is_voice)
+
+#realist sources are shown on screen, not read aloud
+STOP_MARKERS={"realist":(realistic.SOURCES_MARKER,)}
+SOURCES_NOTE="Please refer to the sources below for more information."
+
+async def _emit(callback:Optional[Callable],*args)->None:
+    if callback is None:
+        return
+    result=callback(*args)
+    if inspect.isawaitable(result):
+        await result
+
+@conversation_turn
+async def run_conversation_streaming_async(user_input:str, on_chunk:Callable[[str,str],Any], on_agent_done:Optional[Callable[[str],Any]]=None,
+                                           is_voice:bool=False, concurrent:bool=True, *, session_id:Optional[str]=None)->AgentState:
+    #same turn as run_conversation_async, but speakable sentences reach on_chunk(agent,text) while tokens are still streaming
     try:
         if not user_input or not isinstance(user_input,str):
-            return AgentState(
-                user_input=str(user_input),
-                final_response="I didn't receive valid input. Could you try again?",
-                active_agent="system",
-                is_voice_input=is_voice
-            )
-        initial_state=create_initial_state(user_input, is_voice)
+            return invalid_input_state(user_input,is_voice)
+        initial_state=prepare_initial_state(user_input, is_voice, concurrent, session_id)
+        segmenters={
+            agent:SentenceSegmenter(stop_markers=STOP_MARKERS.get(agent,()),stop_note=SOURCES_NOTE if agent in STOP_MARKERS else None)
+            for agent in AGENT_NODES
+        }
 
-        if any(word in user_input.lower() for word in ["internship", "project", "job", "career", "work"]):
-            initial_state.topic_type="career"
+        async def consume_events()->Any:
+            result=None
+            async for event in app.astream_events(initial_state,version="v2"):
+                kind=event["event"]
+                node=event.get("metadata",{}).get("langgraph_node")
+                if kind=="on_chat_model_stream" and node in segmenters and SPEAK_TAG in event.get("tags",[]):
+                    for chunk in segmenters[node].push(event["data"]["chunk"].content):
+                        await _emit(on_chunk,node,chunk)
+                elif kind=="on_chain_end" and node in segmenters and event.get("name")==node:
+                    segmenter=segmenters[node]
+                    chunks=segmenter.flush()
+                    output=event["data"].get("output") or {}
+                    if isinstance(output,dict) and node in output.get("dropped_agents",{}):
+                        #cut off at the deadline: the half sentence left in the segmenter is not spoken
+                        chunks=[]
+                    #fallback or non-streamed responses are spoken whole
+                    elif not segmenter.emitted and isinstance(output,dict) and output.get(f"{node}_response"):
+                        chunks=segmenter.push(output[f"{node}_response"])+segmenter.flush()
+                    for chunk in chunks:
+                        await _emit(on_chunk,node,chunk)
+                    await _emit(on_agent_done,node)
+                elif kind=="on_chain_end" and node=="ensemble" and event.get("name")=="ensemble":
+                    #the single-call reply is json, so its answers are spoken once it is parsed
+                    output=event["data"].get("output") or {}
+                    for agent in AGENT_NODES:
+                        if isinstance(output,dict) and output.get(f"{agent}_response"):
+                            segmenter=segmenters[agent]
+                            for chunk in segmenter.push(output[f"{agent}_response"])+segmenter.flush():
+                                await _emit(on_chunk,agent,chunk)
+                            await _emit(on_agent_done,agent)
+                elif kind=="on_chain_end" and not event.get("parent_ids"):
+                    result=event["data"].get("output")
+            return result
 
         try:
-            result=app.invoke(initial_state)
+            with span("workflow",streaming=True):
+                result=await within(consume_events(),time_left(),"workflow")
             result_state=extract_final_state(result)
         except Exception as e:
             print(f"Workflow error: {str(e)}")
             print(traceback.format_exc())
-            return AgentState(
-                user_input=user_input,
-                is_voice_input=is_voice,
-                final_response="I'm sorry, I had trouble processing that. For questions about internships or projects, I can help you weigh the pros and cons. Would you like to try again?",
-                active_agent="system"
-            )
-
-        if not result_state.final_response:
-            lines=[]
-            
-            if not result_state.conversation_history:
-                lines.append('**System**:"Hi! I\'m here with my colleagues to discuss any topic you\'d like. What would you like us to explore together?"')
-            #to bold the sender
-            lines.append(f'**User**: "{result_state.user_input.strip()}"')
-
-            agent_configs = {
-                "optimist":("Optimist Agent","in a hopeful tone"),
-                "realist":("Realist Agent","in a factual tone"),
-                "planner":("Planner Agent","in a strategic tone")
-            }
-
-            for agent_type, response in result_state.response_buffer.items():
-                if response and agent_type in agent_configs:
-                    agent_icon,tone=agent_configs[agent_type]
-                    lines.append(f'**{agent_icon}** *({tone})*: "{response.strip()}"')
-
-            if result_state.topic_type=="career":
-                lines.append('**System**:"Would you like to explore more specific aspects of either the internship or project path?"')
-            else:
-                lines.append('**System**:"Would you like to go deeper into any of those points?"')
-            result_state.final_response="\n\n".join(lines)
-            result_state.active_agent="system"
+            return workflow_error_state(user_input,is_voice)
+
+        unanswered=bool(result_state.dropped_agents) and not result_state.response_buffer
+        result_state=format_final_response(result_state)
+        if unanswered:
+            #nothing was spoken before the deadline, so the fallback that stands in for the agents is
+            await _emit(on_chunk,"planner",result_state.planner_response)
+            await _emit(on_agent_done,"planner")
         return result_state
 
     except Exception as e:
         print(f"Error in run_conversation: {str(e)}")
         print(traceback.format_exc())
-        return AgentState(
-            user_input=str(user_input),
-            is_voice_input=is_voice,
-            final_response="I encountered an issue, but I'm here to help. Could you try rephrasing your question about internships or projects?",
-            active_agent="system"
-        )
+        return conversation_error_state(user_input,is_voice)
+
+#blocking entry point for callers without an event loop (e.g. the streamlit script)
+#every turn runs on the same background loop, so its search client and connection pool carry over between turns
+def run_conversation(user_input:str, is_voice:bool=False, concurrent:bool=True, session_id:Optional[str]=None)->AgentState:
+    return run_sync(run_conversation_async(user_input, is_voice, concurrent, session_id=session_id))
+
+#fixed texts the agents speak word for word, as (agent, text); their audio is synthesized once and served from disk after
+def known_phrases()->List[tuple]:
+    return [
+        ("system",INTRO),
+        ("system",CAREER_CLOSING),
+        ("system",GENERAL_CLOSING),
+        ("optimist",optimistic.FALLBACK_RESPONSE),
+        ("optimist",optimistic.EMPTY_RESPONSE),
+        ("realist",realistic.FALLBACK_RESPONSE),
+        ("realist",SOURCES_NOTE),
+        ("planner",planner.FALLBACK_RESPONSE),
+        ("planner",planner.ERROR_RESPONSE)
+    ]
 
+#builds the llm, memories, vector store and (optionally) the voice client up front so the first turn does not pay for it
+#returns "ok" or the error for each service; a failed service is retried on its first real use
+def warm_up(include_voice:bool=False)->Dict[str,str]:
+    services={"memory":memory.warm_up,"vector_store":memory_store.warm_up}
+    if include_voice:
+        import tts_stt
+        def warm_voice():
+            tts_stt.warm_up()
+            run_sync(tts_stt.prewarm_audio(known_phrases()))
+        services["voice"]=warm_voice
+    status={}
+    with ThreadPoolExecutor(max_workers=len(services)) as pool:
+        futures={name:pool.submit(warm) for name,warm in services.items()}
+        for name,future in futures.items():
+            try:
+                future.result()
+                status[name]="ok"
+            except Exception as e:
+                print(f"Warm-up failed for {name}: {str(e)}")
+                status[name]=str(e)
+    return status
@@ -0,0 +1,141 @@
+#disk-backed LRU cache of synthesized speech
+#one file per clip keyed by voice, encoding, sample rate and text; the least recently played clips go once the size cap is reached
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict,Optional
+from dotenv import load_dotenv
+from lazy import LazyResource
+from telemetry import register_cache
+
+load_dotenv()
+logger=logging.getLogger(__name__)
+
+AUDIO_CACHE_ENABLED=os.getenv("AUDIO_CACHE","1")!="0"
+AUDIO_CACHE_PATH=os.getenv("AUDIO_CACHE_PATH") or os.path.join(os.path.expanduser("~"),".cache","voiceagent","audio")
+AUDIO_CACHE_MAX_MB=float(os.getenv("AUDIO_CACHE_MAX_MB","200"))
+
+def normalize_text(text:str)->str:
+    return " ".join(text.split())
+
+def audio_key(model:str,encoding:str,sample_rate:int,text:str)->str:
+    return hashlib.sha256(f"{model}\0{encoding}\0{sample_rate}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+class AudioCache:
+    def __init__(self,path:str,max_bytes:int):
+        self.path=path
+        self.max_bytes=max_bytes
+        self._lock=threading.Lock()
+        #key -> size, least recently used first
+        self._index:"OrderedDict[str,int]"=OrderedDict()
+        self.total_bytes=0
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        os.makedirs(path,exist_ok=True)
+        self._load()
+
+    def _file(self,key:str)->str:
+        return os.path.join(self.path,f"{key}.audio")
+
+    def _load(self)->None:
+        #modification times are refreshed on every hit, so they give the lru order back after a restart
+        entries=[]
+        for name in os.listdir(self.path):
+            if not name.endswith(".audio"):
+                continue
+            stat=os.stat(os.path.join(self.path,name))
+            entries.append((stat.st_mtime,name[:-6],stat.st_size))
+        for _,key,size in sorted(entries):
+            self._index[key]=size
+            self.total_bytes+=size
+        self._evict()
+
+    def get(self,key:str)->Optional[bytes]:
+        with self._lock:
+            if key not in self._index:
+                self.misses+=1
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._file(key),"rb") as f:
+                audio=f.read()
+            os.utime(self._file(key))
+        except OSError:
+            with self._lock:
+                self.total_bytes-=self._index.pop(key,0)
+                self.misses+=1
+            return None
+        with self._lock:
+            self.hits+=1
+        return audio
+
+    def set(self,key:str,audio:bytes)->None:
+        if not audio or len(audio)>self.max_bytes:
+            return
+        #written under a temporary name so a reader never sees half a clip
+        temp=self._file(key)+f".{threading.get_ident()}.tmp"
+        try:
+            with open(temp,"wb") as f:
+                f.write(audio)
+            os.replace(temp,self._file(key))
+        except OSError as e:
+            logger.error(f"Audio cache write failed: {str(e)}")
+            return
+        with self._lock:
+            self.total_bytes+=len(audio)-self._index.pop(key,0)
+            self._index[key]=len(audio)
+            self._evict()
+
+    def _evict(self)->None:
+        while self.total_bytes>self.max_bytes and self._index:
+            key,size=self._index.popitem(last=False)
+            self.total_bytes-=size
+            self.evictions+=1
+            try:
+                os.remove(self._file(key))
+            except OSError:
+                pass
+
+    def __contains__(self,key:str)->bool:
+        return key in self._index
+
+    def clear(self)->None:
+        with self._lock:
+            for key in list(self._index):
+                try:
+                    os.remove(self._file(key))
+                except OSError:
+                    pass
+            self._index.clear()
+            self.total_bytes=0
+
+    def stats(self)->Dict[str,float]:
+        with self._lock:
+            lookups=self.hits+self.misses
+            return {
+                "entries":len(self._index),
+                "bytes":self.total_bytes,
+                "max_bytes":self.max_bytes,
+                "hits":self.hits,
+                "misses":self.misses,
+                "evictions":self.evictions,
+                "hit_rate":self.hits/lookups if lookups else 0.0
+            }
+
+#created on first use so importing tts_stt does not touch the disk
+_audio_cache=LazyResource(lambda:AudioCache(AUDIO_CACHE_PATH,int(AUDIO_CACHE_MAX_MB*1024*1024)),"audio cache")
+
+def get_audio_cache()->Optional[AudioCache]:
+    if not AUDIO_CACHE_ENABLED:
+        return None
+    try:
+        return _audio_cache.get()
+    except OSError as e:
+        logger.error(f"Audio cache unavailable: {str(e)}")
+        return None
+
+#reported once the cache exists, reading stats should not create it
+register_cache("audio",lambda:_audio_cache.get().stats() if _audio_cache.initialized else {})
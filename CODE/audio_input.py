@@ -0,0 +1,157 @@
+#streaming speech capture with an energy-based endpointer
+#audio sources yield 16-bit mono pcm frames; capture stops as soon as the speaker goes quiet
+import os
+import wave
+import asyncio
+import inspect
+import numpy as np
+from typing import AsyncIterator,Iterable,Optional,Union
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SAMPLE_RATE=16000
+FRAME_MS=20
+
+#silence that ends an utterance, and the hard limits on either side of it
+VAD_SILENCE_MS=int(os.getenv("VAD_SILENCE_MS","700"))
+VAD_MIN_SPEECH_MS=int(os.getenv("VAD_MIN_SPEECH_MS","200"))
+VAD_NO_SPEECH_MS=int(os.getenv("VAD_NO_SPEECH_MS","5000"))
+VAD_MAX_MS=int(os.getenv("VAD_MAX_MS","15000"))
+#speech must be this many times louder than the noise floor measured while nobody talks
+VAD_RATIO=float(os.getenv("VAD_RATIO","3.0"))
+VAD_MIN_RMS=float(os.getenv("VAD_MIN_RMS","300"))
+
+def frame_rms(frame:bytes)->float:
+    samples=np.frombuffer(frame[:len(frame)//2*2],dtype=np.int16)
+    if not samples.size:
+        return 0.0
+    return float(np.sqrt(np.mean(samples.astype(np.float64)**2)))
+
+class EnergyEndpointer:
+    def __init__(self,sample_rate:int=SAMPLE_RATE,silence_ms:int=VAD_SILENCE_MS,min_speech_ms:int=VAD_MIN_SPEECH_MS,
+                 no_speech_ms:int=VAD_NO_SPEECH_MS,max_ms:int=VAD_MAX_MS,ratio:float=VAD_RATIO,min_rms:float=VAD_MIN_RMS):
+        self.sample_rate=sample_rate
+        self.silence_ms=silence_ms
+        self.min_speech_ms=min_speech_ms
+        self.no_speech_ms=no_speech_ms
+        self.max_ms=max_ms
+        self.ratio=ratio
+        self.min_rms=min_rms
+        self.noise_floor:Optional[float]=None
+        self.elapsed_ms=0.0
+        self.speech_ms=0.0
+        self.silence_run_ms=0.0
+        self.reason:Optional[str]=None
+
+    @property
+    def threshold(self)->float:
+        return max(self.min_rms,(self.noise_floor or 0.0)*self.ratio)
+
+    @property
+    def speech_started(self)->bool:
+        return self.speech_ms>=self.min_speech_ms
+
+    #feeds one frame of any length, returns True once the utterance is over
+    def process(self,frame:bytes)->bool:
+        rms=frame_rms(frame)
+        frame_ms=len(frame)/2/self.sample_rate*1000
+        self.elapsed_ms+=frame_ms
+        if rms>=self.threshold:
+            self.speech_ms+=frame_ms
+            self.silence_run_ms=0.0
+        else:
+            #the floor only tracks quiet frames, so it adapts to the room without chasing the voice
+            self.noise_floor=rms if self.noise_floor is None else 0.95*self.noise_floor+0.05*rms
+            if self.speech_started:
+                self.silence_run_ms+=frame_ms
+            elif self.speech_ms:
+                #a click or a cough, not speech
+                self.speech_ms=0.0
+        if self.speech_started and self.silence_run_ms>=self.silence_ms:
+            self.reason="silence"
+        elif not self.speech_started and self.elapsed_ms>=self.no_speech_ms:
+            self.reason="no_speech"
+        elif self.elapsed_ms>=self.max_ms:
+            self.reason="max_duration"
+        return self.reason is not None
+
+#audio sources
+
+async def microphone_frames(sample_rate:int=SAMPLE_RATE,frame_ms:int=FRAME_MS)->AsyncIterator[bytes]:
+    #imported here, loading portaudio fails on machines without an audio device
+    import sounddevice as sd
+    loop=asyncio.get_running_loop()
+    frames:asyncio.Queue=asyncio.Queue()
+    def callback(data,frame_count,time_info,status):
+        loop.call_soon_threadsafe(frames.put_nowait,bytes(data))
+    with sd.RawInputStream(samplerate=sample_rate,blocksize=sample_rate*frame_ms//1000,channels=1,dtype="int16",callback=callback):
+        while True:
+            yield await frames.get()
+
+#realtime=True paces the file like a live microphone
+async def wav_frames(path:str,frame_ms:int=FRAME_MS,realtime:bool=False)->AsyncIterator[bytes]:
+    with wave.open(path,"rb") as wav_file:
+        if wav_file.getsampwidth()!=2 or wav_file.getnchannels()!=1:
+            raise ValueError("Only 16-bit mono WAV files are supported")
+        frame_count=wav_file.getframerate()*frame_ms//1000
+        while True:
+            frame=wav_file.readframes(frame_count)
+            if not frame:
+                return
+            yield frame
+            await asyncio.sleep(frame_ms/1000 if realtime else 0)
+
+async def iter_frames(source:Union[Iterable[bytes],AsyncIterator[bytes]])->AsyncIterator[bytes]:
+    if inspect.isasyncgen(source) or hasattr(source,"__aiter__"):
+        async for frame in source:
+            yield bytes(frame)
+    else:
+        for frame in source:
+            yield bytes(frame)
+            await asyncio.sleep(0)
+
+def wav_sample_rate(path:str)->int:
+    with wave.open(path,"rb") as wav_file:
+        return wav_file.getframerate()
+
+#transcriber protocol: await start(), await send(frame), await finish()->transcript, await cancel()
+class BufferedTranscriber:
+    #collects the utterance and sends it once; used when no streaming session is available
+    def __init__(self,transcribe_buffer,sample_rate:int=SAMPLE_RATE):
+        self.transcribe_buffer=transcribe_buffer
+        self.sample_rate=sample_rate
+        self.frames=[]
+
+    async def start(self)->None:
+        self.frames=[]
+
+    async def send(self,frame:bytes)->None:
+        self.frames.append(frame)
+
+    async def finish(self)->str:
+        return await self.transcribe_buffer(b"".join(self.frames),self.sample_rate)
+
+    async def cancel(self)->None:
+        self.frames=[]
+
+#pushes frames to an already started transcriber as they arrive and stops at the endpoint
+async def capture_utterance(source,transcriber,endpointer:Optional[EnergyEndpointer]=None)->str:
+    endpointer=endpointer or EnergyEndpointer()
+    frames=iter_frames(source)
+    try:
+        async for frame in frames:
+            await transcriber.send(frame)
+            if endpointer.process(frame):
+                break
+    finally:
+        #stops the microphone stream as well as the wrapper
+        await frames.aclose()
+        close=getattr(source,"aclose",None)
+        if close:
+            await close()
+    if endpointer.reason=="no_speech":
+        #nothing was said, so nothing is sent for transcription
+        await transcriber.cancel()
+        return ""
+    return await transcriber.finish()
@@ -0,0 +1,32 @@
+#one long-lived event loop on a daemon thread for blocking callers (the streamlit script, the cli)
+#clients bound to a loop, like the httpx search client, then keep their pooled connections from one turn to the next
+#instead of a new loop and a new, never closed client per asyncio.run
+import asyncio
+import threading
+from typing import Any,Coroutine,Optional
+from lazy import LazyResource
+
+LOOP_THREAD="background-loop"
+
+def _start_loop()->asyncio.AbstractEventLoop:
+    loop=asyncio.new_event_loop()
+    ready=threading.Event()
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        loop.run_forever()
+    threading.Thread(target=run,name=LOOP_THREAD,daemon=True).start()
+    ready.wait()
+    return loop
+
+_loop=LazyResource(_start_loop,"background loop")
+
+def get_loop()->asyncio.AbstractEventLoop:
+    return _loop.get()
+
+#blocks the calling thread until the coroutine finishes on the background loop
+def run_sync(coro:Coroutine[Any,Any,Any],timeout:Optional[float]=None)->Any:
+    if threading.current_thread().name==LOOP_THREAD:
+        coro.close()
+        raise RuntimeError("run_sync would deadlock when called from the background loop")
+    return asyncio.run_coroutine_threadsafe(coro,get_loop()).result(timeout)
@@ -0,0 +1,478 @@
+#offline end-to-end latency benchmark of run_conversation_async
+#gemini, embeddings, serper, pinecone and deepgram are replaced by local fakes with seeded lognormal latencies,
+#every turn is timed per stage and p50/p95/p99 are written as json
+#run with: python bench_pipeline.py [--turns N] [--seed S] [--time-scale F] [--latency llm=900:1800] [--single-call] [--output results.json]
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import hashlib
+import argparse
+import platform
+import threading
+from collections import defaultdict
+from datetime import datetime,timezone
+from typing import Any,Callable,Dict,List,Tuple
+import numpy as np
+import httpx
+import google.generativeai as genai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration,ChatResult
+
+#the fakes need no credentials and nothing may be persisted between runs
+#applied by main() (or a test) before the agent modules are imported, they read these at import
+OFFLINE_ENV={"EMBEDDING_CACHE_PATH":"","SEARCH_CACHE_PATH":"","AUDIO_CACHE":"0"}
+OFFLINE_API_KEY="offline-benchmark"
+
+def offline_environment()->Dict[str,str]:
+    env=dict(OFFLINE_ENV)
+    env["GOOGLE_API_KEY"]=os.environ.get("GOOGLE_API_KEY") or OFFLINE_API_KEY
+    return env
+
+#latency of each service in milliseconds as (median, p95)
+SERVICE_LATENCY={
+    "llm":(900,2200),
+    "embedding":(120,350),
+    "search":(450,1300),
+    "vector":(70,220),
+    "tts":(280,700)
+}
+
+STAGES=["classification","search","retrieval","generation","persistence","tts","turn"]
+
+#(topic, transcript) pairs shaped like what the voice front end hands over
+TRANSCRIPTS=[
+    ("career","should I take a summer internship or focus on my final year project"),
+    ("career","I got two internship offers, one at a startup and one at a big company, which one is better"),
+    ("career","how do I prepare for software engineering interviews in three months"),
+    ("career","is it worth doing an unpaid internship for the experience"),
+    ("education","should I do a masters right after my bachelors or work first"),
+    ("education","how can I get better grades in my data structures course"),
+    ("education","what is a good topic for my final year project in machine learning"),
+    ("technical","should I learn rust or go for backend development"),
+    ("technical","how do I make my python web scraper faster"),
+    ("technical","what database should I use for a small mobile app"),
+    ("general","I feel stuck and do not know what to do next"),
+    ("general","how do I stay motivated when working on long projects")
+]
+
+class LatencyModel:
+    #lognormal with the given median and 95th percentile, scaled by time_scale
+    def __init__(self,name:str,median_ms:float,p95_ms:float,seed:int,time_scale:float=1.0):
+        self.name=name
+        self.median_ms=median_ms
+        self.p95_ms=p95_ms
+        self.mu=math.log(median_ms/1000*time_scale) if median_ms>0 and time_scale>0 else None
+        self.sigma=math.log(p95_ms/median_ms)/1.645 if median_ms>0 and p95_ms>median_ms else 0.0
+        #one generator per service, so adding calls to one service does not shift the others
+        self._rng=random.Random(f"{seed}:{name}")
+        self._lock=threading.Lock()
+
+    def sample(self)->float:
+        if self.mu is None:
+            return 0.0
+        with self._lock:
+            return self._rng.lognormvariate(self.mu,self.sigma)
+
+    def sleep(self)->None:
+        time.sleep(self.sample())
+
+    async def asleep(self)->None:
+        await asyncio.sleep(self.sample())
+
+def _digest(text:str)->int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8],"big")
+
+#canned payloads
+
+LLM_RESPONSES={
+    "planner":(
+        "ANALYSIS STEPS:\n1. List what you want to learn this year and what each option teaches.\n"
+        "2. Compare the time each path needs against your course load.\n3. Talk to two people who took each path.\n\n"
+        "RECOMMENDATION:\nPick the option that closes your biggest skill gap and set a review date in six weeks."
+    ),
+    "realist":(
+        "Current listings show competition is high and most roles ask for prior project work. "
+        "Unpaid or short placements rarely convert into offers, so weigh the cost against what you will actually ship. "
+        "A focused project with measurable results is often the stronger signal."
+    ),
+    "optimist":(
+        "This is a great moment to choose! Either path can open doors, and the effort you put in now compounds. "
+        "Pick the one that excites you and you will learn faster than you expect!"
+    ),
+    "classifier":"career"
+}
+#the single-call reply answers as every agent at once
+LLM_RESPONSES["ensemble"]=json.dumps({"topic":"career",**{agent:LLM_RESPONSES[agent] for agent in ("optimist","realist","planner")}})
+
+#which canned answer a prompt gets, matched on text only that agent's prompt contains
+#the single-call prompt quotes every agent's instructions, so it is matched first
+PROMPT_MARKERS=[
+    ("answers of several advisors","ensemble"),
+    ("expert planner","planner"),
+    ("pragmatic advisor","realist"),
+    ("enthusiastic and supportive","optimist"),
+    ("Classify as one of","classifier")
+]
+
+class FakeGemini(BaseChatModel):
+    latency:Any
+
+    @property
+    def _llm_type(self)->str:
+        return "fake-gemini"
+
+    def _respond(self,messages)->ChatResult:
+        prompt="\n".join(str(message.content) for message in messages)
+        role=next((role for marker,role in PROMPT_MARKERS if marker in prompt),"planner")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=LLM_RESPONSES[role]))])
+
+    def _generate(self,messages,stop=None,run_manager=None,**kwargs)->ChatResult:
+        self.latency.sleep()
+        return self._respond(messages)
+
+    async def _agenerate(self,messages,stop=None,run_manager=None,**kwargs)->ChatResult:
+        await self.latency.asleep()
+        return self._respond(messages)
+
+class FakeEmbeddings:
+    #stands in for genai.embed_content(_async); vectors are fixed per text
+    def __init__(self,latency:LatencyModel,dimension:int):
+        self.latency=latency
+        self.dimension=dimension
+
+    def vector(self,text:str)->List[float]:
+        values=np.random.default_rng(_digest(text)).standard_normal(self.dimension)
+        return (values/np.linalg.norm(values)).tolist()
+
+    def _result(self,content)->Dict[str,Any]:
+        if isinstance(content,list):
+            return {"embedding":[self.vector(text) for text in content]}
+        return {"embedding":self.vector(content)}
+
+    def embed_content(self,model:str,content,**kwargs)->Dict[str,Any]:
+        self.latency.sleep()
+        return self._result(content)
+
+    async def embed_content_async(self,model:str,content,**kwargs)->Dict[str,Any]:
+        await self.latency.asleep()
+        return self._result(content)
+
+def serper_payload(query:str,count:int=8)->Dict[str,Any]:
+    key=_digest(query)
+    return {
+        "searchParameters":{"q":query,"type":"search","engine":"google"},
+        "organic":[{
+            "title":f"{query.title()} - guide {index+1}",
+            "link":f"https://example.com/{(key+index)%100000}",
+            "snippet":f"Result {index+1} for {query}: salaries, timelines and what employers look for in 2024.",
+            "position":index+1
+        } for index in range(count)]
+    }
+
+class _FakeResponse:
+    def __init__(self,payload:Dict[str,Any]):
+        self.payload=payload
+        self.status_code=200
+
+    def raise_for_status(self)->None:
+        pass
+
+    def json(self)->Dict[str,Any]:
+        return self.payload
+
+class FakeSerperSession:
+    #the requests.Session used by websearch.fetch_organic
+    def __init__(self,latency:LatencyModel):
+        self.latency=latency
+
+    def post(self,url:str,json:Dict[str,Any],timeout=None)->_FakeResponse:
+        self.latency.sleep()
+        return _FakeResponse(serper_payload(json["q"]))
+
+def serper_async_client(latency:LatencyModel)->httpx.AsyncClient:
+    async def handler(request:httpx.Request)->httpx.Response:
+        await latency.asleep()
+        return httpx.Response(200,json=serper_payload(json.loads(request.content)["q"]))
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+def fake_vector_store(latency:LatencyModel):
+    from vector_store import LocalBackend,VectorBackend
+    class FakePinecone(VectorBackend):
+        #pinecone round trips in front of the local store, which already answers with pinecone-shaped matches
+        def __init__(self):
+            self.store=LocalBackend()
+
+        def upsert(self,vectors):
+            latency.sleep()
+            self.store.upsert(vectors)
+
+        def query(self,vector,top_k,filter=None):
+            latency.sleep()
+            return self.store.query(vector,top_k,filter)
+
+        def query_by_agent(self,vector,top_k,agent_types):
+            #the per-agent queries go out in parallel, so one round trip covers them
+            latency.sleep()
+            return self.store.query_by_agent(vector,top_k,agent_types)
+
+        def delete(self,ids):
+            latency.sleep()
+            self.store.delete(ids)
+
+        def clear(self):
+            self.store.clear()
+
+        def __len__(self):
+            return len(self.store)
+    return FakePinecone()
+
+def fake_synthesizer(latency:LatencyModel,sample_rate:int=24000):
+    async def synthesize(text:str,agent:str)->bytes:
+        await latency.asleep()
+        #about 15 characters per second of 16-bit speech
+        return bytes(int(len(text)/15*sample_rate)*2)
+    return synthesize
+
+#stage timing
+
+class StageRecorder:
+    #intervals per stage; overlapping calls in one turn count once, so a stage's time is the wall time it was busy
+    def __init__(self):
+        self._lock=threading.Lock()
+        self._intervals:Dict[str,List[Tuple[float,float]]]=defaultdict(list)
+
+    def record(self,stage:str,start:float,end:float)->None:
+        with self._lock:
+            self._intervals[stage].append((start,end))
+
+    def take(self)->Dict[str,float]:
+        with self._lock:
+            intervals,self._intervals=self._intervals,defaultdict(list)
+        return {stage:_union_ms(spans) for stage,spans in intervals.items()}
+
+def _union_ms(spans:List[Tuple[float,float]])->float:
+    total=0.0
+    current_start,current_end=None,None
+    for start,end in sorted(spans):
+        if current_end is None or start>current_end:
+            if current_end is not None:
+                total+=current_end-current_start
+            current_start,current_end=start,end
+        else:
+            current_end=max(current_end,end)
+    if current_end is not None:
+        total+=current_end-current_start
+    return total*1000
+
+def timed_async(recorder:StageRecorder,stage:str,func:Callable)->Callable:
+    async def run(*args,**kwargs):
+        start=time.perf_counter()
+        try:
+            return await func(*args,**kwargs)
+        finally:
+            recorder.record(stage,start,time.perf_counter())
+    return run
+
+def timed(recorder:StageRecorder,stage:str,func:Callable)->Callable:
+    def run(*args,**kwargs):
+        start=time.perf_counter()
+        try:
+            return func(*args,**kwargs)
+        finally:
+            recorder.record(stage,start,time.perf_counter())
+    return run
+
+#returns app and a callable that puts every patched service back
+def install_fakes(latency:Dict[str,LatencyModel],recorder:StageRecorder)->Tuple[Any,Callable[[],None]]:
+    #the fakes go in before app is imported, the graph binds its node functions at import
+    import memory
+    import memory_store
+    import embeddings
+    import websearch
+    import research
+    import topic_classifier
+    import optimistic
+    import realistic
+    import planner
+    import ensemble
+
+    undo=[]
+    def patch(target,name,value):
+        original=getattr(target,name)
+        setattr(target,name,value)
+        undo.append(lambda:setattr(target,name,original))
+    def replace(resource,value):
+        original=resource.get() if resource.initialized else None
+        was_set=resource.initialized
+        resource.set(value)
+        undo.append(lambda:resource.set(original) if was_set else resource.reset())
+
+    fake_embeddings=FakeEmbeddings(latency["embedding"],memory_store.EMBEDDING_DIM)
+    patch(genai,"embed_content",fake_embeddings.embed_content)
+    patch(genai,"embed_content_async",fake_embeddings.embed_content_async)
+    #genai.configure is process-wide, so the fakes mark it done instead of configuring the offline key
+    replace(embeddings.genai_client,True)
+    replace(memory._llm,FakeGemini(latency=latency["llm"]))
+    replace(memory_store._backend,fake_vector_store(latency["vector"]))
+    patch(websearch,"_session",FakeSerperSession(latency["search"]))
+    clients={}
+    def get_async_client():
+        loop=asyncio.get_running_loop()
+        if loop not in clients:
+            clients[loop]=serper_async_client(latency["search"])
+        return clients[loop]
+    patch(websearch,"get_async_client",get_async_client)
+
+    patch(topic_classifier,"classify_topic_async",timed_async(recorder,"classification",topic_classifier.classify_topic_async))
+    patch(research,"fetch_organic_async",timed_async(recorder,"search",research.fetch_organic_async))
+    patch(research,"aprefetch_relevant_history",timed_async(recorder,"retrieval",research.aprefetch_relevant_history))
+    patch(optimistic,"optimistic_node_async",timed_async(recorder,"generation",optimistic.optimistic_node_async))
+    patch(realistic,"realistic_node_async",timed_async(recorder,"generation",realistic.realistic_node_async))
+    patch(planner,"planner_node_async",timed_async(recorder,"generation",planner.planner_node_async))
+    patch(ensemble,"ensemble_node_async",timed_async(recorder,"generation",ensemble.ensemble_node_async))
+    patch(memory_store.memory_writer,"write_batch",timed(recorder,"persistence",memory_store.memory_writer.write_batch))
+
+    import app
+    #per-call info logs would swamp the output and cost time inside the measured stages
+    root=logging.getLogger()
+    level=root.level
+    root.setLevel(logging.WARNING)
+    undo.append(lambda:root.setLevel(level))
+
+    def uninstall():
+        while undo:
+            undo.pop()()
+    return app,uninstall
+
+def clear_caches()->None:
+    import embeddings
+    import websearch
+    import topic_classifier
+    embeddings.embedding_cache.clear()
+    websearch.search_cache.clear()
+    topic_classifier.topic_cache.clear()
+
+async def run_turn(app,user_input:str,session_id:str,synthesize,recorder:StageRecorder)->Dict[str,float]:
+    import memory_store
+    from streaming import SpeechStreamer,speak_responses
+    start=time.perf_counter()
+    final_state=await app.run_conversation_async(user_input,session_id=session_id)
+    recorder.record("turn",start,time.perf_counter())
+    speech=[(agent,getattr(final_state,f"{agent}_response")) for agent in app.AGENT_NODES]
+    streamer=SpeechStreamer(synthesize=synthesize,play=lambda audio:None)
+    first_audio=await speak_responses([(agent,text) for agent,text in speech if text],streamer)
+    #persistence is write-behind; waiting here keeps each turn's writes in its own sample
+    await asyncio.to_thread(memory_store.flush_memories)
+    timings=recorder.take()
+    timings["tts"]=(first_audio or 0.0)*1000
+    return timings
+
+def percentile_summary(samples:List[float])->Dict[str,float]:
+    values=np.asarray(samples,dtype=np.float64)
+    return {
+        "count":int(values.size),
+        "mean_ms":round(float(values.mean()),3),
+        "p50_ms":round(float(np.percentile(values,50)),3),
+        "p95_ms":round(float(np.percentile(values,95)),3),
+        "p99_ms":round(float(np.percentile(values,99)),3),
+        "max_ms":round(float(values.max()),3)
+    }
+
+async def run_benchmark(args,latency:Dict[str,LatencyModel])->Dict[str,Any]:
+    recorder=StageRecorder()
+    app,_=install_fakes(latency,recorder)
+    synthesize=fake_synthesizer(latency["tts"])
+    rng=random.Random(args.seed)
+    order=[rng.choice(TRANSCRIPTS) for _ in range(args.warmup+args.turns)]
+    samples:Dict[str,List[float]]=defaultdict(list)
+    turns=[]
+    for index,(topic,transcript) in enumerate(order):
+        if not args.keep_caches:
+            clear_caches()
+        #a few turns per session so the history the prompts carry grows like a real conversation
+        session_id=f"bench-{index//args.turns_per_session}"
+        timings=await run_turn(app,transcript,session_id,synthesize,recorder)
+        if index<args.warmup:
+            continue
+        for stage in STAGES:
+            samples[stage].append(timings.get(stage,0.0))
+        turns.append({"topic":topic,"transcript":transcript,"session_id":session_id,
+                      "stages":{stage:round(value,3) for stage,value in timings.items()}})
+    result={
+        "benchmark":"pipeline",
+        "timestamp":datetime.now(timezone.utc).isoformat(),
+        "python":platform.python_version(),
+        "config":{
+            "turns":args.turns,
+            "warmup":args.warmup,
+            "seed":args.seed,
+            "time_scale":args.time_scale,
+            "keep_caches":args.keep_caches,
+            "turns_per_session":args.turns_per_session,
+            "generation_mode":os.environ.get("GENERATION_MODE","per_agent"),
+            "latency_ms":{name:{"median":model.median_ms,"p95":model.p95_ms} for name,model in latency.items()}
+        },
+        "stages":{stage:percentile_summary(samples[stage]) for stage in STAGES}
+    }
+    if args.per_turn:
+        result["turns"]=turns
+    return result
+
+def parse_latency(values:List[str])->Dict[str,Tuple[float,float]]:
+    latency=dict(SERVICE_LATENCY)
+    for value in values:
+        try:
+            name,spec=value.split("=",1)
+            median,p95=(float(part) for part in spec.split(":",1))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected service=median:p95 in milliseconds, got {value!r}")
+        if name not in latency:
+            raise argparse.ArgumentTypeError(f"unknown service {name!r}, expected one of {', '.join(latency)}")
+        latency[name]=(median,p95)
+    return latency
+
+def print_table(result:Dict[str,Any])->None:
+    print("stage".ljust(16)+"".join(column.rjust(10) for column in ("p50","p95","p99","mean"))+"   (milliseconds)")
+    for stage,summary in result["stages"].items():
+        print(stage.ljust(16)+"".join(f"{summary[key]:10.1f}" for key in ("p50_ms","p95_ms","p99_ms","mean_ms")))
+
+def main():
+    parser=argparse.ArgumentParser(description="offline per-stage latency of run_conversation_async against seeded fakes")
+    parser.add_argument("--turns",type=int,default=30)
+    parser.add_argument("--warmup",type=int,default=2,help="turns run first and left out of the results")
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--time-scale",type=float,default=1.0,help="multiplies every fake latency, 0 measures only local overhead")
+    parser.add_argument("--latency",action="append",default=[],metavar="SERVICE=MEDIAN:P95",
+                        help=f"override a service latency in ms, services: {', '.join(SERVICE_LATENCY)}")
+    parser.add_argument("--turns-per-session",type=int,default=4)
+    parser.add_argument("--keep-caches",action="store_true",help="keep search, embedding and topic caches between turns")
+    parser.add_argument("--single-call",action="store_true",help="generate every agent's answer in one llm call (GENERATION_MODE=single_call)")
+    parser.add_argument("--per-turn",action="store_true",help="include every turn's timings in the output")
+    parser.add_argument("--output",help="write the json here instead of stdout and print a summary table")
+    args=parser.parse_args()
+    os.environ.update(offline_environment())
+    if args.single_call:
+        #read when the agents are imported, which install_fakes does after this
+        os.environ["GENERATION_MODE"]="single_call"
+    try:
+        latency_ms=parse_latency(args.latency)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    latency={name:LatencyModel(name,median,p95,args.seed,args.time_scale) for name,(median,p95) in latency_ms.items()}
+    result=asyncio.run(run_benchmark(args,latency))
+    if args.output:
+        with open(args.output,"w") as f:
+            json.dump(result,f,indent=2)
+        print_table(result)
+    else:
+        json.dump(result,sys.stdout,indent=2)
+        print()
+
+if __name__=="__main__":
+    main()
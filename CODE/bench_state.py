@@ -0,0 +1,41 @@
+#micro-benchmark of per-hop state handling against conversation history length
+#run with: python bench_state.py [--repeat N]
+import argparse
+import timeit
+from state import AgentState,ConversationEntry,agent_update,append_history,merge_buffer
+
+HISTORY_LENGTHS=[0,10,100,1000,5000]
+
+def build_channels(length:int):
+    history=[ConversationEntry(agent="planner",message=f"message {i} "*20,confidence=0.5) for i in range(length)]
+    state=AgentState(user_input="should I do an internship?",topic_type="career",conversation_history=history)
+    return state,dict(state)
+
+def bench(length:int,repeat:int):
+    state,channels=build_channels(length)
+    delta=agent_update("realist","Market is tight, compare the offers.",0.7)
+    cases={
+        #what every node used to do before returning
+        "full copy":lambda:AgentState(**state.model_dump()),
+        #the graph building a node's input from its channels
+        "node input":lambda:AgentState(**channels),
+        #applying a node's partial update through the reducers
+        "delta merge":lambda:(append_history(channels["conversation_history"],delta["conversation_history"]),
+                              merge_buffer(channels["response_buffer"],delta["response_buffer"])),
+        #extract_final_state on the graph output
+        "final state":lambda:AgentState.model_construct(**channels)
+    }
+    return {name:min(timeit.repeat(case,number=repeat,repeat=3))/repeat*1e6 for name,case in cases.items()}
+
+def main():
+    parser=argparse.ArgumentParser(description="per-hop AgentState overhead by history length")
+    parser.add_argument("--repeat",type=int,default=200)
+    args=parser.parse_args()
+    rows=[(length,bench(length,args.repeat)) for length in HISTORY_LENGTHS]
+    names=list(rows[0][1])
+    print("history".rjust(8)+"".join(name.rjust(14) for name in names)+"   (microseconds per call)")
+    for length,timings in rows:
+        print(str(length).rjust(8)+"".join(f"{timings[name]:14.1f}" for name in names))
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,179 @@
+#in-memory TTL/LRU cache with an optional sqlite tier that survives restarts
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any,Callable,Dict,Optional,Tuple
+
+class DiskStore:
+    #key -> blob table; values carry their own expiry so stale rows are skipped on read
+    def __init__(self,path:str,table:str="cache",max_rows:int=10000):
+        self.path=path
+        self.table=table
+        self.max_rows=max_rows
+        self._writes=0
+        self._lock=threading.Lock()
+        self._conn=sqlite3.connect(path,check_same_thread=False)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)")
+        self._conn.commit()
+
+    def get(self,key:str)->Optional[Tuple[bytes,float]]:
+        with self._lock:
+            row=self._conn.execute(f"SELECT value, expires FROM {self.table} WHERE key=?",(key,)).fetchone()
+        if row is None:
+            return None
+        value,expires=row
+        if expires<time.time():
+            self.delete(key)
+            return None
+        return bytes(value),expires
+
+    def set(self,key:str,value:bytes,expires:float)->None:
+        with self._lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)",(key,value,expires))
+            self._writes+=1
+            #rows expire in write order, so trimming the soonest-expiring rows drops the oldest writes
+            if self._writes%64==0:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,)
+                )
+            self._conn.commit()
+
+    def delete(self,key:str)->None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key=?",(key,))
+            self._conn.commit()
+
+    def clear(self)->None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def purge_expired(self)->None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires<?",(time.time(),))
+            self._conn.commit()
+
+def _encode_text(value:Any)->bytes:
+    return str(value).encode("utf-8")
+
+def _decode_text(value:bytes)->Any:
+    return value.decode("utf-8")
+
+class TTLCache:
+    def __init__(self,maxsize:int=512,ttl:float=3600.0,path:Optional[str]=None,table:str="cache",disk_maxsize:Optional[int]=None,
+                 serialize:Callable[[Any],bytes]=_encode_text,deserialize:Callable[[bytes],Any]=_decode_text):
+        self.maxsize=maxsize
+        self.ttl=ttl
+        self.serialize=serialize
+        self.deserialize=deserialize
+        self._entries:"OrderedDict[str,tuple]"=OrderedDict()
+        self._lock=threading.Lock()
+        self.store=DiskStore(path,table,disk_maxsize or maxsize*10) if path else None
+        if self.store:
+            self.store.purge_expired()
+        self.hits=0
+        self.disk_hits=0
+        self.misses=0
+        self.evictions=0
+
+    def _remember(self,key:str,value:Any,expires:float)->None:
+        #caller holds the lock
+        self._entries[key]=(value,expires)
+        self._entries.move_to_end(key)
+        while len(self._entries)>self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions+=1
+
+    def _lookup(self,key:str)->Tuple[bool,Any]:
+        now=time.time()
+        with self._lock:
+            entry=self._entries.get(key)
+            if entry is not None:
+                value,expires=entry
+                if expires>=now:
+                    self._entries.move_to_end(key)
+                    self.hits+=1
+                    return True,value
+                del self._entries[key]
+        return False,None
+
+    def _load(self,key:str)->Optional[Any]:
+        if self.store:
+            try:
+                raw=self.store.get(key)
+            except Exception as e:
+                print(f"Cache read error: {str(e)}")
+                raw=None
+            if raw is not None:
+                value=self.deserialize(raw[0])
+                with self._lock:
+                    self._remember(key,value,raw[1])
+                    self.disk_hits+=1
+                return value
+        with self._lock:
+            self.misses+=1
+        return None
+
+    def get(self,key:str)->Optional[Any]:
+        found,value=self._lookup(key)
+        return value if found else self._load(key)
+
+    def _persist(self,key:str,value:Any,expires:float)->None:
+        try:
+            self.store.set(key,self.serialize(value),expires)
+        except Exception as e:
+            print(f"Cache write error: {str(e)}")
+
+    def set(self,key:str,value:Any)->None:
+        expires=time.time()+self.ttl
+        with self._lock:
+            self._remember(key,value,expires)
+        if self.store:
+            self._persist(key,value,expires)
+
+    #for coroutines: memory hits are answered inline, the sqlite tier runs on a worker thread instead of the event loop
+    async def aget(self,key:str)->Optional[Any]:
+        found,value=self._lookup(key)
+        if found:
+            return value
+        if not self.store:
+            return self._load(key)
+        return await asyncio.to_thread(self._load,key)
+
+    async def aset(self,key:str,value:Any)->None:
+        expires=time.time()+self.ttl
+        with self._lock:
+            self._remember(key,value,expires)
+        if self.store:
+            await asyncio.to_thread(self._persist,key,value,expires)
+
+    def delete(self,key:str)->None:
+        with self._lock:
+            self._entries.pop(key,None)
+        if self.store:
+            self.store.delete(key)
+
+    def clear(self)->None:
+        with self._lock:
+            self._entries.clear()
+        if self.store:
+            self.store.clear()
+
+    def __len__(self)->int:
+        return len(self._entries)
+
+    def stats(self)->Dict[str,Any]:
+        with self._lock:
+            lookups=self.hits+self.disk_hits+self.misses
+            return {
+                "size":len(self._entries),
+                "maxsize":self.maxsize,
+                "hits":self.hits,
+                "disk_hits":self.disk_hits,
+                "misses":self.misses,
+                "evictions":self.evictions,
+                "hit_rate":(self.hits+self.disk_hits)/lookups if lookups else 0.0
+            }
@@ -0,0 +1,128 @@
+#token-budgeted context assembly for the agent prompts
+#each source gets a per-agent budget so prompt size stays flat however long the session or search results get
+import os
+import re
+import logging
+from typing import Any,Dict,List,Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+logger=logging.getLogger(__name__)
+
+#gemini has no local tokenizer; four characters per token is close enough for budgeting english text
+CHARS_PER_TOKEN=4
+
+DEFAULT_BUDGETS={
+    "web_context":int(os.getenv("CONTEXT_WEB_TOKENS","600")),
+    "relevant_history":int(os.getenv("CONTEXT_MEMORY_TOKENS","300")),
+    "history":int(os.getenv("CONTEXT_HISTORY_TOKENS","500"))
+}
+
+#the optimist prompt has no web section, the realist leans on current data, the planner on the conversation
+AGENT_BUDGETS={
+    "optimist":{"web_context":0},
+    "realist":{"web_context":800,"history":300},
+    "planner":{"history":700}
+}
+
+#snippets sharing this much of their word trigrams count as the same snippet
+DEDUPE_THRESHOLD=float(os.getenv("CONTEXT_DEDUPE_THRESHOLD","0.8"))
+
+_WORD_RE=re.compile(r"\w+")
+
+def count_tokens(text:str)->int:
+    return (len(text)+CHARS_PER_TOKEN-1)//CHARS_PER_TOKEN if text else 0
+
+def get_budget(agent_type:str,source:str)->int:
+    return AGENT_BUDGETS.get(agent_type,{}).get(source,DEFAULT_BUDGETS[source])
+
+def truncate_tokens(text:str,max_tokens:int,keep_tail:bool=False)->str:
+    limit=max_tokens*CHARS_PER_TOKEN
+    if len(text)<=limit:
+        return text
+    if limit<=0:
+        return ""
+    if keep_tail:
+        clipped=text[-limit:]
+        return "..."+clipped.split(" ",1)[-1]
+    return text[:limit].rsplit(" ",1)[0]+"..."
+
+def _shingles(text:str)->set:
+    words=_WORD_RE.findall(text.lower())
+    if len(words)<3:
+        return {" ".join(words)}
+    return {" ".join(words[i:i+3]) for i in range(len(words)-2)}
+
+def is_near_duplicate(shingles:set,seen:List[set],threshold:float=DEDUPE_THRESHOLD)->bool:
+    for other in seen:
+        union=len(shingles|other)
+        if union and len(shingles&other)/union>=threshold:
+            return True
+    return False
+
+#walks texts in order until the budget is spent; the first one is clipped rather than dropped
+def _fit(texts:List[str],max_tokens:int)->List[Tuple[int,str]]:
+    picked=[]
+    seen=[]
+    used=0
+    for index,text in enumerate(texts):
+        text=text.strip()
+        if not text:
+            continue
+        shingles=_shingles(text)
+        if is_near_duplicate(shingles,seen):
+            continue
+        tokens=count_tokens(text)
+        if used+tokens>max_tokens:
+            if not picked and max_tokens>0:
+                picked.append((index,truncate_tokens(text,max_tokens)))
+            break
+        seen.append(shingles)
+        picked.append((index,text))
+        used+=tokens
+    return picked
+
+def select_snippets(snippets:List[str],max_tokens:int)->List[str]:
+    return [text for _,text in _fit(snippets,max_tokens)]
+
+#most relevant first, near-duplicates and whatever does not fit are dropped
+def select_memories(memories:List[Dict[str,Any]],max_tokens:int)->List[Dict[str,Any]]:
+    ranked=sorted(memories,key=lambda memory:memory.get("relevance_score",0.0),reverse=True)
+    return [{**ranked[index],"text":text} for index,text in _fit([memory.get("text","") for memory in ranked],max_tokens)]
+
+#newest lines are kept, the oldest part of the history goes first
+def fit_history(history:str,max_tokens:int)->str:
+    if count_tokens(history)<=max_tokens:
+        return history
+    kept=[]
+    used=0
+    for line in reversed(history.split("\n")):
+        tokens=count_tokens(line)+1
+        if used+tokens>max_tokens:
+            if not kept:
+                kept.append(truncate_tokens(line,max_tokens,keep_tail=True))
+            break
+        kept.append(line)
+        used+=tokens
+    return "\n".join(reversed(kept))
+
+def assemble_context(agent_type:str,web_context:str,history:str,relevant_history:str)->Dict[str,str]:
+    web_blocks=select_snippets((web_context or "").split("\n\n"),get_budget(agent_type,"web_context"))
+    return {
+        "web_context":"\n\n".join(web_blocks),
+        "history":fit_history(history or "",get_budget(agent_type,"history")),
+        "relevant_history":truncate_tokens(relevant_history or "",get_budget(agent_type,"relevant_history"))
+    }
+
+#budgeted prompt inputs for an agent and the token count of the rendered prompt
+def build_prompt_inputs(agent_type:str,prompt,user_input:str,web_context:str,memory_vars:Dict[str,Any])->Tuple[Dict[str,str],int]:
+    inputs=assemble_context(
+        agent_type,
+        web_context,
+        memory_vars.get("history",""),
+        memory_vars.get("relevant_history","")
+    )
+    inputs["user_input"]=user_input
+    tokens=count_tokens(prompt.format(**inputs))
+    logger.debug(f"{agent_type} prompt: {tokens} tokens")
+    return inputs,tokens
@@ -0,0 +1,101 @@
+#per-turn latency budget
+#a turn sets one absolute deadline in a contextvar; the research stage, the agents and every external read take their
+#timeout from what is left of it, so a slow service costs its own slice instead of the whole turn
+import os
+import time
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from typing import Any,Awaitable,Callable,Iterator,Optional
+from dotenv import load_dotenv
+from telemetry import metrics
+
+load_dotenv()
+
+#whole turn, from the user's words to the last agent's answer; 0 turns the deadline off
+TURN_DEADLINE_MS=float(os.getenv("TURN_DEADLINE_MS","12000"))
+#longest share of the turn a single stage may use before it is skipped
+SEARCH_SLICE_MS=float(os.getenv("SEARCH_SLICE_MS","3000"))
+RETRIEVAL_SLICE_MS=float(os.getenv("RETRIEVAL_SLICE_MS","1500"))
+CLASSIFY_SLICE_MS=float(os.getenv("CLASSIFY_SLICE_MS","1500"))
+#held back from the agents for formatting the answer and starting speech
+AGENT_RESERVE_MS=float(os.getenv("AGENT_RESERVE_MS","250"))
+#a clip that takes longer than this is skipped rather than holding up the next sentence
+TTS_TIMEOUT_MS=float(os.getenv("TTS_TIMEOUT_MS","5000"))
+#a second, identical request is sent when the first has not answered after this long; 0 disables hedging
+SEARCH_HEDGE_MS=float(os.getenv("SEARCH_HEDGE_MS","0"))
+RETRIEVAL_HEDGE_MS=float(os.getenv("RETRIEVAL_HEDGE_MS","0"))
+
+DEADLINE_MISSES=metrics.counter("deadline_misses_total","Stages cut short by the turn deadline",("stage",))
+HEDGES=metrics.counter("hedged_requests_total","Hedged reads and which attempt answered",("operation","winner"))
+
+#absolute time.monotonic() value, None outside a turn or with the deadline off
+_deadline:contextvars.ContextVar[Optional[float]]=contextvars.ContextVar("turn_deadline",default=None)
+
+@contextmanager
+def turn_deadline(budget_ms:float=TURN_DEADLINE_MS)->Iterator[Optional[float]]:
+    #a nested turn keeps the earlier of the two deadlines
+    deadline=time.monotonic()+budget_ms/1000 if budget_ms>0 else None
+    outer=_deadline.get()
+    if outer is not None and (deadline is None or outer<deadline):
+        deadline=outer
+    token=_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+def remaining()->Optional[float]:
+    deadline=_deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0,deadline-time.monotonic())
+
+#seconds a stage may take: what is left of the turn minus the reserve, capped by the stage's own slice
+def time_left(slice_ms:float=0,reserve_ms:float=0)->Optional[float]:
+    left=remaining()
+    if left is not None:
+        left=max(0.0,left-reserve_ms/1000)
+    if slice_ms>0:
+        left=slice_ms/1000 if left is None else min(left,slice_ms/1000)
+    return left
+
+def expired()->bool:
+    left=remaining()
+    return left is not None and left<=0
+
+#raises TimeoutError once the stage runs past its time; the caller decides what to do without it
+async def within(awaitable:Awaitable[Any],timeout:Optional[float],stage:str)->Any:
+    try:
+        return await asyncio.wait_for(awaitable,timeout)
+    except asyncio.TimeoutError:
+        DEADLINE_MISSES.inc(stage=stage)
+        #the builtin type, which asyncio.TimeoutError only became in python 3.11
+        raise TimeoutError(f"{stage} missed the turn deadline") from None
+
+#only for idempotent reads: the slower attempt is cancelled, and a failed attempt leaves the other one to answer
+async def hedged(call:Callable[[],Awaitable[Any]],hedge_after_ms:float,operation:str)->Any:
+    if hedge_after_ms<=0:
+        return await call()
+    first=asyncio.ensure_future(call())
+    attempts=[first]
+    try:
+        done,_=await asyncio.wait(attempts,timeout=hedge_after_ms/1000)
+        if done:
+            return first.result()
+        attempts.append(asyncio.ensure_future(call()))
+        pending=set(attempts)
+        while pending:
+            done,pending=await asyncio.wait(pending,return_when=asyncio.FIRST_COMPLETED)
+            #attempts that finish in the same round come back unordered, a success among them wins
+            for attempt in attempts:
+                if attempt in done and not attempt.cancelled() and attempt.exception() is None:
+                    HEDGES.inc(operation=operation,winner="primary" if attempt is first else "hedge")
+                    return attempt.result()
+        #every attempt failed; the first real error is raised rather than a cancellation
+        HEDGES.inc(operation=operation,winner="none")
+        failed=[attempt for attempt in attempts if not attempt.cancelled()]
+        return (failed or attempts)[0].result()
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
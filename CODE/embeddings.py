@@ -0,0 +1,292 @@
+#content-addressed embedding cache in front of the gemini embedding model
+#vectors are kept as float32 rows in memory and, with EMBEDDING_CACHE_PATH set, in sqlite
+import os
+import time
+import queue
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future,ThreadPoolExecutor,TimeoutError as FutureTimeout
+from typing import Callable,Dict,List,Optional,Tuple
+import numpy as np
+import google.generativeai as genai
+from dotenv import load_dotenv
+from cache import TTLCache
+from lazy import LazyResource
+from telemetry import span,register_cache,metrics
+
+load_dotenv()
+logger=logging.getLogger(__name__)
+
+EMBEDDING_MODEL=os.getenv("EMBEDDING_MODEL","models/embedding-001")
+
+#single-text misses from every session are coalesced into one batched request: the first text waits at most
+#EMBEDDING_BATCH_WINDOW_MS for others, a batch is sent early once EMBEDDING_BATCH_MAX texts are queued; 0 sends each text alone
+EMBEDDING_BATCH_WINDOW_MS=float(os.getenv("EMBEDDING_BATCH_WINDOW_MS","5"))
+EMBEDDING_BATCH_MAX=int(os.getenv("EMBEDDING_BATCH_MAX","64"))
+#batches in flight at once, so collecting the next batch never waits on the previous request
+EMBEDDING_BATCH_WORKERS=int(os.getenv("EMBEDDING_BATCH_WORKERS","4"))
+#how long one caller waits for its vector, queueing included
+EMBEDDING_TIMEOUT=float(os.getenv("EMBEDDING_TIMEOUT","10"))
+
+#the client is configured before the first remote call, not at import
+def _configure_genai()->bool:
+    api_key=os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable is not set")
+    genai.configure(api_key=api_key)
+    return True
+
+genai_client=LazyResource(_configure_genai,"genai")
+
+embedding_cache=TTLCache(
+    maxsize=int(os.getenv("EMBEDDING_CACHE_SIZE","2048")),
+    ttl=float(os.getenv("EMBEDDING_CACHE_TTL",str(30*24*3600))),
+    path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+    table="embeddings",
+    serialize=lambda vector:np.asarray(vector,dtype=np.float32).tobytes(),
+    deserialize=lambda raw:np.frombuffer(raw,dtype=np.float32)
+)
+
+#concurrent misses for the same text wait on the first request instead of embedding again
+_inflight:Dict[str,threading.Event]={}
+_inflight_lock=threading.Lock()
+_inflight_async:Dict[str,asyncio.Future]={}
+
+def embedding_key(text:str,model:str=EMBEDDING_MODEL)->str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+def embedding_cache_stats():
+    return embedding_cache.stats()
+
+register_cache("embedding",embedding_cache_stats)
+
+def _to_row(embedding)->np.ndarray:
+    return np.asarray(embedding,dtype=np.float32)
+
+BATCH_SIZE=metrics.histogram("embedding_batch_size","Texts per coalesced embedding request",buckets=(1,2,4,8,16,32,64,128))
+BATCH_WAIT=metrics.histogram("embedding_batch_wait_seconds","Time a text waits in the coalescer before its request is sent",
+                             buckets=(0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,1.0))
+BATCH_TIMEOUTS=metrics.counter("embedding_timeouts_total","Callers that gave up waiting for a coalesced embedding")
+
+def _embed_batch(texts:List[str])->List[List[float]]:
+    genai_client.get()
+    result=genai.embed_content(model=EMBEDDING_MODEL,content=texts)
+    return result["embedding"]
+
+class EmbeddingBatcher:
+    #callers get a concurrent future, so threads and any event loop share one queue and one set of batches
+    def __init__(self,embed_batch:Callable[[List[str]],List[List[float]]],window:float,max_batch:int,workers:int):
+        self.embed_batch=embed_batch
+        self.window=window
+        self.max_batch=max_batch
+        self.workers=workers
+        self._queue:"queue.Queue[Tuple[str,Future,float]]"=queue.Queue()
+        self._thread:Optional[threading.Thread]=None
+        self._pool:Optional[ThreadPoolExecutor]=None
+        self._lock=threading.Lock()
+        self.batches=0
+        self.texts=0
+        self.timeouts=0
+        self.errors=0
+        self.largest=0
+
+    def _ensure_started(self)->None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._pool=ThreadPoolExecutor(max_workers=self.workers,thread_name_prefix="embedding-batch")
+                    self._thread=threading.Thread(target=self._run,name="embedding-coalescer",daemon=True)
+                    self._thread.start()
+
+    def submit(self,text:str)->Future:
+        self._ensure_started()
+        future:Future=Future()
+        self._queue.put((text,future,time.perf_counter()))
+        return future
+
+    def _collect(self)->List[Tuple[str,Future,float]]:
+        batch=[self._queue.get()]
+        deadline=time.monotonic()+self.window
+        while len(batch)<self.max_batch:
+            remaining=deadline-time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining>0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self)->None:
+        while True:
+            batch=self._collect()
+            self._pool.submit(self._dispatch,batch)
+
+    def _dispatch(self,batch:List[Tuple[str,Future,float]])->None:
+        #callers that timed out meanwhile have cancelled their futures and are left out
+        live=[(text,future,queued) for text,future,queued in batch if future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        texts=list(dict.fromkeys(text for text,_,_ in live))
+        sent=time.perf_counter()
+        for _,_,queued in live:
+            BATCH_WAIT.observe(sent-queued)
+        BATCH_SIZE.observe(len(texts))
+        with self._lock:
+            self.batches+=1
+            self.texts+=len(texts)
+            self.largest=max(self.largest,len(texts))
+        try:
+            with span("gemini.embed",kind="external",service="gemini",operation="embed",texts=len(texts)):
+                result=list(self.embed_batch(texts))
+                if len(result)!=len(texts):
+                    raise ValueError(f"embedding batch returned {len(result)} vectors for {len(texts)} texts")
+            vectors=dict(zip(texts,result))
+        except Exception as e:
+            with self._lock:
+                self.errors+=1
+            for _,future,_ in live:
+                future.set_exception(e)
+            return
+        #every future is settled, one bad entry must not leave the rest waiting for their timeout
+        for text,future,_ in live:
+            try:
+                vector=vectors[text]
+            except KeyError as e:
+                future.set_exception(e)
+                continue
+            future.set_result(vector)
+
+    def _timed_out(self,future:Future,timeout:float)->TimeoutError:
+        future.cancel()
+        with self._lock:
+            self.timeouts+=1
+        BATCH_TIMEOUTS.inc()
+        return TimeoutError(f"embedding not ready after {timeout:g}s")
+
+    def embed(self,text:str,timeout:float=EMBEDDING_TIMEOUT)->List[float]:
+        future=self.submit(text)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            raise self._timed_out(future,timeout)
+
+    async def embed_async(self,text:str,timeout:float=EMBEDDING_TIMEOUT)->List[float]:
+        future=self.submit(text)
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),timeout)
+        except asyncio.TimeoutError:
+            raise self._timed_out(future,timeout)
+
+    def stats(self)->Dict[str,float]:
+        with self._lock:
+            return {
+                "batches":self.batches,
+                "texts":self.texts,
+                "mean_batch_size":self.texts/self.batches if self.batches else 0.0,
+                "largest_batch":self.largest,
+                "queued":self._queue.qsize(),
+                "timeouts":self.timeouts,
+                "errors":self.errors
+            }
+
+embedding_batcher=EmbeddingBatcher(_embed_batch,EMBEDDING_BATCH_WINDOW_MS/1000,EMBEDDING_BATCH_MAX,EMBEDDING_BATCH_WORKERS)
+
+def embedding_batch_stats()->Dict[str,float]:
+    return embedding_batcher.stats()
+
+def _embed_one(text:str)->List[float]:
+    if EMBEDDING_BATCH_WINDOW_MS>0:
+        with span("embedding.coalesce"):
+            return embedding_batcher.embed(text)
+    genai_client.get()
+    with span("gemini.embed",kind="external",service="gemini",operation="embed",texts=1):
+        return genai.embed_content(model=EMBEDDING_MODEL,content=text)["embedding"]
+
+async def _embed_one_async(text:str)->List[float]:
+    if EMBEDDING_BATCH_WINDOW_MS>0:
+        with span("embedding.coalesce"):
+            return await embedding_batcher.embed_async(text)
+    genai_client.get()
+    with span("gemini.embed",kind="external",service="gemini",operation="embed",texts=1):
+        result=await genai.embed_content_async(model=EMBEDDING_MODEL,content=text)
+    return result["embedding"]
+
+def embed_text(text:str)->List[float]:
+    key=embedding_key(text)
+    cached=embedding_cache.get(key)
+    if cached is not None:
+        return cached.tolist()
+    with _inflight_lock:
+        event=_inflight.get(key)
+        owner=event is None
+        if owner:
+            event=_inflight[key]=threading.Event()
+    if not owner:
+        event.wait()
+        cached=embedding_cache.get(key)
+        if cached is not None:
+            return cached.tolist()
+    try:
+        row=_to_row(_embed_one(text))
+        embedding_cache.set(key,row)
+        return row.tolist()
+    finally:
+        if owner:
+            with _inflight_lock:
+                _inflight.pop(key,None)
+            event.set()
+
+#one remote call for every text that is not cached yet
+def embed_texts(texts:List[str])->List[List[float]]:
+    keys=[embedding_key(text) for text in texts]
+    rows:Dict[str,np.ndarray]={}
+    missing:Dict[str,str]={}
+    for key,text in zip(keys,texts):
+        cached=embedding_cache.get(key)
+        if cached is not None:
+            rows[key]=cached
+        else:
+            missing.setdefault(key,text)
+    if missing:
+        genai_client.get()
+        with span("gemini.embed",kind="external",service="gemini",operation="embed",texts=len(missing)):
+            result=genai.embed_content(model=EMBEDDING_MODEL,content=list(missing.values()))
+        for key,embedding in zip(missing.keys(),result["embedding"]):
+            rows[key]=_to_row(embedding)
+            embedding_cache.set(key,rows[key])
+    return [rows[key].tolist() for key in keys]
+
+async def embed_text_async(text:str)->List[float]:
+    key=embedding_key(text)
+    cached=await embedding_cache.aget(key)
+    if cached is not None:
+        return cached.tolist()
+    loop=asyncio.get_running_loop()
+    pending=_inflight_async.get(key)
+    if pending is not None and pending.get_loop() is loop:
+        try:
+            row=await asyncio.shield(pending)
+            return row.tolist()
+        except asyncio.CancelledError:
+            #only fall through when the owning request was cancelled, not this caller
+            if not pending.cancelled():
+                raise
+    pending=loop.create_future()
+    _inflight_async[key]=pending
+    try:
+        row=_to_row(await _embed_one_async(text))
+        #waiters get the row before the disk write
+        pending.set_result(row)
+        await embedding_cache.aset(key,row)
+        return row.tolist()
+    except Exception as e:
+        pending.set_exception(e)
+        #nobody else may be waiting, mark the exception as retrieved
+        pending.exception()
+        raise
+    finally:
+        if not pending.done():
+            pending.cancel()
+        if _inflight_async.get(key) is pending:
+            del _inflight_async[key]
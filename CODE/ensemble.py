@@ -0,0 +1,183 @@
+#single-call generation mode
+#with GENERATION_MODE=single_call one structured llm call answers as every pending agent and classifies the topic;
+#agents the reply leaves out, or all of them if it cannot be parsed, still get their own call afterwards
+import os
+import re
+import json
+import asyncio
+import logging
+import traceback
+from typing import Any,Dict,List,Optional,Tuple
+from dotenv import load_dotenv
+from pydantic import BaseModel,ValidationError
+from langchain.schema import HumanMessage
+from memory import get_llm,get_agent_memory,build_memory_inputs,save_to_memory,asave_to_memory,AGENT_TYPES
+from session_memory import session_store
+from prompts import ENSEMBLE_PROMPT,OPTIMIST_PROMPT,REALIST_PROMPT,PLANNER_PROMPT
+from context import assemble_context,fit_history,get_budget,count_tokens
+from state import AgentState,agent_update,merge_buffer,append_history
+from topic_classifier import remember_topic,topic_deferred
+from telemetry import span,record_llm_usage,metrics
+from deadline import within,time_left,AGENT_RESERVE_MS
+import optimistic
+import realistic
+import planner
+
+load_dotenv()
+logger=logging.getLogger(__name__)
+
+#"per_agent" (default) makes one llm call per agent, "single_call" one call for all of them
+GENERATION_MODE=os.getenv("GENERATION_MODE","per_agent")
+SINGLE_CALL=GENERATION_MODE=="single_call"
+
+PERSONA_PROMPTS={"optimist":OPTIMIST_PROMPT,"realist":REALIST_PROMPT,"planner":PLANNER_PROMPT}
+TOPICS={"career","education","technical","general"}
+
+ENSEMBLE_CALLS=metrics.counter("ensemble_calls_total","Single-call generations by how much of the reply was usable",("outcome",))
+
+class PersonaResponses(BaseModel):
+    topic:Optional[str]=None
+    optimist:Optional[str]=None
+    realist:Optional[str]=None
+    planner:Optional[str]=None
+
+#an agent prompt's instructions are everything above its first context line
+def persona_instructions(prompt)->str:
+    lines=[]
+    for line in prompt.template.strip().splitlines():
+        if any("{"+name+"}" in line for name in prompt.input_variables):
+            break
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+#agents this call should answer for: not left out by the scheduler and not already served from the response cache
+def pending_personas(state:AgentState)->List[str]:
+    return [
+        agent for agent in AGENT_TYPES
+        if not getattr(state,f"{agent}_response") and agent not in state.dropped_agents and agent not in state.cached_responses
+    ]
+
+def build_ensemble_messages(state:AgentState,personas:List[str],memory_vars:Dict[str,Dict[str,Any]])->Tuple[List[HumanMessage],int]:
+    personas_text=[]
+    context=[]
+    for agent in personas:
+        prompt=PERSONA_PROMPTS[agent]
+        personas_text.append(f'Advisor "{agent}":\n{persona_instructions(prompt)}')
+        budgeted=assemble_context(agent,state.agent_web_results.get(agent,""),"",memory_vars[agent].get("relevant_history",""))
+        lines=[f'Advisor "{agent}":',f"Relevant Memory: {budgeted['relevant_history']}"]
+        #only the agents whose own prompt reads web results get them
+        if "web_context" in prompt.input_variables:
+            lines.append(f"Web Research Context: {budgeted['web_context']}")
+        context.append("\n".join(lines))
+    content=ENSEMBLE_PROMPT.format(
+        personas="\n\n".join(personas_text),
+        history=fit_history(session_store.get(state.session_id).view_all(),get_budget("ensemble","history")),
+        user_input=state.question,
+        context="\n\n".join(context),
+        keys=", ".join(f'"{agent}"' for agent in personas)
+    )
+    return [HumanMessage(content=content)],count_tokens(content)
+
+#tolerates markdown fences and text around the object; None when no json object can be read
+def parse_ensemble(text:str)->Optional[PersonaResponses]:
+    text=re.sub(r"^```(?:json)?\s*|\s*```$","",text.strip())
+    start,end=text.find("{"),text.rfind("}")
+    if start<0 or end<=start:
+        return None
+    try:
+        data=json.loads(text[start:end+1])
+        if not isinstance(data,dict):
+            return None
+        return PersonaResponses(**{key:str(value) for key,value in data.items() if key in PersonaResponses.model_fields and value is not None})
+    except (ValueError,ValidationError):
+        return None
+
+def persona_update(state:AgentState,agent:str,response:str,topic:str)->Dict[str,Any]:
+    #the same finishing and confidence each agent's own node applies
+    search_result=state.agent_web_results.get(agent,"")
+    if agent=="optimist":
+        confidence=optimistic.calculate_optimist_confidence(state.question,topic)
+    elif agent=="realist":
+        response=realistic.finish_response(response,search_result)
+        confidence=realistic.calculate_realist_confidence(state.question,search_result,topic)
+    else:
+        confidence=planner.calculate_expert_confidence(state.question,topic,search_result)
+    return agent_update(agent,response,confidence)
+
+#partial state for every agent the reply answered, merged the way the graph's reducers would merge their own updates
+def apply_reply(state:AgentState,personas:List[str],text:str,prompt_tokens:int)->Tuple[Dict[str,Any],List[str]]:
+    parsed=parse_ensemble(text)
+    if parsed is None:
+        logger.warning("Single-call reply could not be parsed, falling back to per-agent calls")
+        ENSEMBLE_CALLS.inc(outcome="unparsed")
+        return {},[]
+    update:Dict[str,Any]={"prompt_tokens":{"ensemble":prompt_tokens}}
+    topic=(parsed.topic or "").strip().lower()
+    #the reply's topic only settles what the local classifier left open, a confident local topic stands
+    if topic in TOPICS and topic_deferred(state.question):
+        update["topic_type"]=topic
+        remember_topic(state.question,topic)
+    topic=update.get("topic_type") or state.topic_type or "general"
+    answered=[]
+    for agent in personas:
+        response=(getattr(parsed,agent) or "").strip()
+        if not response:
+            continue
+        agent_result=persona_update(state,agent,response,topic)
+        update["response_buffer"]=merge_buffer(update.get("response_buffer"),agent_result.pop("response_buffer"))
+        update["conversation_history"]=append_history(update.get("conversation_history"),agent_result.pop("conversation_history"))
+        update.update(agent_result)
+        answered.append(agent)
+    ENSEMBLE_CALLS.inc(outcome="complete" if len(answered)==len(personas) else "partial" if answered else "empty")
+    return update,answered
+
+def ensemble_node(state:AgentState)->Dict[str,Any]:
+    personas=pending_personas(state)
+    if not personas:
+        return {}
+    try:
+        memory_vars={
+            agent:get_agent_memory(agent,state.session_id).load_memory_variables(build_memory_inputs(agent,state.question,state.agent_relevant_history))
+            for agent in personas
+        }
+        messages,prompt_tokens=build_ensemble_messages(state,personas,memory_vars)
+        with span("gemini.generate",kind="external",service="gemini",operation="generate",personas=len(personas)):
+            result=get_llm().invoke(messages)
+            record_llm_usage("ensemble",prompt_tokens,result)
+    except Exception as e:
+        print(f"Ensemble error: {str(e)}")
+        traceback.print_exc()
+        ENSEMBLE_CALLS.inc(outcome="error")
+        return {}
+    update,answered=apply_reply(state,personas,str(result.content),prompt_tokens)
+    for agent in answered:
+        save_to_memory(agent,state.user_input,update[f"{agent}_response"],state.session_id)
+    return update
+
+async def ensemble_node_async(state:AgentState)->Dict[str,Any]:
+    personas=pending_personas(state)
+    if not personas:
+        return {}
+    try:
+        loaded=await asyncio.gather(*[
+            get_agent_memory(agent,state.session_id).aload_memory_variables(build_memory_inputs(agent,state.question,state.agent_relevant_history))
+            for agent in personas
+        ])
+        messages,prompt_tokens=build_ensemble_messages(state,personas,dict(zip(personas,loaded)))
+        with span("gemini.generate",kind="external",service="gemini",operation="generate",personas=len(personas)):
+            result=await within(get_llm().ainvoke(messages),time_left(reserve_ms=AGENT_RESERVE_MS),"ensemble")
+            record_llm_usage("ensemble",prompt_tokens,result)
+    except TimeoutError:
+        #the agents' own nodes take over and are dropped right away if the turn has no time left
+        ENSEMBLE_CALLS.inc(outcome="timeout")
+        return {}
+    except Exception as e:
+        print(f"Ensemble error: {str(e)}")
+        traceback.print_exc()
+        ENSEMBLE_CALLS.inc(outcome="error")
+        return {}
+    update,answered=apply_reply(state,personas,str(result.content),prompt_tokens)
+    await asyncio.gather(*[
+        asave_to_memory(agent,state.user_input,update[f"{agent}_response"],state.session_id) for agent in answered
+    ])
+    return update
@@ -0,0 +1,37 @@
+#thread-safe lazy initialization for service clients
+#nothing is built at import time; the first caller builds the value and everyone else reuses it
+import threading
+from typing import Callable,Generic,TypeVar
+
+T=TypeVar("T")
+
+class LazyResource(Generic[T]):
+    def __init__(self,factory:Callable[[],T],name:str=""):
+        self._factory=factory
+        self.name=name or getattr(factory,"__name__","resource")
+        self._lock=threading.Lock()
+        self._value=None
+        self._ready=False
+
+    @property
+    def initialized(self)->bool:
+        return self._ready
+
+    def get(self)->T:
+        if not self._ready:
+            with self._lock:
+                #failures are not cached, the next caller retries
+                if not self._ready:
+                    self._value=self._factory()
+                    self._ready=True
+        return self._value
+
+    def set(self,value:T)->None:
+        with self._lock:
+            self._value=value
+            self._ready=True
+
+    def reset(self)->None:
+        with self._lock:
+            self._value=None
+            self._ready=False
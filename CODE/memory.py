@@ -1,51 +1,54 @@
 #manages current convo flow
-#combines buffer and vector memory
+#combines per-session and vector memory
 import os
 from typing import List, Dict, Any, Optional
-from langchain.memory import ConversationBufferMemory
 from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
-from memory_store import store_memory,get_memories,clear_memories
-import google.generativeai as genai
+from memory_store import store_memory,get_memories,get_memories_async,get_memories_by_agent,get_memories_by_agent_async,clear_memories
+from lazy import LazyResource
+from session_memory import SessionMemory,session_store,NO_HISTORY
+from context import select_memories,get_budget
 
 load_dotenv()
 
-GOOGLE_API_KEY=os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY environment variable is not set")
-
-genai.configure(api_key=GOOGLE_API_KEY)
-
-try:
-    llm = ChatGoogleGenerativeAI(
-        model="models/gemini-1.5-pro-latest",
-        google_api_key=GOOGLE_API_KEY
-    )
-except Exception as e:
-    print(f"Error initializing LLM: {str(e)}")
-    raise
-
-class VectorEnhancedMemory(ConversationBufferMemory):
-    #memory class that combines buffer memory with vector store
-    def __init__(self, agent_type: str):
-        super().__init__(
-            memory_key="history",
-            input_key="user_input",
-            output_key="output",
-            return_messages=True
+AGENT_TYPES=["optimist","realist","planner"]
+
+#the llm is built on first use, importing the agents needs no credentials
+def _create_llm()->ChatGoogleGenerativeAI:
+    google_api_key=os.getenv("GOOGLE_API_KEY")
+    if not google_api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable is not set")
+    try:
+        return ChatGoogleGenerativeAI(
+            model="models/gemini-1.5-pro-latest",
+            google_api_key=google_api_key
         )
-        self._agent_type=agent_type
+    except Exception as e:
+        print(f"Error initializing LLM: {str(e)}")
+        raise
+
+_llm=LazyResource(_create_llm,"llm")
 
-    @property
-    def agent_type(self)->str:
-        return self._agent_type
+def get_llm()->ChatGoogleGenerativeAI:
+    return _llm.get()
 
-    def format_memory(self, messages)->str:
-        formatted=[]
-        for msg in messages:
-            if hasattr(msg, 'content'):
-                formatted.append(f"{msg.type.capitalize()}: {msg.content}")
-        return "\n".join(formatted) if formatted else "No history available."
+#ranked by relevance and cut to the agent's memory budget
+def format_relevant_memories(relevant_memories,agent_type:str="")->str:
+    relevant_memories=select_memories(relevant_memories or [],get_budget(agent_type,"relevant_history"))
+    return "\n".join([
+        f"Memory {i+1} (Score: {mem['relevance_score']:.2f}):\n{mem['text']}"
+        for i, mem in enumerate(relevant_memories)
+    ]) if relevant_memories else "No relevant memories found."
+
+class VectorEnhancedMemory:
+    #an agent's view of its session's turn log, combined with the long-term vector store
+    memory_key="history"
+    input_key="user_input"
+    output_key="output"
+
+    def __init__(self, agent_type: str, session: SessionMemory):
+        self.agent_type=agent_type
+        self.session=session
 
     def get_relevant_history(self,query:str,top_k:int=3)->str:
         try:
@@ -60,61 +63,97 @@ class VectorEnhancedMemory(ConversationBufferMemory):
 
     def load_memory_variables(self,inputs: Dict[str, Any])->Dict[str,Any]:
         try:
-            buffer_memory=super().load_memory_variables(inputs)
             query=inputs.get(self.input_key, "")
-            relevant_memories=get_memories(query=query,agent_type=self.agent_type,top_k=3)
-            relevant_history="\n".join([
-                f"Memory {i+1} (Score: {mem['relevance_score']:.2f}):\n{mem['text']}"
-                for i, mem in enumerate(relevant_memories)
-            ]) if relevant_memories else "No relevant memories found."
+            #prefetched by the research stage when available
+            relevant_history=inputs.get("relevant_history")
+            if relevant_history is None:
+                relevant_history=format_relevant_memories(get_memories(query=query,agent_type=self.agent_type,top_k=3),self.agent_type)
             return {
-                "history":self.format_memory(buffer_memory.get("history", [])),
+                "history":self.session.view(self.agent_type),
                 "relevant_history":relevant_history,
                 self.input_key:query
             }
         except Exception as e:
             print(f"Error loading memory variables: {str(e)}")
             return {
-                "history": "No history available.",
+                "history": NO_HISTORY,
+                "relevant_history": "No relevant memories found.",
+                self.input_key: inputs.get(self.input_key, "")
+            }
+
+    async def aload_memory_variables(self,inputs: Dict[str, Any])->Dict[str,Any]:
+        try:
+            query=inputs.get(self.input_key, "")
+            relevant_history=inputs.get("relevant_history")
+            if relevant_history is None:
+                relevant_history=format_relevant_memories(await get_memories_async(query=query,agent_type=self.agent_type,top_k=3),self.agent_type)
+            return {
+                "history":self.session.view(self.agent_type),
+                "relevant_history":relevant_history,
+                self.input_key:query
+            }
+        except Exception as e:
+            print(f"Error loading memory variables: {str(e)}")
+            return {
+                "history": NO_HISTORY,
                 "relevant_history": "No relevant memories found.",
                 self.input_key: inputs.get(self.input_key, "")
             }
 
     def save_context(self,inputs:Dict[str, Any],outputs:Dict[str, str])->None:
-        super().save_context(inputs, outputs)
+        user_input=inputs.get(self.input_key, "")
+        agent_response=outputs.get(self.output_key, "")
+        self.session.record(user_input,self.agent_type,agent_response)
         try:
             store_memory(
                 agent_type=self.agent_type,
-                user_input=inputs.get(self.input_key, ""),
-                agent_response=outputs.get(self.output_key, "")
+                user_input=user_input,
+                agent_response=agent_response
             )
         except Exception as e:
             print(f"Warning: Failed to store memory in vector store: {str(e)}")
 
-agent_memories={}
-
-try:
-    agent_memories={
-        "optimist": VectorEnhancedMemory(agent_type="optimist"),
-        "realist": VectorEnhancedMemory(agent_type="realist"),
-        "planner": VectorEnhancedMemory(agent_type="planner")
-    }
-    print("Successfully initialized agent memories")
-except Exception as e:
-    print(f"Error initializing memories: {str(e)}")
-    #fallback to regular memory if vector enhanced fails
-    for agent_type in ["optimist", "realist", "planner"]:
-        agent_memories[agent_type]=ConversationBufferMemory(
-            memory_key="history",
-            input_key="user_input",
-            output_key="output",
-            return_messages=True
-        )
+    def clear(self)->None:
+        self.session.clear()
+
+#short-term memory is per session; every agent reads the same bounded turn log
+def get_agent_memory(agent_type:str,session_id:Optional[str]=None)->VectorEnhancedMemory:
+    return VectorEnhancedMemory(agent_type,session_store.get(session_id))
+
+def get_agent_memories(session_id:Optional[str]=None)->Dict[str,VectorEnhancedMemory]:
+    session=session_store.get(session_id)
+    return {agent_type:VectorEnhancedMemory(agent_type,session) for agent_type in AGENT_TYPES}
+
+def warm_up()->None:
+    get_llm()
+
+def build_memory_inputs(agent_type:str,user_input:str,prefetched:Dict[str,str])->Dict[str,Any]:
+    inputs={"user_input":user_input}
+    if agent_type in prefetched:
+        inputs["relevant_history"]=prefetched[agent_type]
+    return inputs
 
-def save_to_memory(agent_type:str,user_input:str,response:str)->None:
+#one embedding and one batched lookup for every agent's relevant history
+def prefetch_relevant_history(query:str,agent_types:List[str]=AGENT_TYPES,top_k:int=3)->Dict[str,str]:
     try:
-        if agent_type in agent_memories:
-            memory=agent_memories[agent_type]
+        memories=get_memories_by_agent(query,agent_types,top_k)
+        return {agent:format_relevant_memories(memories.get(agent, []),agent) for agent in agent_types}
+    except Exception as e:
+        print(f"Error retrieving memories: {str(e)}")
+        return {}
+
+async def aprefetch_relevant_history(query:str,agent_types:List[str]=AGENT_TYPES,top_k:int=3)->Dict[str,str]:
+    try:
+        memories=await get_memories_by_agent_async(query,agent_types,top_k)
+        return {agent:format_relevant_memories(memories.get(agent, []),agent) for agent in agent_types}
+    except Exception as e:
+        print(f"Error retrieving memories: {str(e)}")
+        return {}
+
+def save_to_memory(agent_type:str,user_input:str,response:str,session_id:Optional[str]=None)->None:
+    try:
+        if agent_type in AGENT_TYPES:
+            memory=get_agent_memory(agent_type,session_id)
             memory.save_context(
                 {"user_input":user_input},
                 {"output":response}
@@ -122,10 +161,13 @@ def save_to_memory(agent_type:str,user_input:str,response:str)->None:
     except Exception as e:
         print("")
 
+async def asave_to_memory(agent_type:str,user_input:str,response:str,session_id:Optional[str]=None)->None:
+    #the vector write is queued for the background writer, so this never blocks the loop
+    save_to_memory(agent_type,user_input,response,session_id)
+
 def clear_all_memories()->None:
     try:
-        for memory in agent_memories.values():
-            memory.clear()
+        session_store.clear()
         clear_memories()
     except Exception as e:
         print(f"Error clearing memories: {str(e)}")
@@ -1,15 +1,18 @@
-#for storing conversations in Pinecone
+#for storing conversations in the vector store (Pinecone or local)
 #semantic memory store, retrieving similar past conversations- long term memory
 import os
 import json
+import asyncio
 import logging
-from uuid import uuid4
+from uuid import uuid5,NAMESPACE_OID
 from typing import List,Dict,Any,Optional
 from dotenv import load_dotenv
-from pinecone import Pinecone,ServerlessSpec
 import numpy as np
-import google.generativeai as genai
-from google.generativeai import GenerativeModel
+from embeddings import embed_text,embed_text_async,embed_texts
+from memory_writer import create_writer
+from vector_store import create_backend
+from lazy import LazyResource
+from telemetry import span
 
 
 load_dotenv()
@@ -23,69 +26,105 @@ NAMESPACE="default"
 logging.basicConfig(level=logging.INFO)
 logger=logging.getLogger(__name__)
 
-genai.configure(api_key=GOOGLE_API_KEY)
+#VECTOR_BACKEND picks pinecone (default) or the in-process local store
+#the backend is connected on first use so importing this module needs no credentials or network
+def _create_backend():
+    try:
+        return create_backend(EMBEDDING_DIM,api_key=PINECONE_API_KEY,index_name=INDEX_NAME,namespace=NAMESPACE)
+
+    except Exception as e:
+        logger.error(f"Vector store initialization failed: {str(e)}")
+        raise
 
-try:
-    pc=Pinecone(api_key=PINECONE_API_KEY)
-    logger.info("Pinecone client initialized.")
+_backend=LazyResource(_create_backend,"vector store")
 
-    if INDEX_NAME not in pc.list_indexes().names():
-        logger.info(f"Creating new index: {INDEX_NAME}")
-        pc.create_index(
-            name=INDEX_NAME,
-            dimension=EMBEDDING_DIM,
-            metric="cosine",
-            spec=ServerlessSpec(cloud="aws", region="us-east-1")
-        )
+def get_backend():
+    return _backend.get()
 
-    index=pc.Index(INDEX_NAME)
-    logger.info(f"Connected to index: {INDEX_NAME}")
+def warm_up()->None:
+    get_backend()
 
-except Exception as e:
-    logger.error(f"Pinecone initialization failed: {str(e)}")
-    raise
-#text to vector embedding function
+#text to vector embedding function, memoized by embeddings.embedding_cache
 def encode_text_to_embedding(text: str) -> List[float]:
     try:
-        model = GenerativeModel('models/embedding-001')
-        result = model.embed_content(text)
-        return result.embedding
+        return embed_text(text)
     except Exception as e:
         logger.error(f"Embedding error: {str(e)}")
         return [0.0] * EMBEDDING_DIM
 
-def store_memory(user_input: str,agent_response: str,agent_type: str,
-                emotion: Optional[str]=None,context: Optional[Dict[str, Any]]=None)->None:
+async def encode_text_to_embedding_async(text: str) -> List[float]:
+    try:
+        return await embed_text_async(text)
+    except Exception as e:
+        logger.error(f"Embedding error: {str(e)}")
+        return [0.0] * EMBEDDING_DIM
+
+def build_memory_record(user_input: str,agent_response: str,agent_type: str,
+                emotion: Optional[str]=None,context: Optional[Dict[str, Any]]=None)->Dict[str, Any]:
+    full_text=f"User: {user_input}\nAgent: {agent_response}"
+    metadata={
+        "user_input": user_input,
+        "agent_response": agent_response,
+        "agent_type": agent_type,
+        "text": full_text,
+        "timestamp": str(np.datetime64('now'))
+    }
+
+    if emotion:
+        metadata["emotion"]=emotion
+    if context:
+        metadata["context"]=json.dumps(context)
+
+    #ids are derived from the content so a repeated write of the same exchange overwrites itself
+    return {
+        "id":str(uuid5(NAMESPACE_OID,f"{agent_type}\0{full_text}")),
+        "text":full_text,
+        "agent_type":agent_type,
+        "metadata":metadata
+    }
+
+#embeds a batch with one call and upserts it with one request
+def write_memories(records: List[Dict[str, Any]])->None:
     try:
-        memory_id=str(uuid4())
-        full_text=f"User: {user_input}\nAgent: {agent_response}"
-        embedding=encode_text_to_embedding(full_text)
-
-        metadata={
-            "user_input": user_input,
-            "agent_response": agent_response,
-            "agent_type": agent_type,
-            "text": full_text,
-            "timestamp": str(np.datetime64('now'))
-        }
-
-        if emotion:
-            metadata["emotion"]=emotion
-        if context:
-            metadata["context"]=json.dumps(context)
-
-        vector={
-            "id":memory_id,
+        embeddings=embed_texts([record["text"] for record in records])
+        vectors=[{
+            "id":record["id"],
             "values":embedding,
-            "metadata":metadata
-        }
+            "metadata":record["metadata"]
+        } for record, embedding in zip(records, embeddings)]
 
-        index.upsert(vectors=[vector],namespace=NAMESPACE)
-        logger.info(f"Stored memory ID {memory_id} in namespace: {NAMESPACE}")
+        with span("vector.upsert",kind="external",service="vector_store",operation="upsert",records=len(vectors)):
+            get_backend().upsert(vectors)
+        logger.info(f"Stored {len(vectors)} memories in namespace: {NAMESPACE}")
 
+    except Exception as e:
+        logger.error(f"Error storing memories: {str(e)}")
+        raise
+
+memory_writer=create_writer(write_memories)
+
+#queued for the background writer, returns without touching the network
+def store_memory(user_input: str,agent_response: str,agent_type: str,
+                emotion: Optional[str]=None,context: Optional[Dict[str, Any]]=None)->None:
+    try:
+        memory_writer.submit(build_memory_record(user_input,agent_response,agent_type,emotion,context))
     except Exception as e:
         logger.error(f"Error storing memory: {str(e)}")
         raise
+
+def flush_memories(timeout: Optional[float]=None)->None:
+    memory_writer.flush(timeout)
+
+def _format_matches(results,query:str)->List[Dict[str, Any]]:
+    matches = results.get("matches", [])
+    logger.info(f"Retrieved {len(matches)} matches for query: {query}")
+
+    return [{
+        "text":match["metadata"].get("text", ""),
+        "agent_type":match["metadata"].get("agent_type", ""),
+        "relevance_score":match.get("score", 0.0)
+    } for match in matches]
+
 #to retrieeve similar past conversations
 def get_memories(query: str, agent_type: Optional[str]=None,top_k:int=4)->List[Dict[str, Any]]:
     try:
@@ -93,22 +132,47 @@ def get_memories(query: str, agent_type: Optional[str]=None,top_k:int=4)->List[D
 
         filter_dict={"agent_type": {"$eq": agent_type}} if agent_type else None
 
-        results=index.query(
-            vector=query_embedding,
-            top_k=top_k,
-            include_metadata=True,
-            namespace=NAMESPACE,
-            filter=filter_dict
-        )
+        with span("vector.query",kind="external",service="vector_store",operation="query"):
+            results=get_backend().query(query_embedding,top_k,filter_dict)
+        return _format_matches(results,query)
+
+    except Exception as e:
+        logger.error(f"Error retrieving memories: {str(e)}")
+        raise
 
-        matches = results.get("matches", [])
-        logger.info(f"Retrieved {len(matches)} matches for query: {query}")
+async def get_memories_async(query: str, agent_type: Optional[str]=None,top_k:int=4)->List[Dict[str, Any]]:
+    try:
+        query_embedding=await encode_text_to_embedding_async(query)
 
-        return [{
-            "text":match["metadata"].get("text", ""),
-            "agent_type":match["metadata"].get("agent_type", ""),
-            "relevance_score":match.get("score", 0.0)
-        } for match in matches]
+        filter_dict={"agent_type": {"$eq": agent_type}} if agent_type else None
+
+        #backend clients are blocking, so the query runs on the default executor
+        with span("vector.query",kind="external",service="vector_store",operation="query"):
+            results=await asyncio.to_thread(get_backend().query,query_embedding,top_k,filter_dict)
+        return _format_matches(results,query)
+
+    except Exception as e:
+        logger.error(f"Error retrieving memories: {str(e)}")
+        raise
+
+#embeds the query once and returns each agent's own top_k matches
+def get_memories_by_agent(query: str, agent_types: List[str], top_k:int=3)->Dict[str, List[Dict[str, Any]]]:
+    try:
+        query_embedding=encode_text_to_embedding(query)
+        with span("vector.query",kind="external",service="vector_store",operation="query",agents=len(agent_types)):
+            results=get_backend().query_by_agent(query_embedding,top_k,agent_types)
+        return {agent:_format_matches(result,query) for agent, result in results.items()}
+
+    except Exception as e:
+        logger.error(f"Error retrieving memories: {str(e)}")
+        raise
+
+async def get_memories_by_agent_async(query: str, agent_types: List[str], top_k:int=3)->Dict[str, List[Dict[str, Any]]]:
+    try:
+        query_embedding=await encode_text_to_embedding_async(query)
+        with span("vector.query",kind="external",service="vector_store",operation="query",agents=len(agent_types)):
+            results=await asyncio.to_thread(get_backend().query_by_agent,query_embedding,top_k,agent_types)
+        return {agent:_format_matches(result,query) for agent, result in results.items()}
 
     except Exception as e:
         logger.error(f"Error retrieving memories: {str(e)}")
@@ -116,7 +180,9 @@ def get_memories(query: str, agent_type: Optional[str]=None,top_k:int=4)->List[D
 
 def clear_memories()->None:
     try:
-        index.delete(delete_all=True, namespace=NAMESPACE)
+        #pending writes would otherwise land after the delete
+        memory_writer.flush()
+        get_backend().clear()
         logger.info(f"Cleared all vectors in namespace: {NAMESPACE}")
     except Exception as e:
         logger.error(f"Error clearing memories: {str(e)}")
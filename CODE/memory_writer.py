@@ -0,0 +1,156 @@
+#write-behind queue for long-term memory
+#agents enqueue records and return; a background thread batches them into one embedding call and one upsert
+import os
+import queue
+import atexit
+import logging
+import threading
+import time
+from typing import Any,Callable,Dict,List,Optional
+
+logger=logging.getLogger(__name__)
+
+_STOP=object()
+
+class MemoryWriter:
+    def __init__(self,write_batch:Callable[[List[Dict[str,Any]]],None],batch_size:int=32,
+                 flush_interval:float=0.5,max_queue:int=1000):
+        self.write_batch=write_batch
+        self.batch_size=batch_size
+        self.flush_interval=flush_interval
+        self._queue:"queue.Queue"=queue.Queue(maxsize=max_queue)
+        self._thread:Optional[threading.Thread]=None
+        self._lock=threading.Lock()
+        self._closed=False
+        self.written=0
+        self.dropped=0
+        self.duplicates=0
+        self.batches=0
+        self.errors=0
+
+    def _ensure_started(self)->None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread=threading.Thread(target=self._run,name="memory-writer",daemon=True)
+                    self._thread.start()
+
+    def submit(self,record:Dict[str,Any])->bool:
+        if self._closed:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            #never stall a spoken answer on persistence
+            self.dropped+=1
+            logger.warning("Memory write queue is full, dropping record")
+            return False
+
+    def _drain(self)->List[Any]:
+        items=[self._queue.get()]
+        deadline=time.monotonic()+self.flush_interval
+        while len(items)<self.batch_size and items[-1] is not _STOP:
+            remaining=deadline-time.monotonic()
+            if remaining<=0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _dedupe(self,records:List[Dict[str,Any]])->List[Dict[str,Any]]:
+        unique={}
+        for record in records:
+            key=record.get("id") or (record.get("agent_type"),record.get("text"))
+            if key in unique:
+                self.duplicates+=1
+            unique[key]=record
+        return list(unique.values())
+
+    def _write(self,records:List[Dict[str,Any]])->None:
+        if not records:
+            return
+        try:
+            self.write_batch(records)
+            self.written+=len(records)
+            self.batches+=1
+        except Exception as e:
+            self.errors+=1
+            logger.error(f"Error writing memory batch: {str(e)}")
+
+    def _run(self)->None:
+        while True:
+            items=self._drain()
+            stop=any(item is _STOP for item in items)
+            records=[item for item in items if item is not _STOP]
+            self._write(self._dedupe(records))
+            for _ in items:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self,timeout:Optional[float]=None)->None:
+        #blocks until everything submitted so far has been written
+        if self._thread is None:
+            return
+        if timeout is None:
+            self._queue.join()
+            return
+        deadline=time.monotonic()+timeout
+        while self._queue.unfinished_tasks and time.monotonic()<deadline:
+            time.sleep(0.01)
+
+    #drops whatever is still queued; for a writer that cannot keep up by the time the process exits
+    def _discard_pending(self)->None:
+        while True:
+            try:
+                item=self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP:
+                self.dropped+=1
+            self._queue.task_done()
+
+    #timeout bounds the whole call, so a stuck write_batch never holds up exit
+    def close(self,timeout:float=10.0)->None:
+        if self._closed:
+            return
+        self._closed=True
+        if self._thread is None:
+            return
+        deadline=time.monotonic()+timeout
+        try:
+            self._queue.put(_STOP,timeout=timeout)
+        except queue.Full:
+            queued=self._queue.qsize()
+            self._discard_pending()
+            logger.warning(f"Memory writer did not drain in time, dropped {queued} queued records")
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+        self._thread.join(max(0.0,deadline-time.monotonic()))
+
+    def stats(self)->Dict[str,int]:
+        return {
+            "queued":self._queue.qsize(),
+            "written":self.written,
+            "batches":self.batches,
+            "duplicates":self.duplicates,
+            "dropped":self.dropped,
+            "errors":self.errors
+        }
+
+def create_writer(write_batch:Callable[[List[Dict[str,Any]]],None])->MemoryWriter:
+    writer=MemoryWriter(
+        write_batch,
+        batch_size=int(os.getenv("MEMORY_WRITE_BATCH","32")),
+        flush_interval=float(os.getenv("MEMORY_WRITE_INTERVAL","0.5")),
+        max_queue=int(os.getenv("MEMORY_QUEUE_SIZE","1000"))
+    )
+    #flush pending memories when the process exits
+    atexit.register(writer.close)
+    return writer
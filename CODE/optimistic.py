@@ -1,11 +1,14 @@
 import os
 import traceback 
 from dotenv import load_dotenv
-from memory import agent_memories,llm,save_to_memory
+from memory import get_agent_memory,get_llm,build_memory_inputs,save_to_memory,asave_to_memory
 from langchain.schema.runnable import RunnablePassthrough
 from prompts import OPTIMIST_PROMPT
-from websearch import search_web
-from state import AgentState
+from state import AgentState,agent_update
+from streaming import SPEAK_TAG
+from context import build_prompt_inputs
+from telemetry import span,record_llm_usage
+from typing import Dict,Any,Tuple
 
 load_dotenv
 
@@ -33,56 +36,88 @@ def calculate_optimist_confidence(user_input:str,topic_type:str)->float:
 
     return min(confidence,1.0)
 
-def optimistic_node(state:AgentState)->AgentState:
-    user_input=state.user_input
-    new_state=AgentState(**state.dict())
+EMPTY_RESPONSE="That's an interesting question about internships and final year projects! Looking at it positively, both paths offer unique opportunities for growth. Internships provide valuable real-world experience and networking, while final year projects let you showcase your expertise and innovation. Let's explore what excites you most about each option!"
+FALLBACK_RESPONSE=(
+    "Looking at this optimistically, both internships and final year projects offer amazing opportunities! "
+    "Would you like to explore the exciting potential of each path?"
+)
+FALLBACK_CONFIDENCE=0.5
+
+def build_search_query(user_input:str,topic:str)->str:
+    search_queries = {
+        "career": f"success stories {user_input} positive outcomes career growth",
+        "education": f"benefits advantages {user_input} student success stories",
+        "technical": f"exciting developments {user_input} future potential innovations"
+    }
+    return search_queries.get(topic,user_input)
+
+def build_chain():
+    return (OPTIMIST_PROMPT |get_llm() |(lambda x: x.content if hasattr(x, "content") else str(x))
+    ).with_config(tags=[SPEAK_TAG])
+
+#budgeted chain input and its prompt size in tokens
+def build_chain_input(user_input:str,search_result:str,memory_vars:Dict[str,Any])->Tuple[Dict[str,Any],int]:
+    return build_prompt_inputs("optimist",OPTIMIST_PROMPT,user_input,search_result or "",memory_vars)
+
+def optimistic_node(state:AgentState)->Dict[str,Any]:
+    user_input=state.question
+    update:Dict[str,Any]={}
 
     try:
-        #web search
-        search_queries = {
-            "career": f"success stories {user_input} positive outcomes career growth",
-            "education": f"benefits advantages {user_input} student success stories",
-            "technical": f"exciting developments {user_input} future potential innovations"
-        }
-
-        topic=state.topic_type or "general"
-        search_query=search_queries.get(topic,user_input)
-        search_result=search_web(search_query)
-        new_state.web_results=search_result
+        #web results gathered by the research stage
+        search_result=state.agent_web_results.get("optimist","")
 
         #memory retrieval
-        memory=agent_memories["optimist"]
-        memory_vars=memory.load_memory_variables({memory.input_key: user_input})
+        memory=get_agent_memory("optimist",state.session_id)
+        memory_vars=memory.load_memory_variables(build_memory_inputs("optimist",user_input,state.agent_relevant_history))
         
         #execute chain 
-        chain=(OPTIMIST_PROMPT |llm |(lambda x: x.content if hasattr(x, "content") else str(x))
-        )
-        chain_input={
-            "user_input": user_input,
-            "web_context": search_result or "",
-            "history": memory_vars.get("history", ""),
-            "relevant_history": memory_vars.get("relevant_history", "")
-        }
-        response=chain.invoke(chain_input)
-        response=str(response).strip()
-        if not response:
-            response="That's an interesting question about internships and final year projects! Looking at it positively, both paths offer unique opportunities for growth. Internships provide valuable real-world experience and networking, while final year projects let you showcase your expertise and innovation. Let's explore what excites you most about each option!"
+        chain_input,prompt_tokens=build_chain_input(user_input,search_result,memory_vars)
+        with span("gemini.generate",kind="external",service="gemini",operation="generate"):
+            response=build_chain().invoke(chain_input)
+            record_llm_usage("optimist",prompt_tokens,response)
+        response=str(response).strip() or EMPTY_RESPONSE
         #confidence calculation
         confidence=calculate_optimist_confidence(user_input,state.topic_type)
 
-        new_state.update_agent_response("optimist",response,confidence)
+        update.update(agent_update("optimist",response,confidence))
+        update["prompt_tokens"]={"optimist":prompt_tokens}
 
         #save to memory
-        store_key=f"optimist_{topic}"
-        save_to_memory(store_key,user_input,response)
+        save_to_memory("optimist",state.user_input,response,state.session_id)
+
+    except Exception as e:
+        print(f"Optimist error: {str(e)}")
+        traceback.print_exc()
+        update.update(agent_update("optimist",FALLBACK_RESPONSE,FALLBACK_CONFIDENCE))
+
+    return update
+
+async def optimistic_node_async(state:AgentState)->Dict[str,Any]:
+    user_input=state.question
+    update:Dict[str,Any]={}
+
+    try:
+        search_result=state.agent_web_results.get("optimist","")
+
+        memory=get_agent_memory("optimist",state.session_id)
+        memory_vars=await memory.aload_memory_variables(build_memory_inputs("optimist",user_input,state.agent_relevant_history))
+
+        chain_input,prompt_tokens=build_chain_input(user_input,search_result,memory_vars)
+        with span("gemini.generate",kind="external",service="gemini",operation="generate"):
+            response=await build_chain().ainvoke(chain_input)
+            record_llm_usage("optimist",prompt_tokens,response)
+        response=str(response).strip() or EMPTY_RESPONSE
+        confidence=calculate_optimist_confidence(user_input,state.topic_type)
+
+        update.update(agent_update("optimist",response,confidence))
+        update["prompt_tokens"]={"optimist":prompt_tokens}
+
+        await asave_to_memory("optimist",state.user_input,response,state.session_id)
 
     except Exception as e:
         print(f"Optimist error: {str(e)}")
         traceback.print_exc()
-        fallback_response=(
-            "Looking at this optimistically, both internships and final year projects offer amazing opportunities! "
-            "Would you like to explore the exciting potential of each path?"
-        )
-        new_state.update_agent_response("optimist",fallback_response, 0.5)
+        update.update(agent_update("optimist",FALLBACK_RESPONSE,FALLBACK_CONFIDENCE))
 
-    return new_state
\ No newline at end of file
+    return update
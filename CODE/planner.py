@@ -1,47 +1,56 @@
 import os
 import traceback
 from dotenv import load_dotenv
-from memory import agent_memories, llm, save_to_memory
-from memory_store import store_memory
+from memory import get_agent_memory, get_llm, build_memory_inputs, save_to_memory, asave_to_memory
 from langchain.schema import HumanMessage
-from state import AgentState
-from websearch import search_web
-from typing import Optional
+from state import AgentState,agent_update
+from streaming import SPEAK_TAG
+from typing import Optional,Dict,Any
 from prompts import PLANNER_PROMPT
+from context import build_prompt_inputs,count_tokens
+from telemetry import span,record_llm_usage
 
 
 load_dotenv()
-def analyze_topic_type(user_input: str)->str:
-    try:
-        messages=[
-            HumanMessage(content=f"""Analyze this input and determine if it's career, education, or technical related.
-Input: {user_input} Classify as one of: career, education, technical
-Response format: Just the classification word in lowercase.""")
-        ]
-        result=llm.invoke(messages)
-        response=result.content.strip().lower()
-        return response if response in {"career", "education", "technical"} else "general"
-    except Exception as e:
-        print(f"Error analyzing topic type: {str(e)}")
-        return "general"
+
+FALLBACK_RESPONSE="I need more information to provide expert guidance. Could you provide more details?"
+ERROR_RESPONSE="I encountered an error while processing your request."
+ERROR_CONFIDENCE=0.0
+
+def _expert_messages(user_input: str, web_context: str, conversation_history: str, relevant_history: str):
+    chain_input={
+        "user_input": user_input,
+        "web_context": web_context,
+        "history": conversation_history,
+        "relevant_history": relevant_history
+    }
+    return [
+        HumanMessage(content=PLANNER_PROMPT.format(**chain_input))
+    ]
 
 def generate_expert_response(user_input: str, web_context: str, conversation_history: str, relevant_history: str) -> str:
     """Generate an expert response based on context and history"""
     try:
-        chain_input={
-            "user_input": user_input,
-            "web_context": web_context,
-            "history": conversation_history,
-            "relevant_history": relevant_history
-        }
-        messages=[
-            HumanMessage(content=PLANNER_PROMPT.format(**chain_input))
-        ]
-        result=llm.invoke(messages)
+        messages=_expert_messages(user_input,web_context,conversation_history,relevant_history)
+        with span("gemini.generate",kind="external",service="gemini",operation="generate"):
+            result=get_llm().with_config(tags=[SPEAK_TAG]).invoke(messages)
+            record_llm_usage("planner",count_tokens(messages[0].content),result)
         return result.content.strip()
     except Exception as e:
         print(f"Error generating expert response: {str(e)}")
-        return "I need more information to provide expert guidance. Could you provide more details?"
+        return FALLBACK_RESPONSE
+
+async def generate_expert_response_async(user_input: str, web_context: str, conversation_history: str, relevant_history: str) -> str:
+    """Async variant of generate_expert_response"""
+    try:
+        messages=_expert_messages(user_input,web_context,conversation_history,relevant_history)
+        with span("gemini.generate",kind="external",service="gemini",operation="generate"):
+            result=await get_llm().with_config(tags=[SPEAK_TAG]).ainvoke(messages)
+            record_llm_usage("planner",count_tokens(messages[0].content),result)
+        return result.content.strip()
+    except Exception as e:
+        print(f"Error generating expert response: {str(e)}")
+        return FALLBACK_RESPONSE
 
 def calculate_expert_confidence(user_input: str, topic_type: str, web_results: str) -> float:
     confidence=0.0
@@ -61,46 +70,74 @@ def calculate_expert_confidence(user_input: str, topic_type: str, web_results: s
         confidence+=0.3
     return min(confidence, 1.0)
 
-def planner_node(state: AgentState) -> AgentState:
-    user_input=state.user_input
-    new_state=AgentState(**state.dict())
+def build_search_query(user_input: str, topic_type: str) -> str:
+    search_queries={
+        "career":f"career planning methodology {user_input} expert advice steps timeline",
+        "education":f"learning path methodology {user_input} expert guidance timeline",
+        "technical":f"technical implementation guide {user_input} best practices timeline",
+        "general":f"step by step guide {user_input} methodology timeline"
+    }
+    return search_queries.get(topic_type, search_queries["general"])
+
+def planner_node(state: AgentState) -> Dict[str,Any]:
+    user_input=state.question
+    update:Dict[str,Any]={}
 
     try:
-        topic_type=analyze_topic_type(user_input)
-        new_state.topic_type=topic_type
-        search_queries={
-            "career":f"career planning methodology {user_input} expert advice steps timeline",
-            "education":f"learning path methodology {user_input} expert guidance timeline",
-            "technical":f"technical implementation guide {user_input} best practices timeline",
-            "general":f"step by step guide {user_input} methodology timeline"
-        }
-        search_query=search_queries.get(topic_type, search_queries["general"])
-        search_result=search_web(search_query)
-        new_state.web_results=search_result
+        #classified once in system_intro, shared with routing and research
+        topic_type=state.topic_type or "general"
+        search_result=state.agent_web_results.get("planner","")
 
         #memory retrieval with context
-        memory=agent_memories["planner"]
-        memory_vars=memory.load_memory_variables({memory.input_key: user_input})
-        conversation_history=memory_vars.get("history", "")
-        relevant_history=memory_vars.get("relevant_history", "")
+        memory=get_agent_memory("planner",state.session_id)
+        memory_vars=memory.load_memory_variables(build_memory_inputs("planner",user_input,state.agent_relevant_history))
+        chain_input,prompt_tokens=build_prompt_inputs("planner",PLANNER_PROMPT,user_input,search_result,memory_vars)
 
         response=generate_expert_response(
             user_input, 
-            search_result,
-            conversation_history,
-            relevant_history
+            chain_input["web_context"],
+            chain_input["history"],
+            chain_input["relevant_history"]
+        )
+        confidence=calculate_expert_confidence(user_input,topic_type,search_result)
+
+        update.update(agent_update("planner",response,confidence))
+        update["prompt_tokens"]={"planner":prompt_tokens}
+
+        #storing the interaction in memory (buffer and vector store)
+        save_to_memory("planner",state.user_input,response,state.session_id)
+        return update
+    except Exception as e:
+        print(f"Error in planner_node:{str(e)}\n{traceback.format_exc()}")
+        update.update(agent_update("planner",ERROR_RESPONSE,ERROR_CONFIDENCE))
+        return update
+
+async def planner_node_async(state: AgentState) -> Dict[str,Any]:
+    user_input=state.question
+    update:Dict[str,Any]={}
+
+    try:
+        topic_type=state.topic_type or "general"
+        search_result=state.agent_web_results.get("planner","")
+
+        memory=get_agent_memory("planner",state.session_id)
+        memory_vars=await memory.aload_memory_variables(build_memory_inputs("planner",user_input,state.agent_relevant_history))
+        chain_input,prompt_tokens=build_prompt_inputs("planner",PLANNER_PROMPT,user_input,search_result,memory_vars)
+
+        response=await generate_expert_response_async(
+            user_input,
+            chain_input["web_context"],
+            chain_input["history"],
+            chain_input["relevant_history"]
         )
         confidence=calculate_expert_confidence(user_input,topic_type,search_result)
 
-        new_state.planner_response=response
-        new_state.planner_confidence=confidence
+        update.update(agent_update("planner",response,confidence))
+        update["prompt_tokens"]={"planner":prompt_tokens}
 
-        #storing the interaction in memory
-        save_to_memory(memory,user_input,response)
-        store_memory(user_input,response,"planner")
-        return new_state
+        await asave_to_memory("planner",state.user_input,response,state.session_id)
+        return update
     except Exception as e:
         print(f"Error in planner_node:{str(e)}\n{traceback.format_exc()}")
-        new_state.planner_response="I encountered an error while processing your request."
-        new_state.planner_confidence=0.0
-        return new_state
+        update.update(agent_update("planner",ERROR_RESPONSE,ERROR_CONFIDENCE))
+        return update
@@ -49,8 +49,8 @@ PRACTICAL CONSIDERATIONS:
 [List 2-3 key practical points to consider]
 
 FACTUAL RESPONSE:
-Based on {web_context}, respond to the user's query within 2-3 sentences.
-[Your clear , concise response to the user's question related to the context and one step beyond it. Also use {web_context} as a one line summary to support your response.]
+Based on the Current Data below, respond to the user's query within 2-3 sentences.
+[Your clear , concise response to the user's question related to the context and one step beyond it. Also use the Current Data as a one line summary to support your response.]
 
 SOURCES:
 [List the URLs and sources from the web context here, marking them clearly as references]
@@ -80,3 +80,21 @@ Discussion Flow: {history}
 User: {user_input}
 Response:
 """)
+
+#single-call generation: the instruction part of each agent prompt above, one shared context, one json reply
+ENSEMBLE_PROMPT=PromptTemplate.from_template("""
+You are writing the answers of several advisors to the same user at once. Each advisor follows only its own instructions and writes its answer as if it were the only one replying.
+
+{personas}
+
+Shared Context:
+Conversation History: {history}
+User Input: {user_input}
+
+Advisor Context:
+{context}
+
+Also classify the user input as one of: career, education, technical, general.
+
+Reply with a single JSON object and nothing else, no markdown fences. It has the string keys "topic" and {keys}; each advisor's value is its complete answer in the format its instructions describe.
+""")
@@ -1,13 +1,20 @@
 import os
+import re
 import traceback
 from dotenv import load_dotenv
-from memory import agent_memories, llm, save_to_memory
-from langchain.schema.runnable import RunnablePassthrough
+from memory import get_agent_memory, get_llm, build_memory_inputs, save_to_memory, asave_to_memory
 from prompts import REALIST_PROMPT
-from websearch import search_web
-from state import AgentState
+from state import AgentState,agent_update
+from streaming import SPEAK_TAG
+from context import build_prompt_inputs
+from telemetry import span,record_llm_usage
+from typing import Dict,Any
 load_dotenv()
 
+#the heading line where the spoken answer ends: the prompt asks for "SOURCES:", finish_response appends "Sources :"
+#anchored to a line start so "several sources: ..." inside the answer does not cut it short
+SOURCES_MARKER=re.compile(r"(?im)^\s*sources\s*:")
+
 def calculate_realist_confidence(user_input: str, web_results: str, topic_type: str) -> float:
     confidence=0.0
     topic_confidence={
@@ -25,48 +32,76 @@ def calculate_realist_confidence(user_input: str, web_results: str, topic_type:
     if any(indicator in user_input.lower() for indicator in practical_indicators):
         confidence+=0.4
     return min(confidence,1.0)
-def realistic_node(state: AgentState) -> AgentState:
-    user_input=state.user_input
-    new_state=AgentState(**state.dict())
+FALLBACK_RESPONSE="I'm having trouble processing that right now."
+FALLBACK_CONFIDENCE=0.1
+
+def build_search_query(user_input:str,topic:str)->str:
+    search_queries={
+        "career": f"latest statistics {user_input} job market data practical considerations",
+        "education": f"practical advice {user_input} student experiences requirements costs",
+        "technical": f"real-world usage {user_input} industry adoption challenges comparison"
+    }
+    return search_queries.get(topic, user_input)
+
+def build_chain():
+    return (REALIST_PROMPT| get_llm()).with_config(tags=[SPEAK_TAG])
+
+def finish_response(response:str,search_result:str)->str:
+    if search_result in search_result:
+        response+=f"\n\nSources : \n{search_result}"
+    return response
+
+def realistic_node(state: AgentState) -> Dict[str,Any]:
+    user_input=state.question
+    update:Dict[str,Any]={}
     try:
-        search_queries={
-            "career": f"latest statistics {user_input} job market data practical considerations",
-            "education": f"practical advice {user_input} student experiences requirements costs",
-            "technical": f"real-world usage {user_input} industry adoption challenges comparison"
-        }
-        topic=state.topic_type or "general"
-        search_query=search_queries.get(topic, user_input)
-        search_result=search_web(search_query)
-        new_state.web_results=search_result
+        search_result=state.agent_web_results.get("realist","")
 
         #memory retrieval
-        memory=agent_memories["realist"]
-        memory_vars=memory.load_memory_variables({memory.input_key:user_input})
+        memory=get_agent_memory("realist",state.session_id)
+        memory_vars=memory.load_memory_variables(build_memory_inputs("realist",user_input,state.agent_relevant_history))
         
-        #chain execution with context
-        chain=({
-                "user_input":RunnablePassthrough(),
-                "web_context": lambda _:search_result or "",
-                "history": lambda _:memory_vars.get("history", ""),
-                "relevant_history": lambda _:memory_vars.get("relevant_history", "")
-            }| REALIST_PROMPT| llm)
+        #chain execution with budgeted context, the sources still list every result
+        chain_input,prompt_tokens=build_prompt_inputs("realist",REALIST_PROMPT,user_input,search_result,memory_vars)
+        with span("gemini.generate",kind="external",service="gemini",operation="generate"):
+            result=build_chain().invoke(chain_input)
+            record_llm_usage("realist",prompt_tokens,result)
+        response=finish_response(result.content.strip(),search_result)
+
+        confidence=calculate_realist_confidence(user_input, search_result, state.topic_type)
+        update.update(agent_update("realist", response,confidence))
+        update["prompt_tokens"]={"realist":prompt_tokens}
 
-        response=chain.invoke(user_input).content.strip()
+        #save to memory
+        save_to_memory("realist",state.user_input,response,state.session_id)
+    except Exception as e:
+        print(f"Realist error: {str(e)}")
+        traceback.print_exc()
+        update.update(agent_update("realist",FALLBACK_RESPONSE,FALLBACK_CONFIDENCE))
+    return update
 
-        if search_result in search_result:
-            response+=f"\n\nSources : \n{search_result}"
+async def realistic_node_async(state: AgentState) -> Dict[str,Any]:
+    user_input=state.question
+    update:Dict[str,Any]={}
+    try:
+        search_result=state.agent_web_results.get("realist","")
+
+        memory=get_agent_memory("realist",state.session_id)
+        memory_vars=await memory.aload_memory_variables(build_memory_inputs("realist",user_input,state.agent_relevant_history))
+
+        chain_input,prompt_tokens=build_prompt_inputs("realist",REALIST_PROMPT,user_input,search_result,memory_vars)
+        with span("gemini.generate",kind="external",service="gemini",operation="generate"):
+            result=await build_chain().ainvoke(chain_input)
+            record_llm_usage("realist",prompt_tokens,result)
+        response=finish_response(result.content.strip(),search_result)
 
         confidence=calculate_realist_confidence(user_input, search_result, state.topic_type)
-        new_state.update_agent_response("realist", response,confidence)
+        update.update(agent_update("realist", response,confidence))
+        update["prompt_tokens"]={"realist":prompt_tokens}
 
-        #save to memory
-        save_to_memory("realist",user_input,response)
+        await asave_to_memory("realist",state.user_input,response,state.session_id)
     except Exception as e:
         print(f"Realist error: {str(e)}")
         traceback.print_exc()
-        new_state.update_agent_response(
-            "realist",
-            "I'm having trouble processing that right now.",
-            0.1
-        )
-    return new_state
+        update.update(agent_update("realist",FALLBACK_RESPONSE,FALLBACK_CONFIDENCE))
+    return update
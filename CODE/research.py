@@ -0,0 +1,140 @@
+#shared research stage, runs once per turn before the agents
+#every agent-specific web query and one batched memory lookup run together; the agents only read their slice from the state
+import asyncio
+import traceback
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict,Any
+from state import AgentState
+from websearch import fetch_organic,fetch_organic_async,format_organic,normalize_query
+from memory import prefetch_relevant_history,aprefetch_relevant_history,format_relevant_memories,AGENT_TYPES
+from response_cache import lookup_responses,lookup_responses_async
+from deadline import within,hedged,time_left,SEARCH_SLICE_MS,RETRIEVAL_SLICE_MS,AGENT_RESERVE_MS,SEARCH_HEDGE_MS,RETRIEVAL_HEDGE_MS
+import optimistic
+import realistic
+import planner
+
+RESULTS_PER_AGENT=3
+
+def build_agent_queries(user_input:str,topic:str,agent_types=AGENT_TYPES)->Dict[str,str]:
+    queries={
+        "optimist":optimistic.build_search_query(user_input,topic),
+        "realist":realistic.build_search_query(user_input,topic),
+        "planner":planner.build_search_query(user_input,topic)
+    }
+    return {agent:query for agent,query in queries.items() if agent in agent_types}
+
+#each agent keeps its own ranking, but a link already given to another agent is replaced by that agent's next result
+def partition_results(results:Dict[str,Any],limit:int=RESULTS_PER_AGENT)->Dict[str,str]:
+    seen=set()
+    agent_results={}
+    for agent,items in results.items():
+        if isinstance(items,TimeoutError):
+            #out of time: the agent answers without web results
+            agent_results[agent]="No web results found."
+            continue
+        if isinstance(items,Exception):
+            agent_results[agent]=f"Web search failed: {items}"
+            continue
+        picked=[]
+        for item in items:
+            link=item.get("link","")
+            if link and link in seen:
+                continue
+            seen.add(link)
+            picked.append(item)
+            if len(picked)>=limit:
+                break
+        agent_results[agent]=format_organic(picked,limit) if picked else "No web results found."
+    return agent_results
+
+#agents whose templates collapse to the same query share one request
+def unique_queries(queries:Dict[str,str])->Dict[str,str]:
+    unique={}
+    for query in queries.values():
+        unique.setdefault(normalize_query(query),query)
+    return unique
+
+def combine_results(agent_results:Dict[str,str])->str:
+    return "\n\n".join(result for result in agent_results.values() if result)
+
+#under the turn deadline each read gets its slice; a read that misses it is dropped and the agents proceed without it
+async def search_within_deadline(query:str)->Any:
+    return await within(hedged(lambda:fetch_organic_async(query),SEARCH_HEDGE_MS,"search"),
+                        time_left(SEARCH_SLICE_MS,AGENT_RESERVE_MS),"search")
+
+async def retrieve_within_deadline(user_input:str,agent_types)->Dict[str,str]:
+    try:
+        return await within(hedged(lambda:aprefetch_relevant_history(user_input,agent_types),RETRIEVAL_HEDGE_MS,"retrieval"),
+                            time_left(RETRIEVAL_SLICE_MS,AGENT_RESERVE_MS),"retrieval")
+    except TimeoutError:
+        #an empty history, not a missing one, so the agents do not retry the lookup on their own
+        return {agent:format_relevant_memories([],agent) for agent in agent_types}
+
+def research_node(state:AgentState)->Dict[str,Any]:
+    if not state.question.strip():
+        return {}
+    try:
+        #agents left out by the scheduler, and those answered from the response cache, need no search or retrieval
+        scheduled=[agent for agent in AGENT_TYPES if agent not in state.dropped_agents]
+        cached=lookup_responses(scheduled,state.topic_type,state.question)
+        pending=[agent for agent in scheduled if agent not in cached]
+        if not pending:
+            return {"cached_responses":cached}
+        queries=build_agent_queries(state.question,state.topic_type or "general",pending)
+        unique=unique_queries(queries)
+        fetched={}
+        #each task runs in a copy of this context, so its spans land in the turn's trace
+        with ThreadPoolExecutor(max_workers=len(unique)+1) as pool:
+            memories=pool.submit(contextvars.copy_context().run,prefetch_relevant_history,state.question,pending)
+            futures={key:pool.submit(contextvars.copy_context().run,fetch_organic,query) for key,query in unique.items()}
+            for key,future in futures.items():
+                try:
+                    fetched[key]=future.result()
+                except Exception as e:
+                    fetched[key]=e
+            relevant_history=memories.result()
+        agent_results=partition_results({agent:fetched[normalize_query(query)] for agent,query in queries.items()})
+        return {
+            "agent_web_results":agent_results,
+            "web_results":combine_results(agent_results),
+            "agent_relevant_history":relevant_history,
+            "cached_responses":cached
+        }
+    except Exception as e:
+        print(f"Research error: {str(e)}")
+        traceback.print_exc()
+        return {}
+
+async def research_node_async(state:AgentState)->Dict[str,Any]:
+    if not state.question.strip():
+        return {}
+    try:
+        scheduled=[agent for agent in AGENT_TYPES if agent not in state.dropped_agents]
+        try:
+            cached=await within(lookup_responses_async(scheduled,state.topic_type,state.question),
+                                time_left(RETRIEVAL_SLICE_MS,AGENT_RESERVE_MS),"response_cache")
+        except TimeoutError:
+            cached={}
+        pending=[agent for agent in scheduled if agent not in cached]
+        if not pending:
+            return {"cached_responses":cached}
+        queries=build_agent_queries(state.question,state.topic_type or "general",pending)
+        unique=unique_queries(queries)
+        relevant_history,*results=await asyncio.gather(
+            retrieve_within_deadline(state.question,pending),
+            *[search_within_deadline(query) for query in unique.values()],
+            return_exceptions=True
+        )
+        fetched=dict(zip(unique.keys(),results))
+        agent_results=partition_results({agent:fetched[normalize_query(query)] for agent,query in queries.items()})
+        return {
+            "agent_web_results":agent_results,
+            "web_results":combine_results(agent_results),
+            "agent_relevant_history":relevant_history if isinstance(relevant_history,dict) else {},
+            "cached_responses":cached
+        }
+    except Exception as e:
+        print(f"Research error: {str(e)}")
+        traceback.print_exc()
+        return {}
@@ -0,0 +1,192 @@
+#opt-in semantic cache of agent answers for near-duplicate questions
+#(topic, user_input) is embedded once per turn; an agent whose earlier answer is similar enough skips search, retrieval and generation
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict,deque
+from typing import Any,Callable,Dict,Iterable,List,Optional
+from dotenv import load_dotenv
+from embeddings import embed_text,embed_text_async
+from memory import save_to_memory,asave_to_memory
+from state import AgentState,agent_update
+from telemetry import register_cache
+from vector_store import LocalBackend
+
+load_dotenv()
+logger=logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED=os.getenv("RESPONSE_CACHE","0")=="1"
+RESPONSE_CACHE_THRESHOLD=float(os.getenv("RESPONSE_CACHE_THRESHOLD","0.92"))
+RESPONSE_CACHE_TTL=float(os.getenv("RESPONSE_CACHE_TTL",str(24*3600)))
+RESPONSE_CACHE_SIZE=int(os.getenv("RESPONSE_CACHE_SIZE","1024"))
+
+def cache_text(topic:Optional[str],user_input:str)->str:
+    return f"{topic or 'general'}\n{' '.join(user_input.lower().split())}"
+
+class ResponseCache:
+    def __init__(self,threshold:float=RESPONSE_CACHE_THRESHOLD,ttl:float=RESPONSE_CACHE_TTL,max_entries:int=RESPONSE_CACHE_SIZE):
+        self.threshold=threshold
+        self.ttl=ttl
+        self.max_entries=max_entries
+        self.backend=LocalBackend()
+        self._lock=threading.Lock()
+        #per agent, oldest first, for size-bounded eviction
+        self._entries:Dict[str,"OrderedDict[str,float]"]={}
+        self._similarities=deque(maxlen=1000)
+        self.hits=0
+        self.misses=0
+        self.expired=0
+        self.stores=0
+
+    def lookup(self,agent_types:Iterable[str],vector:List[float])->Dict[str,Dict[str,Any]]:
+        agent_types=list(agent_types)
+        results=self.backend.query_by_agent(vector,1,agent_types)
+        now=time.time()
+        hits={}
+        with self._lock:
+            for agent in agent_types:
+                matches=results.get(agent,{}).get("matches",[])
+                if not matches:
+                    self.misses+=1
+                    continue
+                match=matches[0]
+                metadata=match["metadata"]
+                if metadata["expires"]<now:
+                    self.expired+=1
+                    self.misses+=1
+                    self._forget(agent,match["id"])
+                    continue
+                self._similarities.append(match["score"])
+                if match["score"]<self.threshold:
+                    self.misses+=1
+                    continue
+                self.hits+=1
+                hits[agent]={
+                    "response":metadata["response"],
+                    "confidence":metadata["confidence"],
+                    "similarity":match["score"]
+                }
+        return hits
+
+    def store(self,agent_type:str,key:str,vector:List[float],response:str,confidence:float)->None:
+        entry_id=f"{agent_type}\0{key}"
+        expires=time.time()+self.ttl
+        self.backend.upsert([{
+            "id":entry_id,
+            "values":vector,
+            "metadata":{"agent_type":agent_type,"response":response,"confidence":confidence,"expires":expires}
+        }])
+        with self._lock:
+            self.stores+=1
+            entries=self._entries.setdefault(agent_type,OrderedDict())
+            entries[entry_id]=expires
+            entries.move_to_end(entry_id)
+            while len(entries)>self.max_entries:
+                oldest,_=entries.popitem(last=False)
+                self.backend.delete([oldest])
+
+    def _forget(self,agent_type:str,entry_id:str)->None:
+        self._entries.get(agent_type,{}).pop(entry_id,None)
+        self.backend.delete([entry_id])
+
+    def clear(self)->None:
+        with self._lock:
+            self._entries.clear()
+            self.backend.clear()
+
+    def stats(self)->Dict[str,Any]:
+        with self._lock:
+            lookups=self.hits+self.misses
+            similarities=sorted(self._similarities)
+            return {
+                "enabled":RESPONSE_CACHE_ENABLED,
+                "entries":len(self.backend),
+                "hits":self.hits,
+                "misses":self.misses,
+                "expired":self.expired,
+                "stores":self.stores,
+                "hit_rate":self.hits/lookups if lookups else 0.0,
+                "median_similarity":similarities[len(similarities)//2] if similarities else 0.0,
+                "threshold":self.threshold
+            }
+
+response_cache=ResponseCache()
+
+def response_cache_stats()->Dict[str,Any]:
+    return response_cache.stats()
+
+register_cache("response",response_cache_stats)
+
+#called by the research stage; embedding failures only mean a miss
+def lookup_responses(agent_types:Iterable[str],topic:Optional[str],user_input:str)->Dict[str,Dict[str,Any]]:
+    if not RESPONSE_CACHE_ENABLED:
+        return {}
+    try:
+        return response_cache.lookup(agent_types,embed_text(cache_text(topic,user_input)))
+    except Exception as e:
+        logger.error(f"Response cache lookup failed: {str(e)}")
+        return {}
+
+async def lookup_responses_async(agent_types:Iterable[str],topic:Optional[str],user_input:str)->Dict[str,Dict[str,Any]]:
+    if not RESPONSE_CACHE_ENABLED:
+        return {}
+    try:
+        return response_cache.lookup(agent_types,await embed_text_async(cache_text(topic,user_input)))
+    except Exception as e:
+        logger.error(f"Response cache lookup failed: {str(e)}")
+        return {}
+
+def _cacheable(agent_type:str,update:Dict[str,Any],skip:Iterable[str])->Optional[str]:
+    response=update.get(f"{agent_type}_response")
+    if not response or response in skip:
+        return None
+    return response
+
+def _cached_update(agent_type:str,hit:Dict[str,Any])->Dict[str,Any]:
+    update=agent_update(agent_type,hit["response"],hit["confidence"])
+    update["cached_responses"]={agent_type:hit}
+    return update
+
+#wraps an agent node: answers from the hit the research stage found, otherwise runs the node and stores its answer
+#skip lists the agent's fallback texts, which must never be served from the cache
+def cached_node(agent_type:str,node:Callable[[AgentState],Dict[str,Any]],skip:Iterable[str]=())->Callable[[AgentState],Dict[str,Any]]:
+    if not RESPONSE_CACHE_ENABLED:
+        return node
+    skip=set(skip)
+    def run(state:AgentState)->Dict[str,Any]:
+        hit=state.cached_responses.get(agent_type)
+        if hit:
+            #the session still records the exchange so later turns see it
+            save_to_memory(agent_type,state.user_input,hit["response"],state.session_id)
+            return _cached_update(agent_type,hit)
+        update=node(state)
+        response=_cacheable(agent_type,update,skip)
+        if response:
+            try:
+                key=cache_text(state.topic_type,state.question)
+                response_cache.store(agent_type,key,embed_text(key),response,update.get(f"{agent_type}_confidence",0.0))
+            except Exception as e:
+                logger.error(f"Response cache store failed: {str(e)}")
+        return update
+    return run
+
+def cached_node_async(agent_type:str,node:Callable,skip:Iterable[str]=())->Callable:
+    if not RESPONSE_CACHE_ENABLED:
+        return node
+    skip=set(skip)
+    async def run(state:AgentState)->Dict[str,Any]:
+        hit=state.cached_responses.get(agent_type)
+        if hit:
+            await asave_to_memory(agent_type,state.user_input,hit["response"],state.session_id)
+            return _cached_update(agent_type,hit)
+        update=await node(state)
+        response=_cacheable(agent_type,update,skip)
+        if response:
+            try:
+                key=cache_text(state.topic_type,state.question)
+                response_cache.store(agent_type,key,await embed_text_async(key),response,update.get(f"{agent_type}_confidence",0.0))
+            except Exception as e:
+                logger.error(f"Response cache store failed: {str(e)}")
+        return update
+    return run
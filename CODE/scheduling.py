@@ -0,0 +1,123 @@
+#confidence-gated agent scheduling
+#every agent is scored up front with its own confidence heuristic; only the agents the policy keeps run this turn,
+#the rest are remembered per session and answer the same question if the user asks to go deeper
+import os
+import re
+from typing import Dict,List,Optional,Tuple
+from dotenv import load_dotenv
+from cache import TTLCache
+from telemetry import metrics
+from optimistic import calculate_optimist_confidence
+from realistic import calculate_realist_confidence
+from planner import calculate_expert_confidence
+from memory import AGENT_TYPES
+
+load_dotenv()
+
+#a policy is "all", "top_k:<k>" or "threshold:<min confidence>"
+#AGENT_SCHEDULE applies to every topic, AGENT_SCHEDULE_TOPICS overrides it per topic, e.g. "general=top_k:1,technical=threshold:0.6"
+AGENT_SCHEDULE=os.getenv("AGENT_SCHEDULE","all")
+AGENT_SCHEDULE_TOPICS=os.getenv("AGENT_SCHEDULE_TOPICS","")
+#how long the agents left out of a turn wait for a follow-up
+DEFERRED_TTL=float(os.getenv("DEFERRED_TTL","1800"))
+
+GO_DEEPER=re.compile(
+    r"\b(go deeper|dig deeper|tell me more|more perspectives?|other perspectives?|what do the others think|"
+    r"hear from the others|the other (agents|views))\b",
+    re.IGNORECASE
+)
+
+SCHEDULED=metrics.counter("agents_scheduled_total","Agents run or deferred by confidence-gated scheduling",("agent","decision"))
+#counted when an agent is held back; the ones a follow-up resumes show up as decision="resumed" above
+CALLS_SAVED=metrics.counter("llm_calls_saved_total","Agent llm calls held back by confidence-gated scheduling",("topic",))
+
+def parse_policy(text:str)->Tuple[str,float]:
+    mode,_,value=text.strip().lower().partition(":")
+    if mode=="top_k":
+        return mode,float(value or 2)
+    if mode=="threshold":
+        return mode,float(value or 0.5)
+    if mode and mode!="all":
+        print(f"Unknown agent schedule '{text}', running every agent")
+    return "all",0.0
+
+def parse_topic_policies(text:str)->Dict[str,Tuple[str,float]]:
+    policies={}
+    for item in text.split(","):
+        topic,_,policy=item.partition("=")
+        if topic.strip() and policy.strip():
+            policies[topic.strip().lower()]=parse_policy(policy)
+    return policies
+
+DEFAULT_POLICY=parse_policy(AGENT_SCHEDULE)
+TOPIC_POLICIES=parse_topic_policies(AGENT_SCHEDULE_TOPICS)
+
+def policy_for(topic:Optional[str])->Tuple[str,float]:
+    return TOPIC_POLICIES.get(topic or "general",DEFAULT_POLICY)
+
+#the agents' own heuristics; search has not run yet, so each is scored as if its web results arrive
+def score_agents(user_input:str,topic:Optional[str])->Dict[str,float]:
+    topic=topic or "general"
+    expected_results="pending"
+    return {
+        "optimist":calculate_optimist_confidence(user_input,topic),
+        "realist":calculate_realist_confidence(user_input,expected_results,topic),
+        "planner":calculate_expert_confidence(user_input,topic,expected_results)
+    }
+
+#returns (run now, deferred); the best scoring agent always runs, ties keep the usual agent order
+def select_agents(scores:Dict[str,float],policy:Tuple[str,float])->Tuple[List[str],List[str]]:
+    mode,value=policy
+    ranked=sorted(scores,key=lambda agent:(-scores[agent],AGENT_TYPES.index(agent)))
+    if mode=="top_k":
+        selected=ranked[:max(1,int(value))]
+    elif mode=="threshold":
+        selected=[agent for agent in ranked if scores[agent]>=value] or ranked[:1]
+    else:
+        selected=ranked
+    return [agent for agent in AGENT_TYPES if agent in selected],[agent for agent in AGENT_TYPES if agent not in selected]
+
+#session -> the question, topic and agents held back from its last gated turn
+deferred_turns=TTLCache(maxsize=int(os.getenv("DEFERRED_SESSIONS","1024")),ttl=DEFERRED_TTL)
+
+def wants_more(user_input:str)->bool:
+    return bool(GO_DEEPER.search(user_input or ""))
+
+#partial state for the turn: agents left out go to dropped_agents, which the research stage and the router skip
+def schedule_agents(user_input:str,topic:Optional[str],session_id:str)->Dict[str,object]:
+    policy=policy_for(topic)
+    if policy[0]=="all":
+        return {}
+    scores=score_agents(user_input,topic)
+    selected,deferred=select_agents(scores,policy)
+    for agent in selected:
+        SCHEDULED.inc(agent=agent,decision="run")
+    for agent in deferred:
+        SCHEDULED.inc(agent=agent,decision="deferred")
+    if not deferred:
+        return {}
+    CALLS_SAVED.inc(len(deferred),topic=topic or "general")
+    deferred_turns.set(session_id,{"user_input":user_input,"topic_type":topic,"agents":deferred})
+    return {"dropped_agents":{agent:"gated" for agent in deferred}}
+
+#a "go deeper" follow-up reruns the previous question, as resumed_from, with only the agents that were held back
+def resume_deferred(user_input:str,session_id:str)->Optional[Dict[str,object]]:
+    if not wants_more(user_input):
+        return None
+    record=deferred_turns.get(session_id)
+    if not record:
+        return None
+    deferred_turns.delete(session_id)
+    for agent in record["agents"]:
+        SCHEDULED.inc(agent=agent,decision="resumed")
+    return {
+        "resumed_from":record["user_input"],
+        "topic_type":record["topic_type"],
+        "dropped_agents":{agent:"answered" for agent in AGENT_TYPES if agent not in record["agents"]}
+    }
+
+def schedule_stats()->Dict[str,float]:
+    stats={decision:sum(SCHEDULED.value(agent=agent,decision=decision) for agent in AGENT_TYPES) for decision in ("run","deferred","resumed")}
+    #a deferred call a follow-up made after all was not saved
+    stats["llm_calls_saved"]=stats["deferred"]-stats["resumed"]
+    return stats
@@ -0,0 +1,399 @@
+#headless conversation server: REST for text turns, a websocket that takes audio in and streams per-agent text and audio out
+#turns run under a bounded concurrency limit behind a bounded wait queue; when both are full new turns are shed with 503
+#run with: python server.py  (SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_QUEUE, SERVER_QUEUE_TIMEOUT, SERVER_SESSION_QUEUE)
+import os
+import time
+import uuid
+import json
+import base64
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any,AsyncIterator,Dict,Optional
+from aiohttp import web,WSMsgType
+from dotenv import load_dotenv
+from app import AGENT_NODES,run_conversation_async,run_conversation_streaming_async,warm_up
+from session_memory import session_store,SESSION_IDLE_TTL
+from state import AgentState
+from streaming import SpeechStreamer
+from telemetry import metrics,render_prometheus,get_trace
+from websearch import close_async_client
+
+load_dotenv()
+logger=logging.getLogger(__name__)
+
+SERVER_HOST=os.getenv("SERVER_HOST","0.0.0.0")
+SERVER_PORT=int(os.getenv("SERVER_PORT","8080"))
+#turns running at once, and turns allowed to wait for one of those slots
+SERVER_WORKERS=int(os.getenv("SERVER_WORKERS","8"))
+SERVER_QUEUE=int(os.getenv("SERVER_QUEUE","32"))
+#a queued turn that has not started by then is shed rather than answered late
+SERVER_QUEUE_TIMEOUT=float(os.getenv("SERVER_QUEUE_TIMEOUT","10"))
+#turns of one session allowed to wait behind its running turn; more are shed as session_busy
+SERVER_SESSION_QUEUE=int(os.getenv("SERVER_SESSION_QUEUE","1"))
+#incoming audio frames buffered per connection before frames are dropped (about 10s of 20ms frames)
+SERVER_AUDIO_BUFFER=int(os.getenv("SERVER_AUDIO_BUFFER","500"))
+MAX_INPUT_CHARS=int(os.getenv("SERVER_MAX_INPUT_CHARS","2000"))
+MAX_SESSION_ID=128
+
+ACTIVE_TURNS=metrics.gauge("server_active_turns","Turns currently running")
+QUEUED_TURNS=metrics.gauge("server_queued_turns","Turns waiting for a worker slot")
+SHED_TURNS=metrics.counter("server_shed_turns_total","Turns rejected because the server was saturated",("reason",))
+REQUESTS=metrics.counter("server_requests_total","Requests by endpoint and status",("endpoint","status"))
+
+class Overloaded(Exception):
+    def __init__(self,reason:str,retry_after:float):
+        super().__init__(f"server overloaded ({reason})")
+        self.reason=reason
+        self.retry_after=retry_after
+
+class TurnLimiter:
+    def __init__(self,max_concurrent:int=SERVER_WORKERS,max_queued:int=SERVER_QUEUE,queue_timeout:float=SERVER_QUEUE_TIMEOUT):
+        self.max_concurrent=max_concurrent
+        self.max_queued=max_queued
+        self.queue_timeout=queue_timeout
+        self._slots=asyncio.Semaphore(max_concurrent)
+        self.active=0
+        self.queued=0
+        self.shed=0
+
+    def _report(self)->None:
+        ACTIVE_TURNS.set(self.active)
+        QUEUED_TURNS.set(self.queued)
+
+    def reject(self,reason:str)->Overloaded:
+        self.shed+=1
+        SHED_TURNS.inc(reason=reason)
+        return Overloaded(reason,retry_after=max(1.0,self.queue_timeout/2))
+
+    #counted here rather than read off the semaphore, acquires still being scheduled must count as taken
+    def check(self)->None:
+        if self.active+self.queued>=self.max_concurrent+self.max_queued:
+            raise self.reject("queue_full")
+
+    @asynccontextmanager
+    async def slot(self)->AsyncIterator[None]:
+        self.check()
+        self.queued+=1
+        self._report()
+        try:
+            await asyncio.wait_for(self._slots.acquire(),self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise self.reject("queue_timeout")
+        finally:
+            self.queued-=1
+        self.active+=1
+        self._report()
+        try:
+            yield
+        finally:
+            self.active-=1
+            self._slots.release()
+            self._report()
+
+    def stats(self)->Dict[str,int]:
+        return {"active":self.active,"queued":self.queued,"shed":self.shed,"workers":self.max_concurrent,"queue_size":self.max_queued}
+
+class ServerSession:
+    #one turn at a time per session, so each turn sees the history of the one before
+    def __init__(self,session_id:str):
+        self.session_id=session_id
+        self.lock=asyncio.Lock()
+        #turns running or waiting on this session
+        self.pending=0
+        self.last_used=time.time()
+        self.turns=0
+
+    #capacity is checked before waiting on the session, and the wait is bounded like the worker queue,
+    #so turns piling up on one session are shed like any other overload
+    @asynccontextmanager
+    async def turn(self,limiter:TurnLimiter)->AsyncIterator[None]:
+        limiter.check()
+        #counted, not read off the lock, for the same reason as TurnLimiter.check
+        if self.pending>SERVER_SESSION_QUEUE:
+            raise limiter.reject("session_busy")
+        self.pending+=1
+        try:
+            try:
+                await asyncio.wait_for(self.lock.acquire(),limiter.queue_timeout)
+            except asyncio.TimeoutError:
+                raise limiter.reject("session_timeout")
+            try:
+                async with limiter.slot():
+                    yield
+            finally:
+                self.lock.release()
+        finally:
+            self.pending-=1
+
+class SessionRegistry:
+    def __init__(self,idle_ttl:float=SESSION_IDLE_TTL):
+        self.idle_ttl=idle_ttl
+        self._sessions:Dict[str,ServerSession]={}
+
+    def get(self,session_id:Optional[str]=None)->ServerSession:
+        self._evict()
+        session_id=session_id or uuid.uuid4().hex
+        session=self._sessions.get(session_id)
+        if session is None:
+            session=self._sessions[session_id]=ServerSession(session_id)
+        session.last_used=time.time()
+        return session
+
+    def _evict(self)->None:
+        cutoff=time.time()-self.idle_ttl
+        for session_id,session in list(self._sessions.items()):
+            if session.last_used<cutoff and not session.pending:
+                del self._sessions[session_id]
+
+    def drop(self,session_id:str)->bool:
+        session_store.drop(session_id)
+        return self._sessions.pop(session_id,None) is not None
+
+    def __len__(self)->int:
+        return len(self._sessions)
+
+LIMITER=web.AppKey("limiter",TurnLimiter)
+SESSIONS=web.AppKey("sessions",SessionRegistry)
+
+def valid_session_id(session_id:Optional[str])->bool:
+    return session_id is None or (isinstance(session_id,str) and 0<len(session_id)<=MAX_SESSION_ID and session_id.isprintable())
+
+def turn_payload(state:AgentState,session_id:str)->Dict[str,Any]:
+    return {
+        "session_id":session_id,
+        "trace_id":state.trace_id,
+        "topic":state.topic_type,
+        "responses":{
+            agent:{"text":getattr(state,f"{agent}_response"),"confidence":getattr(state,f"{agent}_confidence")}
+            for agent in AGENT_NODES if getattr(state,f"{agent}_response")
+        },
+        "final_response":state.final_response
+    }
+
+def overloaded_response(error:Overloaded)->web.Response:
+    return web.json_response({"error":"overloaded","reason":error.reason},status=503,headers={"Retry-After":str(int(error.retry_after))})
+
+#rest
+
+async def create_turn(request:web.Request)->web.Response:
+    limiter,sessions=request.app[LIMITER],request.app[SESSIONS]
+    try:
+        body=await request.json()
+    except (json.JSONDecodeError,UnicodeDecodeError):
+        REQUESTS.inc(endpoint="turns",status="400")
+        return web.json_response({"error":"body must be json"},status=400)
+    text=body.get("text") if isinstance(body,dict) else None
+    session_id=body.get("session_id") if isinstance(body,dict) else None
+    if not isinstance(text,str) or not text.strip() or len(text)>MAX_INPUT_CHARS:
+        REQUESTS.inc(endpoint="turns",status="400")
+        return web.json_response({"error":f"text must be a non-empty string of at most {MAX_INPUT_CHARS} characters"},status=400)
+    if not valid_session_id(session_id):
+        REQUESTS.inc(endpoint="turns",status="400")
+        return web.json_response({"error":"invalid session_id"},status=400)
+    session=sessions.get(session_id)
+    try:
+        async with session.turn(limiter):
+            state=await run_conversation_async(text.strip(),session_id=session.session_id)
+            session.turns+=1
+    except Overloaded as e:
+        REQUESTS.inc(endpoint="turns",status="503")
+        return overloaded_response(e)
+    REQUESTS.inc(endpoint="turns",status="200")
+    return web.json_response(turn_payload(state,session.session_id))
+
+async def delete_session(request:web.Request)->web.Response:
+    dropped=request.app[SESSIONS].drop(request.match_info["session_id"])
+    return web.json_response({"dropped":dropped})
+
+async def get_trace_handler(request:web.Request)->web.Response:
+    trace=get_trace(request.match_info["trace_id"])
+    if trace is None:
+        return web.json_response({"error":"trace not found"},status=404)
+    return web.json_response(trace)
+
+async def health(request:web.Request)->web.Response:
+    limiter,sessions=request.app[LIMITER],request.app[SESSIONS]
+    return web.json_response({"status":"ok","turns":limiter.stats(),"sessions":len(sessions)})
+
+async def metrics_handler(request:web.Request)->web.Response:
+    return web.Response(text=render_prometheus(),content_type="text/plain")
+
+#websocket
+#client -> server: {"type":"text","text":...}, {"type":"start","sample_rate":16000,"audio":true}, binary 16-bit mono pcm frames,
+#                  {"type":"end"} (optional, the endpointer also ends the utterance), {"type":"cancel"}
+#server -> client: session, transcript, chunk (agent, text), audio (agent, base64 wav), agent_done, done, audio_done, error
+
+async def _queued_frames(frames:asyncio.Queue)->AsyncIterator[bytes]:
+    while True:
+        frame=await frames.get()
+        if frame is None:
+            return
+        yield frame
+
+class StreamConnection:
+    def __init__(self,ws:web.WebSocketResponse,limiter:TurnLimiter,session:ServerSession):
+        self.ws=ws
+        self.limiter=limiter
+        self.session=session
+        self.frames:Optional[asyncio.Queue]=None
+        self.task:Optional[asyncio.Task]=None
+        self.dropped_frames=0
+
+    async def send(self,message:Dict[str,Any])->None:
+        if not self.ws.closed:
+            await self.ws.send_json(message)
+
+    @property
+    def busy(self)->bool:
+        return self.task is not None and not self.task.done()
+
+    def start_turn(self,turn)->None:
+        self.task=asyncio.create_task(self._guarded(turn))
+
+    async def _guarded(self,turn)->None:
+        try:
+            await turn
+        except asyncio.CancelledError:
+            await self.send({"type":"error","code":"cancelled"})
+        except Overloaded as e:
+            await self.send({"type":"error","code":"overloaded","reason":e.reason,"retry_after":e.retry_after})
+        except Exception as e:
+            logger.exception("Stream turn failed")
+            await self.send({"type":"error","code":"internal","message":str(e)})
+        finally:
+            self.frames=None
+
+    def push_frame(self,frame:bytes)->None:
+        if self.frames is None:
+            return
+        try:
+            self.frames.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.dropped_frames+=1
+
+    def end_audio(self)->None:
+        if self.frames is not None:
+            try:
+                self.frames.put_nowait(None)
+            except asyncio.QueueFull:
+                #the reader is far behind, cut the utterance at what it has
+                self.frames.get_nowait()
+                self.frames.put_nowait(None)
+
+    async def voice_turn(self,sample_rate:int,speak:bool)->None:
+        #imported here so text-only deployments do not need the audio stack
+        from tts_stt import stream_and_transcribe
+        from audio_input import EnergyEndpointer
+        frames=self.frames
+        transcript=await stream_and_transcribe(_queued_frames(frames),sample_rate,EnergyEndpointer(sample_rate))
+        self.frames=None
+        await self.send({"type":"transcript","text":transcript})
+        if transcript.strip():
+            await self.text_turn(transcript.strip(),speak,is_voice=True)
+        else:
+            await self.send({"type":"done","session_id":self.session.session_id,"trace_id":None,"final_response":None})
+
+    async def text_turn(self,text:str,speak:bool,is_voice:bool=False)->None:
+        streamer=None
+        if speak:
+            from tts_stt import synthesize_async
+            streamer=SpeechStreamer(synthesize=synthesize_async,play=self._send_audio)
+        async def on_chunk(agent:str,chunk:str)->None:
+            await self.send({"type":"chunk","agent":agent,"text":chunk})
+            if streamer:
+                streamer.submit(agent,chunk)
+        async def on_agent_done(agent:str)->None:
+            await self.send({"type":"agent_done","agent":agent})
+            if streamer:
+                streamer.finish(agent)
+        try:
+            async with self.session.turn(self.limiter):
+                state=await run_conversation_streaming_async(text,on_chunk,on_agent_done,is_voice=is_voice,session_id=self.session.session_id)
+                self.session.turns+=1
+            await self.send({"type":"done",**turn_payload(state,self.session.session_id)})
+        finally:
+            if streamer:
+                await streamer.close()
+                await self.send({"type":"audio_done"})
+
+    async def _send_audio(self,agent:str,audio:bytes)->None:
+        await self.send({"type":"audio","agent":agent,"format":"wav","data":base64.b64encode(audio).decode("ascii")})
+
+    async def handle(self,message:Dict[str,Any])->None:
+        kind=message.get("type")
+        if kind=="cancel":
+            if self.busy:
+                self.task.cancel()
+            return
+        if kind=="end":
+            self.end_audio()
+            return
+        if kind not in ("text","start"):
+            await self.send({"type":"error","code":"bad_request","message":f"unknown message type {kind!r}"})
+            return
+        if self.busy:
+            await self.send({"type":"error","code":"busy","message":"a turn is already running on this connection"})
+            return
+        speak=bool(message.get("audio",kind=="start"))
+        if kind=="text":
+            text=message.get("text")
+            if not isinstance(text,str) or not text.strip() or len(text)>MAX_INPUT_CHARS:
+                await self.send({"type":"error","code":"bad_request","message":"text must be a non-empty string"})
+                return
+            self.start_turn(self.text_turn(text.strip(),speak))
+        else:
+            self.frames=asyncio.Queue(maxsize=SERVER_AUDIO_BUFFER)
+            self.start_turn(self.voice_turn(int(message.get("sample_rate",16000)),speak))
+
+async def stream(request:web.Request)->web.WebSocketResponse:
+    limiter,sessions=request.app[LIMITER],request.app[SESSIONS]
+    session_id=request.match_info.get("session_id") or request.query.get("session_id")
+    if not valid_session_id(session_id):
+        raise web.HTTPBadRequest(text="invalid session_id")
+    ws=web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    connection=StreamConnection(ws,limiter,sessions.get(session_id))
+    await connection.send({"type":"session","session_id":connection.session.session_id})
+    try:
+        async for message in ws:
+            if message.type==WSMsgType.BINARY:
+                connection.push_frame(message.data)
+            elif message.type==WSMsgType.TEXT:
+                try:
+                    data=json.loads(message.data)
+                except json.JSONDecodeError:
+                    await connection.send({"type":"error","code":"bad_request","message":"messages must be json"})
+                    continue
+                await connection.handle(data if isinstance(data,dict) else {})
+    finally:
+        if connection.busy:
+            connection.task.cancel()
+    return ws
+
+async def _warm(app:web.Application)->None:
+    status=await asyncio.to_thread(warm_up,bool(os.getenv("DEEPGRAM_API_KEY")))
+    logger.info(f"Warm-up: {status}")
+
+async def _close_clients(app:web.Application)->None:
+    await close_async_client()
+
+def create_app(limiter:Optional[TurnLimiter]=None,warm:bool=True)->web.Application:
+    app=web.Application()
+    app[LIMITER]=limiter or TurnLimiter()
+    app[SESSIONS]=SessionRegistry()
+    app.router.add_post("/v1/turns",create_turn)
+    app.router.add_delete("/v1/sessions/{session_id}",delete_session)
+    app.router.add_get("/v1/stream",stream)
+    app.router.add_get("/v1/sessions/{session_id}/stream",stream)
+    app.router.add_get("/v1/traces/{trace_id}",get_trace_handler)
+    app.router.add_get("/healthz",health)
+    app.router.add_get("/metrics",metrics_handler)
+    if warm:
+        app.on_startup.append(_warm)
+    app.on_cleanup.append(_close_clients)
+    return app
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(),host=SERVER_HOST,port=SERVER_PORT)
@@ -0,0 +1,134 @@
+#short-term conversation memory scoped to AgentState.session_id
+#one shared turn log per session, a fixed window of recent turns and a rolling summary of the older ones
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any,Dict,List,Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+#callers that do not pass a session share this one (the cli and single-user scripts)
+DEFAULT_SESSION="default"
+
+SESSION_WINDOW=int(os.getenv("SESSION_WINDOW","6"))
+SESSION_SUMMARY_CHARS=int(os.getenv("SESSION_SUMMARY_CHARS","1200"))
+SESSION_MAX=int(os.getenv("SESSION_MAX","256"))
+SESSION_IDLE_TTL=float(os.getenv("SESSION_IDLE_TTL","3600"))
+
+NO_HISTORY="No history available."
+
+def _clip(text:str,limit:int)->str:
+    text=" ".join(text.split())
+    if len(text)<=limit:
+        return text
+    return text[:limit].rsplit(" ",1)[0]+"..."
+
+class SessionMemory:
+    def __init__(self,window:int=SESSION_WINDOW,summary_chars:int=SESSION_SUMMARY_CHARS):
+        self.window=window
+        self.summary_chars=summary_chars
+        self.turns:List[Dict[str,Any]]=[]
+        self.summary:List[str]=[]
+        self.last_used=time.monotonic()
+        self._lock=threading.Lock()
+
+    #agents of the same turn answer the same input, so their responses join the latest turn
+    def record(self,user_input:str,agent_type:str,response:str)->None:
+        with self._lock:
+            self.last_used=time.monotonic()
+            last=self.turns[-1] if self.turns else None
+            if last is None or last["user_input"]!=user_input or agent_type in last["responses"]:
+                last={"user_input":user_input,"responses":{}}
+                self.turns.append(last)
+            last["responses"][agent_type]=response
+            while len(self.turns)>self.window:
+                self._summarize(self.turns.pop(0))
+
+    #older turns are folded into one line each; the oldest lines go once the summary is full
+    def _summarize(self,turn:Dict[str,Any])->None:
+        parts=[f"User asked: {_clip(turn['user_input'],120)}"]
+        parts.extend(f"{agent}: {_clip(response,100)}" for agent,response in turn["responses"].items())
+        self.summary.append(" | ".join(parts))
+        while self.summary and sum(len(line)+1 for line in self.summary)>self.summary_chars:
+            self.summary.pop(0)
+
+    #formatted like the old buffer memory: the agent only sees its own replies
+    def view(self,agent_type:str)->str:
+        with self._lock:
+            self.last_used=time.monotonic()
+            lines=[]
+            if self.summary:
+                lines.append("Summary of earlier conversation:\n"+"\n".join(self.summary))
+            for turn in self.turns:
+                response=turn["responses"].get(agent_type)
+                if response is None:
+                    continue
+                lines.append(f"Human: {turn['user_input']}")
+                lines.append(f"Ai: {response}")
+            return "\n".join(lines) if lines else NO_HISTORY
+
+    #every agent's replies under each turn, for a prompt that answers as all of them at once
+    def view_all(self)->str:
+        with self._lock:
+            self.last_used=time.monotonic()
+            lines=[]
+            if self.summary:
+                lines.append("Summary of earlier conversation:\n"+"\n".join(self.summary))
+            for turn in self.turns:
+                lines.append(f"Human: {turn['user_input']}")
+                lines.extend(f"{agent.capitalize()}: {response}" for agent,response in turn["responses"].items())
+            return "\n".join(lines) if lines else NO_HISTORY
+
+    def clear(self)->None:
+        with self._lock:
+            self.turns.clear()
+            self.summary.clear()
+
+class SessionStore:
+    def __init__(self,max_sessions:int=SESSION_MAX,idle_ttl:float=SESSION_IDLE_TTL):
+        self.max_sessions=max_sessions
+        self.idle_ttl=idle_ttl
+        self._sessions:"OrderedDict[str,SessionMemory]"=OrderedDict()
+        self._lock=threading.Lock()
+        self.evictions=0
+
+    def get(self,session_id:Optional[str]=None)->SessionMemory:
+        session_id=session_id or DEFAULT_SESSION
+        with self._lock:
+            session=self._sessions.get(session_id)
+            if session is None:
+                session=self._sessions[session_id]=SessionMemory()
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_used=time.monotonic()
+            self._evict()
+            return session
+
+    def _evict(self)->None:
+        now=time.monotonic()
+        while self._sessions:
+            session_id,session=next(iter(self._sessions.items()))
+            if len(self._sessions)<=self.max_sessions and now-session.last_used<=self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.evictions+=1
+
+    def drop(self,session_id:str)->None:
+        with self._lock:
+            self._sessions.pop(session_id,None)
+
+    def clear(self)->None:
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self)->Dict[str,int]:
+        with self._lock:
+            return {
+                "sessions":len(self._sessions),
+                "turns":sum(len(session.turns) for session in self._sessions.values()),
+                "evictions":self.evictions
+            }
+
+session_store=SessionStore()
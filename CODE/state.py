@@ -1,13 +1,27 @@
-from typing import Optional,Dict,Any,List,Tuple,Union
+from typing import Optional,Dict,Any,List,Tuple,Union,Annotated
 from pydantic import BaseModel,Field,model_validator
 
 class ConversationEntry(BaseModel):
     agent:str
     message:str
-    confidence:float
+    confidence:float=0.0
+
+#reducers used by the graph to merge partial updates from concurrent nodes
+def append_history(left:List[ConversationEntry],right:List[ConversationEntry])->List[ConversationEntry]:
+    return (left or [])+(right or [])
+
+def merge_buffer(left:Dict[str,str],right:Dict[str,str])->Dict[str,str]:
+    merged=dict(left or {})
+    merged.update(right or {})
+    return merged
+
+def keep_latest(left:Optional[str],right:Optional[str])->Optional[str]:
+    return right if right is not None else left
 
 class AgentState(BaseModel):
     user_input:str=""
+    #the earlier question a "go deeper" follow-up reopens; user_input keeps what the user actually said
+    resumed_from:Optional[str]=None
     active_agent:Optional[str]=None
     final_response:Optional[str]=None
     is_voice_input:bool=False
@@ -24,13 +38,25 @@ class AgentState(BaseModel):
     user_intent:Optional[str]=None
     topic_type:Optional[str]=None 
 
-    web_results:Optional[str]=None
+    web_results:Annotated[Optional[str],keep_latest]=None
+    #per-agent search results written by the research stage
+    agent_web_results:Annotated[Dict[str, str],merge_buffer]=Field(default_factory=dict)
+    #per-agent long-term memories retrieved in one batched lookup
+    agent_relevant_history:Annotated[Dict[str, str],merge_buffer]=Field(default_factory=dict)
+    #estimated size of each agent's rendered prompt after context budgeting
+    prompt_tokens:Annotated[Dict[str, int],merge_buffer]=Field(default_factory=dict)
+    #answers served by the semantic response cache, found by the research stage
+    cached_responses:Annotated[Dict[str, Dict[str, Any]],merge_buffer]=Field(default_factory=dict)
     memory_context:Optional[str]=None
-    response_buffer:Dict[str, str]=Field(default_factory=dict)
-    conversation_history:List[ConversationEntry]=Field(default_factory=list)
+    response_buffer:Annotated[Dict[str, str],merge_buffer]=Field(default_factory=dict)
+    #agents left out of the answer, with the reason (e.g. the turn deadline)
+    dropped_agents:Annotated[Dict[str, str],merge_buffer]=Field(default_factory=dict)
+    conversation_history:Annotated[List[ConversationEntry],append_history]=Field(default_factory=list)
     #metadata
     user_id:str="user_001"
     session_id:Optional[str]=None
+    #telemetry trace of the turn that produced this state
+    trace_id:Optional[str]=None
 
     is_concurrent:bool=True
 
@@ -48,20 +74,14 @@ class AgentState(BaseModel):
                     except (TypeError, ValueError):
                         values[conf]=0.0
             
-            if 'conversation_history' in values:
-                if not isinstance(values['conversation_history'],list):
-                    values['conversation_history']=[]
-                else:
-                    history=[]
-                    for entry in values['conversation_history']:
-                        if isinstance(entry, dict):
-                            entry['confidence']=float(entry.get('confidence', 0.0))
-                            history.append(ConversationEntry(**entry))
-                    values['conversation_history']=history
+            #pydantic converts dict entries itself and reuses ConversationEntry instances as they are,
+            #so a hop through the graph does not rebuild the history
+            if 'conversation_history' in values and not isinstance(values['conversation_history'],list):
+                values['conversation_history']=[]
 
             if 'topic_type' in values:
                 valid_topics={'career','education','technical','general'}
-                if values['topic_type'] not in valid_topics:
+                if values['topic_type'] is not None and values['topic_type'] not in valid_topics:
                     values['topic_type']='general'
         return values
 
@@ -88,6 +108,11 @@ class AgentState(BaseModel):
             confidence=confidence
         ))
 
+    #what research, the prompts and the response cache answer this turn
+    @property
+    def question(self)->str:
+        return self.resumed_from or self.user_input
+
     def get_best_response(self)->Tuple[str, str]:
         confidences = {
             "realist": self.realist_confidence,
@@ -115,5 +140,25 @@ class AgentState(BaseModel):
             self.response_buffer['planner']=self.planner_response
         return self
 
+def agent_update(agent_type:str,response:str,confidence:float)->Dict[str,Any]:
+    #partial state written by an agent node, merged through the reducers above
+    response=str(response).strip()
+    if not response:
+        return {}
+    confidence=max(0.0, min(1.0, float(confidence)))
+    return {
+        f"{agent_type}_response":response,
+        f"{agent_type}_confidence":confidence,
+        "response_buffer":{agent_type:response},
+        "conversation_history":[ConversationEntry(agent=agent_type,message=response,confidence=confidence)]
+    }
+
+def dropped_update(agent_type:str,confidence:float,reason:str="deadline")->Dict[str,Any]:
+    #an agent that gave no answer keeps its fallback confidence and writes no response, so nothing of it is shown or spoken
+    return {
+        f"{agent_type}_confidence":max(0.0, min(1.0, float(confidence))),
+        "dropped_agents":{agent_type:reason}
+    }
+
 def initialize_state()->AgentState:
     return AgentState()
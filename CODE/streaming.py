@@ -0,0 +1,174 @@
+#sentence-chunked speech for streamed agent responses
+#tokens are cut into speakable chunks and synthesized while later tokens are still generated
+import os
+import re
+import time
+import asyncio
+import inspect
+from typing import Dict,List,Optional,Callable,Awaitable,Iterable,Tuple,Union,Pattern
+
+#tag put on the llm calls whose tokens should be spoken
+SPEAK_TAG="speak"
+
+#synthesis requests in flight at once; later chunks wait their turn behind earlier ones
+TTS_CONCURRENCY=int(os.getenv("TTS_CONCURRENCY","4"))
+
+SENTENCE_BOUNDARY=re.compile(r"(?<=[.!?;:])\s+|\n+")
+MARKUP=re.compile(r"[*#`_]+")
+
+def clean_chunk(text:str)->str:
+    text=MARKUP.sub("",text)
+    text=re.sub(r"^\s*[-•]\s+","",text)
+    return " ".join(text.split())
+
+class SentenceSegmenter:
+    #min_chars avoids synthesizing tiny fragments, max_chars bounds a run-on chunk
+    #a stop marker is a literal string or a compiled pattern
+    def __init__(self,min_chars:int=40,max_chars:int=240,stop_markers:Iterable[Union[str,Pattern]]=(),stop_note:Optional[str]=None):
+        self.min_chars=min_chars
+        self.max_chars=max_chars
+        self.stop_markers=tuple(re.compile(re.escape(marker)) if isinstance(marker,str) else marker for marker in stop_markers)
+        self.stop_note=stop_note
+        self.buffer=""
+        #everything pushed so far; the buffer is always its unsent tail
+        self.text=""
+        self.stopped=False
+        self.emitted=0
+
+    def _find_cut(self)->Optional[int]:
+        for match in SENTENCE_BOUNDARY.finditer(self.buffer):
+            if match.start()>=self.min_chars:
+                return match.end()
+        if len(self.buffer)>self.max_chars:
+            space=self.buffer.rfind(" ",self.min_chars,self.max_chars)
+            return space+1 if space>0 else self.max_chars
+        return None
+
+    def _take(self,cut:int)->Optional[str]:
+        chunk=clean_chunk(self.buffer[:cut])
+        self.buffer=self.buffer[cut:]
+        if chunk:
+            self.emitted+=1
+            return chunk
+        return None
+
+    def _drain(self)->List[str]:
+        chunks=[]
+        cut=self._find_cut()
+        while cut is not None:
+            chunk=self._take(cut)
+            if chunk:
+                chunks.append(chunk)
+            cut=self._find_cut()
+        return chunks
+
+    def push(self,text:str)->List[str]:
+        if self.stopped or not text:
+            return []
+        self.buffer+=text
+        self.text+=text
+        #markers are searched in the whole text so a line-anchored one only matches at a real line start, not where a chunk was cut
+        start=len(self.text)-len(self.buffer)
+        for marker in self.stop_markers:
+            match=marker.search(self.text,start)
+            if match:
+                self.buffer=self.buffer[:match.start()-start]
+                chunks=self._drain()+self.flush()
+                if self.stop_note:
+                    chunks.append(self.stop_note)
+                self.stopped=True
+                return chunks
+        return self._drain()
+
+    def flush(self)->List[str]:
+        if self.stopped:
+            return []
+        chunk=self._take(len(self.buffer))
+        return [chunk] if chunk else []
+
+class SpeechStreamer:
+    #plays agents in the order they start talking; chunks are synthesized in the background while earlier ones play
+    #play blocks until the clip has finished, so the next clip starts on real completion rather than a timer
+    #an async play is awaited with (agent, audio) instead
+    def __init__(self,synthesize:Optional[Callable[[str,str],Awaitable[bytes]]]=None,play:Optional[Callable]=None,
+                 max_concurrent:int=TTS_CONCURRENCY):
+        if synthesize is None or play is None:
+            from tts_stt import synthesize_async,play_audio
+            synthesize=synthesize or synthesize_async
+            play=play or play_audio
+        self._synthesize=synthesize
+        self._play=play
+        self._slots=asyncio.Semaphore(max_concurrent)
+        self._queues:Dict[str,asyncio.Queue]={}
+        self._finished:set=set()
+        self._order:asyncio.Queue=asyncio.Queue()
+        self._player=asyncio.create_task(self._run())
+        self.started_at=time.perf_counter()
+        self.first_audio_at:Optional[float]=None
+
+    @property
+    def time_to_first_audio(self)->Optional[float]:
+        if self.first_audio_at is None:
+            return None
+        return self.first_audio_at-self.started_at
+
+    def submit(self,agent:str,text:str)->None:
+        if agent in self._finished:
+            return
+        if agent not in self._queues:
+            self._queues[agent]=asyncio.Queue()
+            self._order.put_nowait(agent)
+        self._queues[agent].put_nowait(asyncio.ensure_future(self._synthesize_limited(text,agent)))
+
+    async def _synthesize_limited(self,text:str,agent:str)->bytes:
+        async with self._slots:
+            return await self._synthesize(text,agent)
+
+    def finish(self,agent:str)->None:
+        if agent in self._queues and agent not in self._finished:
+            self._finished.add(agent)
+            self._queues[agent].put_nowait(None)
+
+    async def close(self)->None:
+        for agent in list(self._queues):
+            self.finish(agent)
+        self._order.put_nowait(None)
+        await self._player
+
+    async def _run(self)->None:
+        while True:
+            agent=await self._order.get()
+            if agent is None:
+                return
+            queue=self._queues[agent]
+            while True:
+                pending=await queue.get()
+                if pending is None:
+                    break
+                try:
+                    audio=await pending
+                except Exception as e:
+                    print(f"TTS Error: {str(e)}")
+                    continue
+                if not audio:
+                    continue
+                if self.first_audio_at is None:
+                    self.first_audio_at=time.perf_counter()
+                #an async play (e.g. sending to a client) runs on the loop, a blocking one in a thread
+                if inspect.iscoroutinefunction(self._play):
+                    await self._play(agent,audio)
+                else:
+                    await asyncio.to_thread(self._play,audio)
+
+#speaks finished responses in order: the first sentence plays while the rest, and the next agents, are synthesized
+async def speak_responses(responses:Iterable[Tuple[str,str]],streamer:Optional[SpeechStreamer]=None)->Optional[float]:
+    streamer=streamer or SpeechStreamer()
+    try:
+        for agent,text in responses:
+            segmenter=SentenceSegmenter()
+            for chunk in segmenter.push(text)+segmenter.flush():
+                streamer.submit(agent,chunk)
+            streamer.finish(agent)
+    finally:
+        await streamer.close()
+    return streamer.time_to_first_audio
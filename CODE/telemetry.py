@@ -0,0 +1,412 @@
+#per-turn tracing and process-wide metrics
+#spans nest through a contextvar, so asyncio tasks started inside a turn land in that turn's trace;
+#metrics are rendered in the prometheus text format and every finished turn is kept as a json trace
+import os
+import json
+import time
+import uuid
+import inspect
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict,defaultdict
+from contextlib import contextmanager
+from typing import Any,Callable,Dict,Iterator,List,Optional,Tuple
+from dotenv import load_dotenv
+from context import count_tokens
+from lazy import LazyResource
+
+load_dotenv()
+logger=logging.getLogger(__name__)
+
+#finished traces kept in memory, TRACE_PATH also appends each one as a json line
+TRACE_HISTORY=int(os.getenv("TRACE_HISTORY","200"))
+TRACE_PATH=os.getenv("TRACE_PATH") or None
+#0 leaves the standalone /metrics endpoint off
+METRICS_PORT=int(os.getenv("METRICS_PORT","0"))
+METRICS_PREFIX="voiceagent"
+
+DURATION_BUCKETS=(0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0)
+
+#metrics
+
+def _escape(value:Any)->str:
+    return str(value).replace("\\","\\\\").replace("\n","\\n").replace('"','\\"')
+
+def _labels(names:Tuple[str,...],values:Tuple[Any,...],extra:str="")->str:
+    pairs=[f'{name}="{_escape(value)}"' for name,value in zip(names,values)]
+    if extra:
+        pairs.append(extra)
+    return "{"+",".join(pairs)+"}" if pairs else ""
+
+class Counter:
+    def __init__(self,name:str,help:str,labelnames:Tuple[str,...]=()):
+        self.name=name
+        self.help=help
+        self.labelnames=labelnames
+        self._values:Dict[Tuple[Any,...],float]=defaultdict(float)
+        self._lock=threading.Lock()
+
+    def inc(self,amount:float=1.0,**labels)->None:
+        key=tuple(labels.get(name,"") for name in self.labelnames)
+        with self._lock:
+            self._values[key]+=amount
+
+    def value(self,**labels)->float:
+        return self._values.get(tuple(labels.get(name,"") for name in self.labelnames),0.0)
+
+    def render(self)->List[str]:
+        lines=[f"# HELP {self.name} {self.help}",f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key,value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames,key)} {value:g}")
+        return lines
+
+class Histogram:
+    def __init__(self,name:str,help:str,labelnames:Tuple[str,...]=(),buckets:Tuple[float,...]=DURATION_BUCKETS):
+        self.name=name
+        self.help=help
+        self.labelnames=labelnames
+        self.buckets=buckets
+        #labels -> (bucket counts, sum, count)
+        self._values:Dict[Tuple[Any,...],list]={}
+        self._lock=threading.Lock()
+
+    def observe(self,value:float,**labels)->None:
+        key=tuple(labels.get(name,"") for name in self.labelnames)
+        with self._lock:
+            series=self._values.setdefault(key,[[0]*len(self.buckets),0.0,0])
+            for index,bound in enumerate(self.buckets):
+                if value<=bound:
+                    series[0][index]+=1
+            series[1]+=value
+            series[2]+=1
+
+    def render(self)->List[str]:
+        lines=[f"# HELP {self.name} {self.help}",f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key,(counts,total,count) in sorted(self._values.items()):
+                for bound,bucket_count in zip(self.buckets,counts):
+                    bucket_labels=_labels(self.labelnames,key,'le="%g"'%bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+                bucket_labels=_labels(self.labelnames,key,'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames,key)} {total:g}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames,key)} {count}")
+        return lines
+
+class Gauge:
+    def __init__(self,name:str,help:str,labelnames:Tuple[str,...]=()):
+        self.name=name
+        self.help=help
+        self.labelnames=labelnames
+        self._values:Dict[Tuple[Any,...],float]={}
+        self._lock=threading.Lock()
+
+    def set(self,value:float,**labels)->None:
+        key=tuple(labels.get(name,"") for name in self.labelnames)
+        with self._lock:
+            self._values[key]=value
+
+    def render(self)->List[str]:
+        lines=[f"# HELP {self.name} {self.help}",f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key,value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames,key)} {value:g}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self,prefix:str=METRICS_PREFIX):
+        self.prefix=prefix
+        self._metrics:"OrderedDict[str,Any]"=OrderedDict()
+        #name -> stats function of a cache that keeps its own hit/miss counts
+        self._caches:Dict[str,Callable[[],Dict[str,Any]]]={}
+        self._lock=threading.Lock()
+
+    def counter(self,name:str,help:str,labelnames:Tuple[str,...]=())->Counter:
+        return self._register(Counter(f"{self.prefix}_{name}",help,labelnames))
+
+    def gauge(self,name:str,help:str,labelnames:Tuple[str,...]=())->Gauge:
+        return self._register(Gauge(f"{self.prefix}_{name}",help,labelnames))
+
+    def histogram(self,name:str,help:str,labelnames:Tuple[str,...]=(),buckets:Tuple[float,...]=DURATION_BUCKETS)->Histogram:
+        return self._register(Histogram(f"{self.prefix}_{name}",help,labelnames,buckets))
+
+    def _register(self,metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name,metric)
+
+    def register_cache(self,name:str,stats:Callable[[],Dict[str,Any]])->None:
+        with self._lock:
+            self._caches[name]=stats
+
+    def cache_stats(self)->Dict[str,Dict[str,Any]]:
+        with self._lock:
+            caches=dict(self._caches)
+        results={}
+        for name,stats in caches.items():
+            try:
+                results[name]=stats() or {}
+            except Exception as e:
+                logger.error(f"Cache stats failed for {name}: {str(e)}")
+        return results
+
+    def _render_caches(self)->List[str]:
+        caches=self.cache_stats()
+        series={
+            "cache_hits_total":("counter","Lookups answered by the cache",lambda s:s.get("hits",0)+s.get("disk_hits",0)),
+            "cache_misses_total":("counter","Lookups the cache could not answer",lambda s:s.get("misses",0)),
+            "cache_entries":("gauge","Entries currently held by the cache",lambda s:s.get("size",s.get("entries",0)))
+        }
+        lines=[]
+        for suffix,(kind,help,value) in series.items():
+            name=f"{self.prefix}_{suffix}"
+            lines+=[f"# HELP {name} {help}",f"# TYPE {name} {kind}"]
+            lines+=[f'{name}{{cache="{_escape(cache)}"}} {value(stats):g}' for cache,stats in sorted(caches.items())]
+        return lines
+
+    def render(self)->str:
+        with self._lock:
+            metrics=list(self._metrics.values())
+        lines=[]
+        for metric in metrics:
+            lines+=metric.render()
+        lines+=self._render_caches()
+        return "\n".join(lines)+"\n"
+
+metrics=MetricsRegistry()
+
+TURNS=metrics.counter("turns_total","Conversation turns by outcome",("status",))
+TURN_SECONDS=metrics.histogram("turn_duration_seconds","Wall time of a conversation turn",("topic",))
+SPAN_SECONDS=metrics.histogram("span_duration_seconds","Duration of graph nodes and external calls",("span","kind"))
+EXTERNAL_CALLS=metrics.counter("external_calls_total","Calls to external services",("service","operation","status"))
+ERRORS=metrics.counter("errors_total","Errors raised inside a span, by span",("component",))
+LLM_TOKENS=metrics.counter("llm_tokens_total","Tokens sent to and generated by the llm",("agent","direction"))
+
+def register_cache(name:str,stats:Callable[[],Dict[str,Any]])->None:
+    metrics.register_cache(name,stats)
+
+def render_prometheus()->str:
+    return metrics.render()
+
+#tracing
+
+class Span:
+    def __init__(self,name:str,kind:str,parent:Optional["Span"],attributes:Dict[str,Any]):
+        self.name=name
+        self.kind=kind
+        self.span_id=uuid.uuid4().hex[:16]
+        self.parent_id=parent.span_id if parent else None
+        #the agent a call is made for is inherited from the enclosing node
+        if "agent" not in attributes and parent and "agent" in parent.attributes:
+            attributes["agent"]=parent.attributes["agent"]
+        self.attributes=attributes
+        self.start=time.time()
+        self._started=time.perf_counter()
+        self.duration:Optional[float]=None
+        self.status="ok"
+        self.error:Optional[str]=None
+
+    def set(self,**attributes)->None:
+        self.attributes.update(attributes)
+
+    def to_dict(self,trace:Optional["Trace"]=None)->Dict[str,Any]:
+        attributes=dict(self.attributes)
+        if trace is not None:
+            attributes.setdefault("session_id",trace.session_id)
+            if trace.topic:
+                attributes.setdefault("topic",trace.topic)
+        return {
+            "span_id":self.span_id,
+            "parent_id":self.parent_id,
+            "name":self.name,
+            "kind":self.kind,
+            "start":self.start,
+            "duration_ms":round(self.duration*1000,3) if self.duration is not None else None,
+            "status":self.status,
+            "error":self.error,
+            "attributes":attributes
+        }
+
+class Trace:
+    def __init__(self,session_id:Optional[str],attributes:Dict[str,Any]):
+        self.trace_id=uuid.uuid4().hex
+        self.session_id=session_id
+        self.topic:Optional[str]=None
+        self.attributes=attributes
+        self.start=time.time()
+        self._started=time.perf_counter()
+        self.duration:Optional[float]=None
+        self.spans:List[Span]=[]
+        self._lock=threading.Lock()
+
+    def add(self,span:Span)->None:
+        with self._lock:
+            self.spans.append(span)
+
+    @property
+    def status(self)->str:
+        return "error" if any(span.status=="error" for span in self.spans) else "ok"
+
+    def to_dict(self)->Dict[str,Any]:
+        with self._lock:
+            spans=sorted(self.spans,key=lambda span:span.start)
+        return {
+            "trace_id":self.trace_id,
+            "session_id":self.session_id,
+            "topic":self.topic,
+            "start":self.start,
+            "duration_ms":round(self.duration*1000,3) if self.duration is not None else None,
+            "status":self.status,
+            "attributes":self.attributes,
+            "spans":[span.to_dict(self) for span in spans]
+        }
+
+_current_trace:contextvars.ContextVar=contextvars.ContextVar("trace",default=None)
+_current_span:contextvars.ContextVar=contextvars.ContextVar("span",default=None)
+
+_traces:"OrderedDict[str,Trace]"=OrderedDict()
+_traces_lock=threading.Lock()
+
+def current_trace()->Optional[Trace]:
+    return _current_trace.get()
+
+#one writer thread, so a turn finishing on the event loop never waits on the file and lines keep their order
+_trace_writer=LazyResource(lambda:ThreadPoolExecutor(max_workers=1,thread_name_prefix="trace-writer"),"trace writer")
+
+def _append_trace(trace:Trace)->None:
+    try:
+        with open(TRACE_PATH,"a",encoding="utf-8") as f:
+            f.write(json.dumps(trace.to_dict())+"\n")
+    except OSError as e:
+        logger.error(f"Trace write failed: {str(e)}")
+
+def _store_trace(trace:Trace)->None:
+    with _traces_lock:
+        _traces[trace.trace_id]=trace
+        while len(_traces)>TRACE_HISTORY:
+            _traces.popitem(last=False)
+    if TRACE_PATH:
+        _trace_writer.get().submit(_append_trace,trace)
+
+@contextmanager
+def start_trace(session_id:Optional[str]=None,**attributes)->Iterator[Trace]:
+    trace=Trace(session_id,attributes)
+    trace_token=_current_trace.set(trace)
+    span_token=_current_span.set(None)
+    failed=False
+    try:
+        yield trace
+    except BaseException:
+        failed=True
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        trace.duration=time.perf_counter()-trace._started
+        TURNS.inc(status="error" if failed or trace.status=="error" else "ok")
+        TURN_SECONDS.observe(trace.duration,topic=trace.topic or "unknown")
+        _store_trace(trace)
+
+def set_topic(topic:Optional[str])->None:
+    trace=_current_trace.get()
+    if trace is not None and topic:
+        trace.topic=topic
+
+#kind is "node" for graph nodes, "external" for calls leaving the process (tagged with service and operation)
+#spans outside a turn, e.g. write-behind persistence, still feed the metrics
+@contextmanager
+def span(name:str,kind:str="internal",**attributes)->Iterator[Span]:
+    current=Span(name,kind,_current_span.get(),attributes)
+    token=_current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status="error"
+        current.error=f"{type(e).__name__}: {e}"
+        ERRORS.inc(component=name)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.duration=time.perf_counter()-current._started
+        SPAN_SECONDS.observe(current.duration,span=name,kind=kind)
+        if kind=="external":
+            EXTERNAL_CALLS.inc(service=attributes.get("service",""),operation=attributes.get("operation",name),status=current.status)
+        trace=_current_trace.get()
+        if trace is not None:
+            trace.add(current)
+
+#token usage of one llm call; gemini's usage metadata when the response carries it, the prompt estimate otherwise
+def record_llm_usage(agent:str,prompt_tokens:int,response:Any)->None:
+    usage=getattr(response,"usage_metadata",None) or {}
+    content=getattr(response,"content",response)
+    prompt=usage.get("input_tokens") or prompt_tokens
+    completion=usage.get("output_tokens") or count_tokens(str(content or ""))
+    LLM_TOKENS.inc(prompt,agent=agent,direction="prompt")
+    LLM_TOKENS.inc(completion,agent=agent,direction="completion")
+    current=_current_span.get()
+    if current is not None:
+        current.set(prompt_tokens=prompt,completion_tokens=completion)
+
+#wraps a graph node, sync or async, in a span; agent nodes pass agent= so their external calls are tagged with it
+def traced_node(name:str,node:Callable,**attributes)->Callable:
+    if inspect.iscoroutinefunction(node):
+        async def run_async(state):
+            with span(name,kind="node",**attributes):
+                return await node(state)
+        return run_async
+    def run(state):
+        with span(name,kind="node",**attributes):
+            return node(state)
+    return run
+
+def get_trace(trace_id:str)->Optional[Dict[str,Any]]:
+    with _traces_lock:
+        trace=_traces.get(trace_id)
+    return trace.to_dict() if trace else None
+
+def recent_traces(limit:int=20,session_id:Optional[str]=None)->List[Dict[str,Any]]:
+    with _traces_lock:
+        traces=[trace for trace in reversed(_traces.values()) if session_id is None or trace.session_id==session_id]
+    return [trace.to_dict() for trace in traces[:limit]]
+
+#standalone exporter: /metrics in the prometheus text format, /traces and /traces/<id> as json
+_server=None
+_server_lock=threading.Lock()
+
+def start_metrics_server(port:Optional[int]=None,host:str="0.0.0.0"):
+    global _server
+    port=METRICS_PORT if port is None else port
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path=self.path.split("?",1)[0].rstrip("/")
+            trace=get_trace(path[len("/traces/"):]) if path.startswith("/traces/") else None
+            if path=="/metrics":
+                self._send(200,render_prometheus(),"text/plain; version=0.0.4")
+            elif path=="/traces":
+                self._send(200,json.dumps(recent_traces()),"application/json")
+            elif trace:
+                self._send(200,json.dumps(trace),"application/json")
+            else:
+                self._send(404,"not found","text/plain")
+
+        def _send(self,status:int,body:str,content_type:str):
+            data=body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type",content_type)
+            self.send_header("Content-Length",str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self,format,*args):
+            pass
+    with _server_lock:
+        if _server is None:
+            _server=ThreadingHTTPServer((host,port),Handler)
+            threading.Thread(target=_server.serve_forever,name="metrics-server",daemon=True).start()
+            logger.info(f"Metrics endpoint listening on {host}:{port}")
+    return _server
@@ -0,0 +1,20 @@
+#the modules live flat in CODE/, next to this folder
+import os
+import sys
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_pipeline
+
+#the fakes and the offline environment are taken out again after each test
+@pytest.fixture
+def app(monkeypatch):
+    for name,value in bench_pipeline.offline_environment().items():
+        monkeypatch.setenv(name,value)
+    latency={name:bench_pipeline.LatencyModel(name,median,p95,seed=0,time_scale=0.0) for name,(median,p95) in bench_pipeline.SERVICE_LATENCY.items()}
+    app,uninstall=bench_pipeline.install_fakes(latency,bench_pipeline.StageRecorder())
+    #a search cached by an earlier test would skip the calls a test looks for
+    bench_pipeline.clear_caches()
+    yield app
+    uninstall()
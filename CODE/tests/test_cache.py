@@ -0,0 +1,22 @@
+#the sqlite tier as async callers use it
+import asyncio
+import threading
+from cache import TTLCache
+
+def test_disk_tier_stays_off_the_event_loop(tmp_path,monkeypatch):
+    cache=TTLCache(maxsize=1,ttl=60,path=str(tmp_path/"cache.sqlite"))
+    loop_thread=threading.get_ident()
+    threads=[]
+    for name in ("get","set"):
+        original=getattr(cache.store,name)
+        def record(*args,original=original):
+            threads.append(threading.get_ident())
+            return original(*args)
+        monkeypatch.setattr(cache.store,name,record)
+    async def main():
+        await cache.aset("a","1")
+        await cache.aset("b","2")
+        #one memory slot, so each read goes back to sqlite
+        return await cache.aget("a"),await cache.aget("b")
+    assert asyncio.run(main())==("1","2")
+    assert len(threads)==4 and loop_thread not in threads
@@ -0,0 +1,69 @@
+#the blocking entry point driven end to end against the benchmark's offline fakes
+import bench_pipeline
+
+def test_run_conversation_with_session(app):
+    state=app.run_conversation("Should I take an internship or do a final year project?",session_id="sync-test")
+    assert state.session_id=="sync-test"
+    assert state.trace_id
+    assert all(getattr(state,f"{agent}_response") for agent in app.AGENT_NODES)
+
+def test_run_conversation_positional_arguments(app):
+    state=app.run_conversation("How do I learn rust quickly?",False,False,"sync-sequential")
+    assert state.session_id=="sync-sequential"
+    assert state.response_buffer
+
+def test_single_call_topic_only_settles_unsure_inputs(app,monkeypatch):
+    import ensemble
+    import topic_classifier
+    reply='{"topic":"education","optimist":"Go for it!"}'
+    state=app.AgentState(user_input="Should I take an internship or do a final year project?",topic_type="career")
+    monkeypatch.setattr(topic_classifier,"_needs_llm",lambda confidence:False)
+    update,answered=ensemble.apply_reply(state,["optimist"],reply,10)
+    assert answered==["optimist"] and "topic_type" not in update
+    monkeypatch.setattr(topic_classifier,"_needs_llm",lambda confidence:True)
+    topic_classifier.topic_cache.clear()
+    update,_=ensemble.apply_reply(state,["optimist"],reply,10)
+    assert update["topic_type"]=="education"
+    topic_classifier.topic_cache.clear()
+
+def test_sync_turns_share_one_loop_and_search_client(app,monkeypatch):
+    import asyncio
+    import websearch
+    seen=[]
+    async def turn(user_input,is_voice,concurrent,*,session_id):
+        seen.append((asyncio.get_running_loop(),websearch.get_async_client()))
+        return session_id
+    monkeypatch.setattr(app,"run_conversation_async",turn)
+    assert app.run_conversation("first",session_id="a")=="a"
+    assert app.run_conversation("second",session_id="b")=="b"
+    (first_loop,first_client),(second_loop,second_client)=seen
+    assert first_loop is second_loop and first_client is second_client
+    assert not first_client.is_closed
+
+def test_fakes_are_taken_out_again():
+    import google.generativeai as genai
+    import memory
+    import websearch
+    embed_content=genai.embed_content
+    llm_set=memory._llm.initialized
+    latency={name:bench_pipeline.LatencyModel(name,median,p95,seed=0,time_scale=0.0) for name,(median,p95) in bench_pipeline.SERVICE_LATENCY.items()}
+    _,uninstall=bench_pipeline.install_fakes(latency,bench_pipeline.StageRecorder())
+    assert genai.embed_content is not embed_content
+    uninstall()
+    assert genai.embed_content is embed_content
+    assert memory._llm.initialized==llm_set
+    assert websearch._session is None or not isinstance(websearch._session,bench_pipeline.FakeSerperSession)
+
+def test_go_deeper_keeps_what_the_user_said(app,monkeypatch):
+    import scheduling
+    from session_memory import session_store
+    monkeypatch.setattr(scheduling,"DEFAULT_POLICY",("top_k",1))
+    question="Should I take an internship or do a final year project?"
+    first=app.run_conversation(question,session_id="deeper")
+    assert len(first.dropped_agents)==2
+    follow_up=app.run_conversation("tell me more",session_id="deeper")
+    assert follow_up.user_input=="tell me more"
+    assert follow_up.resumed_from==question and follow_up.question==question
+    assert all(getattr(follow_up,f"{agent}_response") for agent in first.dropped_agents)
+    said=[turn["user_input"] for turn in session_store.get("deeper").turns]
+    assert said==[question,"tell me more"]
@@ -0,0 +1,28 @@
+#hedged reads: which attempt answers when both finish together or fail
+import asyncio
+import pytest
+from deadline import hedged
+
+def run_hedged(outcomes,hedge_after_ms=10):
+    calls=[]
+    async def call():
+        index=len(calls)
+        calls.append(index)
+        delay,error=outcomes[index]
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return f"attempt {index}"
+    return asyncio.run(hedged(call,hedge_after_ms,"test"))
+
+def test_success_wins_when_both_finish_in_the_same_round():
+    #the primary fails and the hedge succeeds on the same tick
+    assert run_hedged([(0.03,ValueError("primary")),(0.02,None)])=="attempt 1"
+    assert run_hedged([(0.03,None),(0.02,ValueError("hedge"))])=="attempt 0"
+
+def test_failed_primary_leaves_the_hedge_to_answer():
+    assert run_hedged([(0.02,ValueError("primary")),(0.05,None)])=="attempt 1"
+
+def test_raises_only_when_every_attempt_failed():
+    with pytest.raises(ValueError,match="primary"):
+        run_hedged([(0.03,ValueError("primary")),(0.05,ValueError("hedge"))])
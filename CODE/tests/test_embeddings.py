@@ -0,0 +1,22 @@
+#the coalescing batcher settles every caller, including when the batch call misbehaves
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from embeddings import EmbeddingBatcher
+
+def test_short_batch_fails_every_caller_at_once():
+    batcher=EmbeddingBatcher(lambda texts:[[0.0]]*(len(texts)-1),window=0.05,max_batch=8,workers=1)
+    started=time.perf_counter()
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures=[pool.submit(batcher.embed,f"text {index}",5.0) for index in range(3)]
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+    assert time.perf_counter()-started<2.0
+    assert batcher.stats()["errors"]==1 and batcher.stats()["timeouts"]==0
+
+def test_batch_answers_each_text():
+    batcher=EmbeddingBatcher(lambda texts:[[float(len(text))] for text in texts],window=0.05,max_batch=8,workers=1)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        results=list(pool.map(lambda text:batcher.embed(text,5.0),["a","bb","a"]))
+    assert results==[[1.0],[2.0],[1.0]]
@@ -0,0 +1,32 @@
+#shutdown of the write-behind queue when the writer is stuck
+import time
+import threading
+from memory_writer import MemoryWriter
+
+def test_close_does_not_block_on_a_full_queue():
+    release=threading.Event()
+    written=[]
+    def write_batch(records):
+        release.wait(5)
+        written.extend(records)
+    writer=MemoryWriter(write_batch,batch_size=1,flush_interval=0.01,max_queue=2)
+    assert writer.submit({"id":"first"})
+    #the writer thread is now stuck on the first record, so two more fill the queue
+    time.sleep(0.05)
+    assert writer.submit({"id":"second"}) and writer.submit({"id":"third"})
+    started=time.monotonic()
+    writer.close(timeout=0.2)
+    assert time.monotonic()-started<1.0
+    assert writer.stats()["dropped"]==2
+    release.set()
+    writer._thread.join(1)
+    assert not writer._thread.is_alive()
+    assert [record["id"] for record in written]==["first"]
+
+def test_close_writes_everything_queued():
+    written=[]
+    writer=MemoryWriter(written.extend,batch_size=8,flush_interval=0.01)
+    for i in range(5):
+        writer.submit({"id":str(i)})
+    writer.close(timeout=2)
+    assert len(written)==5 and writer.stats()["dropped"]==0
@@ -0,0 +1,26 @@
+#load shedding of the rest endpoint with a stubbed turn, so no service is called
+import asyncio
+from aiohttp.test_utils import TestClient,TestServer
+import server
+from state import AgentState
+
+async def slow_turn(text,*args,session_id=None,**kwargs):
+    await asyncio.sleep(0.2)
+    return AgentState(user_input=text,session_id=session_id,final_response="ok")
+
+async def burst(session_ids):
+    client=TestClient(TestServer(server.create_app(limiter=server.TurnLimiter(1,1,queue_timeout=5),warm=False)))
+    await client.start_server()
+    try:
+        responses=await asyncio.gather(*[client.post("/v1/turns",json={"text":"hi","session_id":session_id}) for session_id in session_ids])
+        return sorted(response.status for response in responses)
+    finally:
+        await client.close()
+
+def test_turns_for_one_session_are_shed(monkeypatch):
+    monkeypatch.setattr(server,"run_conversation_async",slow_turn)
+    assert asyncio.run(burst(["same"]*5))==[200,200,503,503,503]
+
+def test_turns_for_many_sessions_are_shed(monkeypatch):
+    monkeypatch.setattr(server,"run_conversation_async",slow_turn)
+    assert asyncio.run(burst([f"s{index}" for index in range(5)]))==[200,200,503,503,503]
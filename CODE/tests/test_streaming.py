@@ -0,0 +1,34 @@
+#the realist's spoken answer stops where its sources begin, however the heading is written
+import pytest
+from streaming import SentenceSegmenter
+from realistic import SOURCES_MARKER,finish_response
+
+def speak(tokens):
+    segmenter=SentenceSegmenter(min_chars=5,stop_markers=(SOURCES_MARKER,),stop_note="See the sources.")
+    chunks=[]
+    for token in tokens:
+        chunks.extend(segmenter.push(token))
+    return chunks+segmenter.flush()
+
+@pytest.mark.parametrize("heading",["SOURCES:","Sources :","sources  :"])
+def test_stops_at_sources_heading(heading):
+    text=f"Rust has a steep learning curve. Practice daily.\n\n{heading}\nhttps://example.com"
+    tokens=[text[i:i+4] for i in range(0,len(text),4)]
+    assert speak(tokens)==["Rust has a steep learning curve.","Practice daily.","See the sources."]
+
+def test_stops_at_finish_response_heading():
+    text=finish_response("Rust has a steep learning curve.","https://example.com")
+    assert speak([text])==["Rust has a steep learning curve.","See the sources."]
+
+def test_literal_marker_still_supported():
+    segmenter=SentenceSegmenter(min_chars=5,stop_markers=("END",))
+    assert segmenter.push("First part here. ENDtrailing")==["First part here."]
+
+@pytest.mark.parametrize("body",[
+    "I checked several sources: they all agree rust takes months.",
+    "The data is mixed; sources: surveys and job boards disagree on demand."
+])
+def test_inline_sources_mention_is_spoken(body):
+    tokens=[body[i:i+3] for i in range(0,len(body),3)]
+    assert " ".join(speak(tokens))==body
+    assert SOURCES_MARKER.split(finish_response(body,"https://example.com"),1)[0].strip()==body
@@ -0,0 +1,33 @@
+#spans from the blocking research path and the trace file
+import json
+import time
+import threading
+import telemetry
+from telemetry import start_trace,span
+
+def test_sync_research_spans_stay_in_the_turn(app):
+    import research
+    from state import AgentState
+    with start_trace("telemetry-test") as trace:
+        with span("research",kind="node") as node:
+            update=research.research_node(AgentState(user_input="How do I learn rust quickly?",topic_type="technical"))
+    assert update["agent_web_results"]
+    searches=[recorded for recorded in trace.spans if recorded.name=="serper.search"]
+    assert searches and all(recorded.parent_id==node.span_id for recorded in searches)
+
+def test_trace_file_is_written_off_the_caller(tmp_path,monkeypatch):
+    path=tmp_path/"traces.jsonl"
+    monkeypatch.setattr(telemetry,"TRACE_PATH",str(path))
+    writers=[]
+    append=telemetry._append_trace
+    def record(trace):
+        writers.append(threading.current_thread().name)
+        append(trace)
+    monkeypatch.setattr(telemetry,"_append_trace",record)
+    with start_trace("file-test") as trace:
+        pass
+    deadline=time.monotonic()+2
+    while not path.exists() and time.monotonic()<deadline:
+        time.sleep(0.01)
+    assert json.loads(path.read_text().splitlines()[0])["trace_id"]==trace.trace_id
+    assert writers and writers[0].startswith("trace-writer")
@@ -0,0 +1,278 @@
+#local topic classifier shared by routing, research and the planner
+#a multinomial naive bayes over word and bigram features; only low-confidence inputs are sent to the llm
+import os
+import re
+import math
+import threading
+from collections import Counter,defaultdict
+from typing import Dict,Iterable,List,Tuple
+from dotenv import load_dotenv
+from langchain.schema import HumanMessage
+from cache import TTLCache
+from context import count_tokens
+from telemetry import span,register_cache,record_llm_usage
+from deadline import within,time_left,CLASSIFY_SLICE_MS
+
+load_dotenv()
+
+TOPICS=("career","education","technical","general")
+LLM_TOPICS={"career","education","technical"}
+
+#below this posterior the llm is asked instead; TOPIC_LLM_FALLBACK=0 keeps every decision local
+TOPIC_CONFIDENCE_THRESHOLD=float(os.getenv("TOPIC_CONFIDENCE_THRESHOLD","0.6"))
+TOPIC_LLM_FALLBACK=os.getenv("TOPIC_LLM_FALLBACK","1")!="0"
+
+SEED_EXAMPLES:Dict[str,List[str]]={
+    "career":[
+        "should I take this internship",
+        "should I accept the job offer",
+        "how do I prepare for a job interview",
+        "internship or personal project which is better for my career",
+        "how to negotiate my salary",
+        "should I switch careers",
+        "how do I get promoted at work",
+        "is it worth quitting my job to start a company",
+        "how to write a good resume",
+        "what career path should I choose",
+        "full time job versus freelance work",
+        "how do I find a summer internship",
+        "my manager gave me a bad performance review",
+        "should I join a startup or a big company",
+        "how do I build a professional network on linkedin",
+        "applying for jobs after graduation",
+        "internship",
+        "job search",
+        "work on a side project for my portfolio"
+    ],
+    "education":[
+        "should I study for a masters degree",
+        "which online course should I take",
+        "how do I prepare for my final exams",
+        "is a phd worth it",
+        "how to study more effectively",
+        "which university should I apply to",
+        "should I learn through a bootcamp or college",
+        "how do I get a scholarship",
+        "what should I major in",
+        "tips for passing the gre",
+        "how to manage homework and classes",
+        "is it better to study abroad",
+        "how do I choose a thesis topic",
+        "what courses should I take next semester",
+        "learning a new language as a student",
+        "how many hours should I study every day",
+        "study plan for the course",
+        "learn a subject at school"
+    ],
+    "technical":[
+        "how do I fix this python error",
+        "which programming language should I learn",
+        "how to deploy a web app to the cloud",
+        "should I use react or vue",
+        "how does a neural network work",
+        "my code is too slow how can I optimize it",
+        "how to design a database schema",
+        "what is the best way to learn software engineering",
+        "how do I set up docker and kubernetes",
+        "explain how an api works",
+        "debugging a memory leak in my application",
+        "how to write unit tests for my code",
+        "which framework is best for machine learning",
+        "how do I use git branches",
+        "what technology stack should I use for my startup",
+        "how to build a mobile app",
+        "learn programming in python",
+        "software technology and code",
+        "javascript java c++ rust golang"
+    ],
+    "general":[
+        "how do I stay motivated",
+        "I feel tired and stressed",
+        "what should I do this weekend",
+        "how can I be more productive",
+        "I am feeling anxious about the future",
+        "how do I make new friends",
+        "should I move to a new city",
+        "how can I improve my health",
+        "what are some good habits to start",
+        "how do I deal with procrastination",
+        "I want to save money and budget better",
+        "how can I sleep better",
+        "should I buy a car or keep using public transport",
+        "how do I handle a difficult conversation",
+        "what hobby should I pick up",
+        "give me some advice on life"
+    ]
+}
+
+_TOKEN_RE=re.compile(r"[a-z0-9+#]+")
+
+#function words carry no topic signal and would otherwise dominate a corpus this small
+STOP_WORDS=frozenset("""a an and are as at be but by can could do does for from get have how i if in into is it
+its me my of on or should so that the this to want what which will with would you your""".split())
+
+def normalize_text(text:str)->str:
+    return " ".join(_TOKEN_RE.findall(text.lower()))
+
+def features(text:str)->List[str]:
+    words=[word for word in normalize_text(text).split() if word not in STOP_WORDS]
+    return words+[f"{a}_{b}" for a,b in zip(words,words[1:])]
+
+class TopicClassifier:
+    def __init__(self,alpha:float=0.5):
+        self.alpha=alpha
+        self.topics:Tuple[str,...]=()
+        self.vocabulary=set()
+        self._log_prior:Dict[str,float]={}
+        self._log_likelihood:Dict[str,Dict[str,float]]={}
+        self._log_unknown:Dict[str,float]={}
+
+    def fit(self,examples:Dict[str,Iterable[str]])->"TopicClassifier":
+        counts:Dict[str,Counter]=defaultdict(Counter)
+        docs:Counter=Counter()
+        for topic,texts in examples.items():
+            for text in texts:
+                counts[topic].update(features(text))
+                docs[topic]+=1
+        self.topics=tuple(counts)
+        self.vocabulary=set().union(*counts.values())
+        total_docs=sum(docs.values())
+        size=len(self.vocabulary)
+        for topic in self.topics:
+            total=sum(counts[topic].values())+self.alpha*size
+            self._log_prior[topic]=math.log(docs[topic]/total_docs)
+            self._log_likelihood[topic]={token:math.log((count+self.alpha)/total) for token,count in counts[topic].items()}
+            self._log_unknown[topic]=math.log(self.alpha/total)
+        return self
+
+    #posterior probability of every topic; tokens never seen in training are ignored
+    def predict_proba(self,text:str)->Dict[str,float]:
+        tokens=[token for token in features(text) if token in self.vocabulary]
+        scores={}
+        for topic in self.topics:
+            likelihood=self._log_likelihood[topic]
+            unknown=self._log_unknown[topic]
+            scores[topic]=self._log_prior[topic]+sum(likelihood.get(token,unknown) for token in tokens)
+        top=max(scores.values())
+        exp={topic:math.exp(score-top) for topic,score in scores.items()}
+        norm=sum(exp.values())
+        return {topic:value/norm for topic,value in exp.items()}
+
+    def predict(self,text:str)->Tuple[str,float]:
+        proba=self.predict_proba(text)
+        topic=max(proba,key=proba.get)
+        return topic,proba[topic]
+
+classifier=TopicClassifier().fit(SEED_EXAMPLES)
+
+topic_cache=TTLCache(
+    maxsize=int(os.getenv("TOPIC_CACHE_SIZE","1024")),
+    ttl=float(os.getenv("TOPIC_CACHE_TTL",str(24*3600)))
+)
+register_cache("topic",topic_cache.stats)
+
+_stats_lock=threading.Lock()
+_stats={"local":0,"escalated":0,"deferred":0,"llm_errors":0}
+
+def _count(name:str)->None:
+    with _stats_lock:
+        _stats[name]+=1
+
+def topic_stats()->Dict[str,float]:
+    with _stats_lock:
+        stats=dict(_stats)
+    stats["cache"]=topic_cache.stats()
+    return stats
+
+def _topic_messages(user_input:str):
+    return [
+        HumanMessage(content=f"""Analyze this input and determine if it's career, education, or technical related.
+Input: {user_input} Classify as one of: career, education, technical
+Response format: Just the classification word in lowercase.""")
+    ]
+
+def _parse_topic(result)->str:
+    response=result.content.strip().lower()
+    return response if response in LLM_TOPICS else "general"
+
+def _needs_llm(confidence:float)->bool:
+    return TOPIC_LLM_FALLBACK and confidence<TOPIC_CONFIDENCE_THRESHOLD
+
+def _classify_llm(user_input:str,fallback:str)->str:
+    from memory import get_llm
+    try:
+        messages=_topic_messages(user_input)
+        with span("gemini.classify",kind="external",service="gemini",operation="generate",agent="classifier"):
+            result=get_llm().invoke(messages)
+            record_llm_usage("classifier",count_tokens(messages[0].content),result)
+        return _parse_topic(result)
+    except Exception as e:
+        print(f"Error analyzing topic type: {str(e)}")
+        _count("llm_errors")
+        return fallback
+
+async def _classify_llm_async(user_input:str,fallback:str)->str:
+    from memory import get_llm
+    try:
+        messages=_topic_messages(user_input)
+        with span("gemini.classify",kind="external",service="gemini",operation="generate",agent="classifier"):
+            #past its slice the local prediction stands
+            result=await within(get_llm().ainvoke(messages),time_left(CLASSIFY_SLICE_MS),"classify")
+            record_llm_usage("classifier",count_tokens(messages[0].content),result)
+        return _parse_topic(result)
+    except Exception as e:
+        print(f"Error analyzing topic type: {str(e)}")
+        _count("llm_errors")
+        return fallback
+
+#use_llm=False returns an unsure local guess without caching it, for callers that ask the llm themselves
+#(single-call generation) and store its answer with remember_topic
+def classify_topic(user_input:str,use_llm:bool=True)->str:
+    key=normalize_text(user_input)
+    if not key:
+        return "general"
+    cached=topic_cache.get(key)
+    if cached is not None:
+        return cached
+    topic,confidence=classifier.predict(user_input)
+    if _needs_llm(confidence) and not use_llm:
+        _count("deferred")
+        return topic
+    if _needs_llm(confidence):
+        _count("escalated")
+        topic=_classify_llm(user_input,topic)
+    else:
+        _count("local")
+    topic_cache.set(key,topic)
+    return topic
+
+async def classify_topic_async(user_input:str,use_llm:bool=True)->str:
+    key=normalize_text(user_input)
+    if not key:
+        return "general"
+    cached=await topic_cache.aget(key)
+    if cached is not None:
+        return cached
+    topic,confidence=classifier.predict(user_input)
+    if _needs_llm(confidence) and not use_llm:
+        _count("deferred")
+        return topic
+    if _needs_llm(confidence):
+        _count("escalated")
+        topic=await _classify_llm_async(user_input,topic)
+    else:
+        _count("local")
+    await topic_cache.aset(key,topic)
+    return topic
+
+#True while classify_topic(use_llm=False) has only an unsure local guess for this input; a settled topic is cached
+def topic_deferred(user_input:str)->bool:
+    key=normalize_text(user_input)
+    if not key or topic_cache.get(key) is not None:
+        return False
+    return _needs_llm(classifier.predict(user_input)[1])
+
+def remember_topic(user_input:str,topic:str)->None:
+    key=normalize_text(user_input)
+    if key and (topic in LLM_TOPICS or topic=="general"):
+        topic_cache.set(key,topic)
@@ -1,72 +1,277 @@
 import os
 import asyncio
-import sounddevice as sd
 import numpy as np
 import scipy.io.wavfile as wav
+import io
+import wave
 import tempfile
 import requests
 from pydub import AudioSegment
 from pydub.playback import play
 from dotenv import load_dotenv
-from deepgram import DeepgramClient,SpeakOptions
+from deepgram import DeepgramClient,SpeakOptions,LiveOptions,LiveTranscriptionEvents
 from deepgram.clients.listen import PrerecordedOptions
+from lazy import LazyResource
+from background import run_sync
+from audio_cache import audio_key,get_audio_cache
+from telemetry import span
+from deadline import within,TTS_TIMEOUT_MS
+from audio_input import BufferedTranscriber,EnergyEndpointer,capture_utterance,microphone_frames,wav_frames,wav_sample_rate
 
 load_dotenv()
-DEEPGRAM_API_KEY=os.getenv("DEEPGRAM_API_KEY")
 
-if not DEEPGRAM_API_KEY:
-    raise ValueError("DEEPGRAM_API_KEY not found in environment variables")
-dg_client=DeepgramClient(DEEPGRAM_API_KEY)
+#STT_STREAMING=0 goes back to fixed-length recordings sent as one prerecorded request
+STT_STREAMING=os.getenv("STT_STREAMING","1")!="0"
+#how long to wait for the last transcript after the endpoint
+STT_FINALIZE_TIMEOUT=float(os.getenv("STT_FINALIZE_TIMEOUT","1.5"))
+
+#the client is created on first use so text-only tooling can import this module without a key
+def _create_client():
+    api_key=os.getenv("DEEPGRAM_API_KEY")
+    if not api_key:
+        raise ValueError("DEEPGRAM_API_KEY not found in environment variables")
+    return DeepgramClient(api_key)
+
+_dg_client=LazyResource(_create_client,"deepgram")
+
+def get_dg_client():
+    return _dg_client.get()
+
+def warm_up():
+    get_dg_client()
+
 async def transcribe_file(audio_file_path):
     try:
         with open(audio_file_path, "rb") as audio:
             buffer=audio.read()
 
-        response=await dg_client.listen.prerecorded.v("1").transcribe_file(
-            {
-                "buffer":buffer,
-                "mimetype":"audio/wav"
-            },
-            PrerecordedOptions(
-                model="nova",
-                language="en-US",
-                smart_format=True
+        with span("deepgram.transcribe",kind="external",service="deepgram",operation="transcribe"):
+            response=await get_dg_client().listen.asyncprerecorded.v("1").transcribe_file(
+                {
+                    "buffer":buffer,
+                    "mimetype":"audio/wav"
+                },
+                PrerecordedOptions(
+                    model="nova",
+                    language="en-US",
+                    smart_format=True
+                )
             )
-        )
         return response["results"]["channels"][0]["alternatives"][0]["transcript"]
 
     except Exception as e:
         print(f"Transcription error: {str(e)}")
         return ""
 
-def listen_and_transcribe(duration=5,sample_rate=16000):
-    print("Listening... Speak now.")
+#raw pcm from the streaming capture, wrapped as wav for a prerecorded request
+async def transcribe_buffer(pcm,sample_rate=16000):
+    try:
+        wav_buffer=io.BytesIO()
+        with wave.open(wav_buffer,"wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(pcm)
+        with span("deepgram.transcribe",kind="external",service="deepgram",operation="transcribe"):
+            response=await get_dg_client().listen.asyncprerecorded.v("1").transcribe_file(
+                {
+                    "buffer":wav_buffer.getvalue(),
+                    "mimetype":"audio/wav"
+                },
+                PrerecordedOptions(
+                    model="nova",
+                    language="en-US",
+                    smart_format=True
+                )
+            )
+        return response["results"]["channels"][0]["alternatives"][0]["transcript"]
+
+    except Exception as e:
+        print(f"Transcription error: {str(e)}")
+        return ""
+
+class LiveTranscriber:
+    #frames go to a deepgram live session while the user is still talking
+    def __init__(self,sample_rate=16000,finalize_timeout=STT_FINALIZE_TIMEOUT):
+        self.sample_rate=sample_rate
+        self.finalize_timeout=finalize_timeout
+        self.segments=[]
+        self.connection=None
+        self._finalized=asyncio.Event()
+
+    async def start(self):
+        self.connection=get_dg_client().listen.asyncwebsocket.v("1")
+        self.connection.on(LiveTranscriptionEvents.Transcript,self._on_transcript)
+        options=LiveOptions(
+            model="nova",
+            language="en-US",
+            smart_format=True,
+            encoding="linear16",
+            sample_rate=self.sample_rate,
+            channels=1
+        )
+        if not await self.connection.start(options):
+            raise RuntimeError("Could not open the live transcription session")
+
+    async def _on_transcript(self,_client,result,**kwargs):
+        transcript=result.channel.alternatives[0].transcript
+        if result.is_final and transcript:
+            self.segments.append(transcript)
+        if getattr(result,"from_finalize",False):
+            self._finalized.set()
+
+    async def send(self,frame):
+        await self.connection.send(frame)
+
+    async def finish(self):
+        try:
+            await self.connection.finalize()
+            await asyncio.wait_for(self._finalized.wait(),self.finalize_timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await self.connection.finish()
+        return " ".join(self.segments).strip()
+
+    async def cancel(self):
+        await self.connection.finish()
+
+#source: None for the microphone, a path to a 16-bit mono wav, or any (async) iterable of pcm frames
+async def stream_and_transcribe(source=None,sample_rate=16000,endpointer=None):
+    if source is None:
+        source=microphone_frames(sample_rate)
+    elif isinstance(source,str):
+        sample_rate=wav_sample_rate(source)
+        source=wav_frames(source)
+    transcriber=LiveTranscriber(sample_rate)
+    try:
+        await transcriber.start()
+    except Exception as e:
+        print(f"Live transcription unavailable, sending the utterance at the end: {str(e)}")
+        transcriber=BufferedTranscriber(transcribe_buffer,sample_rate)
+        await transcriber.start()
+    try:
+        return await capture_utterance(source,transcriber,endpointer or EnergyEndpointer(sample_rate))
+    except Exception as e:
+        print(f"Transcription error: {str(e)}")
+        return ""
+
+def _record(duration,sample_rate):
+    #imported here, loading portaudio fails on machines without an audio device
+    import sounddevice as sd
     recording=sd.rec(int(duration * sample_rate),samplerate=sample_rate,channels=1,dtype='int16')
     sd.wait()
 
     with tempfile.NamedTemporaryFile(delete=False,suffix=".wav") as f:
         wav.write(f.name,sample_rate,recording)
-        audio_file_path=f.name
+        return f.name
 
-    transcript=asyncio.run(transcribe_file(audio_file_path))
-    os.unlink(audio_file_path)
+async def listen_and_transcribe_async(duration=5,sample_rate=16000,source=None,streaming=STT_STREAMING):
+    print("Listening... Speak now.")
+    if streaming or source is not None:
+        #stops when the speaker goes quiet instead of after a fixed duration
+        transcript=await stream_and_transcribe(source,sample_rate)
+        print("You said:", transcript)
+        return transcript
+    #recording blocks on the sound device, so it runs off the event loop
+    audio_file_path=await asyncio.to_thread(_record,duration,sample_rate)
+    try:
+        transcript=await transcribe_file(audio_file_path)
+    finally:
+        os.unlink(audio_file_path)
     print("You said:", transcript)
     return transcript
 
-def speak(text,agent="planner"):
+#runs on the shared background loop like the rest of the blocking entry points
+def listen_and_transcribe(duration=5,sample_rate=16000,source=None,streaming=STT_STREAMING):
+    return run_sync(listen_and_transcribe_async(duration,sample_rate,source,streaming))
+
+def _speak_options(agent):
     voice_map={"optimist":"aura-joy","realist":"aura-solemn","planner":"aura-echo"}
     model=voice_map.get(agent,"aura-echo")
-    options=SpeakOptions(model=model,encoding="linear16",sample_rate=24000)
+    return SpeakOptions(model=model,encoding="linear16",sample_rate=24000)
+
+def _audio_key(text,options):
+    return audio_key(options.model,options.encoding,options.sample_rate,text)
+
+#returns (cache, key, cached audio or None); cache is None when caching is off
+def _cached_audio(text,options):
+    cache=get_audio_cache()
+    if cache is None:
+        return None,None,None
+    key=_audio_key(text,options)
+    return cache,key,cache.get(key)
+
+def synthesize(text,agent="planner"):
+    options=_speak_options(agent)
+    cache,key,audio=_cached_audio(text,options)
+    if audio:
+        return audio
     try:
-        response=dg_client.speak.v("1").stream_memory({"text":text},options)
-        audio_data=response.stream.getvalue()
-        with tempfile.NamedTemporaryFile(delete=False,suffix=".wav") as f:
-            f.write(audio_data)
-            f.flush()
-            audio=AudioSegment.from_wav(f.name)
-            play(audio)
+        with span("deepgram.speak",kind="external",service="deepgram",operation="speak",agent=agent,chars=len(text)):
+            response=get_dg_client().speak.v("1").stream_memory({"text":text},options)
+            audio=response.stream.getvalue()
+        if cache is not None:
+            cache.set(key,audio)
+        return audio
     except Exception as e:
         print(f"TTS Error: {str(e)}")
+        return b""
+
+#decoded in memory, a temp file per clip would pile up with one clip per sentence
+def play_audio(audio_data):
+    audio=AudioSegment.from_wav(io.BytesIO(audio_data))
+    play(audio)
+
+def speak(text,agent="planner"):
+    audio_data=synthesize(text,agent)
+    if audio_data:
+        play_audio(audio_data)
+
+#the audio cache reads and writes files, so it runs on a worker thread instead of the event loop
+async def synthesize_async(text,agent="planner"):
+    options=_speak_options(agent)
+    cache,key,audio=await asyncio.to_thread(_cached_audio,text,options)
+    if audio:
+        return audio
+    try:
+        with span("deepgram.speak",kind="external",service="deepgram",operation="speak",agent=agent,chars=len(text)):
+            #a slow clip is skipped so it cannot hold up the sentences after it
+            response=await within(get_dg_client().speak.asyncrest.v("1").stream_memory({"text":text},options),TTS_TIMEOUT_MS/1000,"tts")
+            audio=response.stream.getvalue()
+        if cache is not None:
+            await asyncio.to_thread(cache.set,key,audio)
+        return audio
+    except Exception as e:
+        print(f"TTS Error: {str(e)}")
+        return b""
+
+#synthesizes fixed phrases ahead of time so they play without a request; phrases are (agent, text) pairs
+#the sentence chunks the streaming speaker uses are warmed as well as the whole text
+async def prewarm_audio(phrases):
+    from streaming import SentenceSegmenter,TTS_CONCURRENCY
+    #the first call scans the cache directory
+    cache=await asyncio.to_thread(get_audio_cache)
+    if cache is None:
+        return 0
+    pending={}
+    for agent,text in phrases:
+        segmenter=SentenceSegmenter()
+        for chunk in [text]+segmenter.push(text)+segmenter.flush():
+            key=_audio_key(chunk,_speak_options(agent))
+            if key not in cache:
+                pending[key]=(chunk,agent)
+    limit=asyncio.Semaphore(TTS_CONCURRENCY)
+    async def warm(chunk,agent):
+        async with limit:
+            return await synthesize_async(chunk,agent)
+    results=await asyncio.gather(*[warm(chunk,agent) for chunk,agent in pending.values()])
+    return sum(1 for audio in results if audio)
+
+async def speak_async(text,agent="planner"):
+    audio_data=await synthesize_async(text,agent)
+    if audio_data:
+        await asyncio.to_thread(play_audio,audio_data)
         
 if __name__=="__main__":
     text=listen_and_transcribe()
@@ -1,43 +1,75 @@
 import streamlit as st
-from tts_stt import listen_and_transcribe,speak
-from app import run_conversation
+from tts_stt import listen_and_transcribe
+from app import run_conversation,run_conversation_streaming_async,warm_up
 from state import initialize_state,AgentState
-import time
+from streaming import SpeechStreamer,speak_responses
+from telemetry import start_metrics_server
+from realistic import SOURCES_MARKER
+from background import run_sync
+import uuid
 st.set_page_config(page_title="Multi-Agent Voice System",layout="centered")
 st.title("Talk with the Agents")
 
+#clients are created once per server process, before the first question
+#METRICS_PORT also serves /metrics and the per-turn traces from the same process
+@st.cache_resource
+def warm_services():
+    start_metrics_server()
+    return warm_up(include_voice=True)
+
+warm_services()
+
 if "agent_state" not in st.session_state:
     st.session_state.agent_state=initialize_state()
 
 if "chat_history" not in st.session_state:
     st.session_state.chat_history=[]
 
+#each browser session keeps its own short-term agent memory
+if "session_id" not in st.session_state:
+    st.session_state.session_id=str(uuid.uuid4())
+
 #for history display
 for speaker, msg in st.session_state.chat_history:
     with st.chat_message(speaker):
         st.markdown(msg)
 
-def run_and_speak(final_state: AgentState):
+def run_and_speak(final_state: AgentState, speak_aloud: bool=True):
     agents=[
         ("optimist","Optimist Agent","optimist"),
         ("realist","Realist Agent","realist"),
         ("planner","Planner Agent","planner")
     ]
+    speech=[]
     for key,label,agent_key in agents:
         response=getattr(final_state, f"{key}_response")
         if response and response.strip():
             with st.chat_message(agent_key):
-                if key=="realist" and "SOURCES:" in response:
-                    main_content, sources=response.split("SOURCES:", 1)
+                if key=="realist" and SOURCES_MARKER.search(response):
+                    main_content, sources=SOURCES_MARKER.split(response, 1)
                     st.success(f"**{label}**: {main_content.strip()}")
-                    speak(f"{main_content.strip()} Please refer to the sources below for more information.", agent=agent_key)
+                    if speak_aloud:
+                        speech.append((agent_key,f"{main_content.strip()} Please refer to the sources below for more information."))
                     st.info("**Sources:**\n" + sources.strip())
                     st.session_state.chat_history.append((agent_key, f"**{label}**: {main_content.strip()}\n\n**Sources:**\n{sources.strip()}"))
                 else:
                     st.success(f"**{label}**: {response}")
-                    speak(response,agent=agent_key)
+                    if speak_aloud:
+                        speech.append((agent_key,response))
                     st.session_state.chat_history.append((agent_key, f"**{label}**: {response}"))
-                time.sleep(len(response.split()) * 0.3) 
+    #every answer is on screen first, then the agents speak back to back with the next one already synthesized
+    if speech:
+        run_sync(speak_responses(speech))
+
+#speaks each agent sentence by sentence while the agents are still generating
+async def stream_and_speak(user_input: str, session_id: str) -> AgentState:
+    streamer=SpeechStreamer()
+    try:
+        return await run_conversation_streaming_async(user_input,streamer.submit,streamer.finish,session_id=session_id)
+    finally:
+        await streamer.close()
+
+stream_audio=st.checkbox("Speak replies while the agents are still answering",value=True)
 
 if st.button("Start Talking"):
     with st.chat_message("user"):
@@ -48,10 +80,13 @@ if st.button("Start Talking"):
         st.session_state.chat_history.append(("user", user_input))
 
         try:
-            final_state=run_conversation(user_input)
+            if stream_audio:
+                final_state=run_sync(stream_and_speak(user_input,st.session_state.session_id))
+            else:
+                final_state=run_conversation(user_input,session_id=st.session_state.session_id)
 
             if isinstance(final_state, AgentState):
-                run_and_speak(final_state)
+                run_and_speak(final_state,speak_aloud=not stream_audio)
                 st.session_state.agent_state=final_state
             else:
                 raise ValueError("Invalid AgentState returned")
@@ -0,0 +1,303 @@
+#vector store backends for memory_store
+#pinecone for hosted deployments, a local numpy/mmap store for small deployments, tests and benchmarks
+import os
+import json
+import sqlite3
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any,Dict,List,Optional
+import numpy as np
+
+logger=logging.getLogger(__name__)
+
+class VectorBackend:
+    #vectors are dicts with "id", "values" and "metadata", queries return {"matches":[{"id","score","metadata"}]}
+    def upsert(self,vectors:List[Dict[str,Any]])->None:
+        raise NotImplementedError
+
+    def query(self,vector:List[float],top_k:int,filter:Optional[Dict[str,Any]]=None)->Dict[str,Any]:
+        raise NotImplementedError
+
+    #one query vector, results partitioned per agent_type with top_k each
+    def query_by_agent(self,vector:List[float],top_k:int,agent_types:List[str])->Dict[str,Any]:
+        return {agent:self.query(vector,top_k,{"agent_type":{"$eq":agent}}) for agent in agent_types}
+
+    def delete(self,ids:List[str])->None:
+        raise NotImplementedError
+
+    def clear(self)->None:
+        raise NotImplementedError
+
+class PineconeBackend(VectorBackend):
+    def __init__(self,api_key:str,index_name:str,dimension:int,namespace:str="default"):
+        from pinecone import Pinecone,ServerlessSpec
+        self.namespace=namespace
+        pc=Pinecone(api_key=api_key)
+        logger.info("Pinecone client initialized.")
+
+        if index_name not in pc.list_indexes().names():
+            logger.info(f"Creating new index: {index_name}")
+            pc.create_index(
+                name=index_name,
+                dimension=dimension,
+                metric="cosine",
+                spec=ServerlessSpec(cloud="aws", region="us-east-1")
+            )
+
+        self.index=pc.Index(index_name)
+        logger.info(f"Connected to index: {index_name}")
+
+    def upsert(self,vectors:List[Dict[str,Any]])->None:
+        self.index.upsert(vectors=vectors,namespace=self.namespace)
+
+    def query(self,vector:List[float],top_k:int,filter:Optional[Dict[str,Any]]=None)->Dict[str,Any]:
+        return self.index.query(
+            vector=vector,
+            top_k=top_k,
+            include_metadata=True,
+            namespace=self.namespace,
+            filter=filter
+        )
+
+    def query_by_agent(self,vector:List[float],top_k:int,agent_types:List[str])->Dict[str,Any]:
+        #pinecone filters one agent_type per request, so the filtered queries go out in parallel
+        with ThreadPoolExecutor(max_workers=max(len(agent_types),1)) as pool:
+            #a copy of the caller's context per query keeps them under the current span
+            futures={agent:pool.submit(contextvars.copy_context().run,self.query,vector,top_k,{"agent_type":{"$eq":agent}}) for agent in agent_types}
+            return {agent:future.result() for agent,future in futures.items()}
+
+    def delete(self,ids:List[str])->None:
+        self.index.delete(ids=ids,namespace=self.namespace)
+
+    def clear(self)->None:
+        self.index.delete(delete_all=True,namespace=self.namespace)
+
+def _matches(value:Any,condition:Any)->bool:
+    if isinstance(condition,dict):
+        if "$eq" in condition:
+            return value==condition["$eq"]
+        if "$in" in condition:
+            return value in condition["$in"]
+        if "$ne" in condition:
+            return value!=condition["$ne"]
+        raise ValueError(f"Unsupported filter: {condition}")
+    return value==condition
+
+class LocalBackend(VectorBackend):
+    #unit-normalized float32 rows, so cosine similarity is a single matrix-vector product
+    #with a path the rows live in a memory-mapped file and ids/metadata in a sqlite side table
+    def __init__(self,path:Optional[str]=None,dimension:Optional[int]=None,capacity:int=1024):
+        self.path=path
+        self.dimension=dimension
+        self.capacity=capacity
+        self._lock=threading.RLock()
+        self._rows:Optional[np.ndarray]=None
+        self._codes:Dict[Any,int]={}
+        self._row_of:Dict[str,int]={}
+        self._metadata:Dict[str,Dict[str,Any]]={}
+        self._free:List[int]=[]
+        self._reset_index(0)
+        self._db=None
+        if path:
+            os.makedirs(path,exist_ok=True)
+            self._db=sqlite3.connect(os.path.join(path,"metadata.db"),check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS vectors (id TEXT PRIMARY KEY, row INTEGER NOT NULL, metadata TEXT NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.commit()
+            self._load()
+
+    @property
+    def _vectors_file(self)->str:
+        return os.path.join(self.path,"vectors.f32")
+
+    def _reset_index(self,capacity:int)->None:
+        self._active=np.zeros(capacity,dtype=bool)
+        self._agent_codes=np.full(capacity,-1,dtype=np.int32)
+        self._ids:List[Optional[str]]=[None]*capacity
+
+    def _load(self)->None:
+        settings=dict(self._db.execute("SELECT key, value FROM settings").fetchall())
+        if "dimension" not in settings:
+            return
+        self.dimension=int(settings["dimension"])
+        self.capacity=int(settings["capacity"])
+        self._rows=np.memmap(self._vectors_file,dtype=np.float32,mode="r+",shape=(self.capacity,self.dimension))
+        self._reset_index(self.capacity)
+        for memory_id,row,metadata in self._db.execute("SELECT id, row, metadata FROM vectors"):
+            self._index_row(memory_id,row,json.loads(metadata))
+        self._free=[row for row in range(self.capacity-1,-1,-1) if not self._active[row]]
+        logger.info(f"Loaded {len(self._row_of)} vectors from {self.path}")
+
+    def _code(self,agent_type:Any)->int:
+        if agent_type not in self._codes:
+            self._codes[agent_type]=len(self._codes)
+        return self._codes[agent_type]
+
+    def _index_row(self,memory_id:str,row:int,metadata:Dict[str,Any])->None:
+        self._active[row]=True
+        self._agent_codes[row]=self._code(metadata.get("agent_type"))
+        self._ids[row]=memory_id
+        self._row_of[memory_id]=row
+        self._metadata[memory_id]=metadata
+
+    def _grow(self,needed:int)->None:
+        #caller holds the lock; capacity doubles so upserts stay amortized O(1)
+        if self._rows is not None and needed<=self.capacity:
+            return
+        old_capacity=0 if self._rows is None else self.capacity
+        capacity=max(self.capacity,1)
+        while capacity<needed:
+            capacity*=2
+        if self.path:
+            rows=np.memmap(self._vectors_file+".tmp",dtype=np.float32,mode="w+",shape=(capacity,self.dimension))
+        else:
+            rows=np.zeros((capacity,self.dimension),dtype=np.float32)
+        if self._rows is not None:
+            rows[:old_capacity]=self._rows[:old_capacity]
+        if self.path:
+            rows.flush()
+            del rows
+            self._rows=None
+            os.replace(self._vectors_file+".tmp",self._vectors_file)
+            rows=np.memmap(self._vectors_file,dtype=np.float32,mode="r+",shape=(capacity,self.dimension))
+            self._db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('dimension', ?)",(str(self.dimension),))
+            self._db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('capacity', ?)",(str(capacity),))
+        self._rows=rows
+        active,codes,ids=self._active,self._agent_codes,self._ids
+        self._reset_index(capacity)
+        self._active[:old_capacity]=active[:old_capacity]
+        self._agent_codes[:old_capacity]=codes[:old_capacity]
+        self._ids[:old_capacity]=ids[:old_capacity]
+        #lowest free rows are popped first
+        self._free=list(range(capacity-1,old_capacity-1,-1))+self._free
+        self.capacity=capacity
+
+    def upsert(self,vectors:List[Dict[str,Any]])->None:
+        if not vectors:
+            return
+        with self._lock:
+            if self.dimension is None:
+                self.dimension=len(vectors[0]["values"])
+            new_ids={vector["id"] for vector in vectors if vector["id"] not in self._row_of}
+            self._grow(len(self._row_of)+len(new_ids))
+            for vector in vectors:
+                values=np.asarray(vector["values"],dtype=np.float32)
+                if values.shape!=(self.dimension,):
+                    raise ValueError(f"Expected a {self.dimension}-dimensional vector, got {values.shape}")
+                norm=np.linalg.norm(values)
+                memory_id=vector["id"]
+                row=self._row_of.get(memory_id)
+                if row is None:
+                    row=self._free.pop()
+                self._rows[row]=values/norm if norm else values
+                metadata=dict(vector.get("metadata") or {})
+                self._index_row(memory_id,row,metadata)
+                if self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO vectors (id, row, metadata) VALUES (?, ?, ?)",
+                        (memory_id,row,json.dumps(metadata))
+                    )
+            if self._db:
+                self._rows.flush()
+                self._db.commit()
+
+    def _mask(self,filter:Optional[Dict[str,Any]])->np.ndarray:
+        mask=self._active.copy()
+        for key,condition in (filter or {}).items():
+            if key=="agent_type" and not (isinstance(condition,dict) and "$ne" in condition):
+                #agent_type is kept as an integer code per row, so the common filters stay vectorized
+                values=condition.get("$in",[condition.get("$eq")]) if isinstance(condition,dict) else [condition]
+                mask&=np.isin(self._agent_codes,[self._codes[value] for value in values if value in self._codes])
+            else:
+                mask&=np.array([
+                    self._ids[row] is not None and _matches(self._metadata[self._ids[row]].get(key),condition)
+                    for row in range(self.capacity)
+                ],dtype=bool)
+        return mask
+
+    def _prepare(self,vector:List[float])->np.ndarray:
+        query=np.asarray(vector,dtype=np.float32)
+        norm=np.linalg.norm(query)
+        return query/norm if norm else query
+
+    def _top_k(self,scores:np.ndarray,candidates:np.ndarray,top_k:int)->Dict[str,Any]:
+        if candidates.size==0:
+            return {"matches":[]}
+        k=min(top_k,candidates.size)
+        best=np.argpartition(-scores,k-1)[:k]
+        best=best[np.argsort(-scores[best])]
+        return {"matches":[{
+            "id":self._ids[candidates[i]],
+            "score":float(scores[i]),
+            "metadata":self._metadata[self._ids[candidates[i]]]
+        } for i in best]}
+
+    def _used(self)->int:
+        #rows are allocated lowest-first, so everything past the highest live row is empty
+        return int(np.flatnonzero(self._active)[-1])+1
+
+    def query(self,vector:List[float],top_k:int,filter:Optional[Dict[str,Any]]=None)->Dict[str,Any]:
+        with self._lock:
+            if self._rows is None or not self._row_of:
+                return {"matches":[]}
+            query=self._prepare(vector)
+            used=self._used()
+            candidates=np.flatnonzero(self._mask(filter)[:used])
+            if candidates.size==0:
+                return {"matches":[]}
+            if candidates.size*2<used:
+                scores=self._rows[candidates]@query
+            else:
+                #scoring the whole used block is cheaper than gathering most of it
+                scores=(self._rows[:used]@query)[candidates]
+            return self._top_k(scores,candidates,top_k)
+
+    def query_by_agent(self,vector:List[float],top_k:int,agent_types:List[str])->Dict[str,Any]:
+        #a single pass over the rows serves every agent
+        with self._lock:
+            if self._rows is None or not self._row_of:
+                return {agent:{"matches":[]} for agent in agent_types}
+            used=self._used()
+            all_scores=self._rows[:used]@self._prepare(vector)
+            active=self._active[:used]
+            codes=self._agent_codes[:used]
+            results={}
+            for agent in agent_types:
+                candidates=np.flatnonzero(active&(codes==self._codes.get(agent,-2)))
+                results[agent]=self._top_k(all_scores[candidates],candidates,top_k)
+            return results
+
+    def delete(self,ids:List[str])->None:
+        with self._lock:
+            for memory_id in ids:
+                row=self._row_of.pop(memory_id,None)
+                if row is None:
+                    continue
+                self._active[row]=False
+                self._agent_codes[row]=-1
+                self._ids[row]=None
+                self._metadata.pop(memory_id,None)
+                self._free.append(row)
+                if self._db:
+                    self._db.execute("DELETE FROM vectors WHERE id=?",(memory_id,))
+            if self._db:
+                self._db.commit()
+
+    def clear(self)->None:
+        with self._lock:
+            self.delete(list(self._row_of))
+
+    def __len__(self)->int:
+        return len(self._row_of)
+
+def create_backend(dimension:int,api_key:Optional[str]=None,index_name:str="voiceagent",namespace:str="default")->VectorBackend:
+    #VECTOR_BACKEND=local keeps memories in-process; LOCAL_VECTOR_PATH makes them persistent
+    kind=os.getenv("VECTOR_BACKEND","pinecone").lower()
+    if kind=="local":
+        logger.info("Using local vector store")
+        return LocalBackend(path=os.getenv("LOCAL_VECTOR_PATH") or None)
+    if kind=="pinecone":
+        return PineconeBackend(api_key,index_name,dimension,namespace)
+    raise ValueError(f"Unknown VECTOR_BACKEND: {kind}")
@@ -1,31 +1,139 @@
 import os
+import json
+import asyncio
+import threading
+import weakref
 import requests
+import httpx
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from cache import TTLCache
+from telemetry import span,register_cache
 load_dotenv()
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
-def search_web(query):
-    url="https://google.serper.dev/search"
-    headers={
+SERPER_URL="https://google.serper.dev/search"
+
+#connect/read timeouts in seconds
+SEARCH_CONNECT_TIMEOUT=float(os.getenv("SEARCH_CONNECT_TIMEOUT","3"))
+SEARCH_READ_TIMEOUT=float(os.getenv("SEARCH_READ_TIMEOUT","10"))
+SEARCH_POOL_SIZE=int(os.getenv("SEARCH_POOL_SIZE","10"))
+
+#organic results of identical normalized queries are answered from here; SEARCH_CACHE_PATH adds a sqlite tier
+search_cache=TTLCache(
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE","512")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL","3600")),
+    path=os.getenv("SEARCH_CACHE_PATH") or None,
+    table="search_organic",
+    serialize=lambda items:json.dumps(items).encode("utf-8"),
+    deserialize=lambda raw:json.loads(raw.decode("utf-8"))
+)
+
+_session=None
+_session_lock=threading.Lock()
+#httpx clients are bound to the loop they were created on
+_async_clients=weakref.WeakKeyDictionary()
+
+def _headers():
+    return {
         "X-API-KEY":SERPER_API_KEY,
         "Content-Type":"application/json"
     }
-    payload={
-        "q":query
-    }
-    try:
-        response=requests.post(url,headers=headers,json=payload)
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session=requests.Session()
+                adapter=HTTPAdapter(pool_connections=SEARCH_POOL_SIZE,pool_maxsize=SEARCH_POOL_SIZE)
+                session.mount("https://",adapter)
+                session.headers.update(_headers())
+                _session=session
+    return _session
+
+def get_async_client():
+    loop=asyncio.get_running_loop()
+    client=_async_clients.get(loop)
+    if client is None:
+        client=httpx.AsyncClient(
+            headers=_headers(),
+            timeout=httpx.Timeout(SEARCH_READ_TIMEOUT,connect=SEARCH_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=SEARCH_POOL_SIZE,max_keepalive_connections=SEARCH_POOL_SIZE)
+        )
+        _async_clients[loop]=client
+    return client
+
+#closes the running loop's client; for loops that stop while the process goes on (a server shutting down, a test)
+async def close_async_client():
+    client=_async_clients.pop(asyncio.get_running_loop(),None)
+    if client is not None:
+        await client.aclose()
+
+def normalize_query(query):
+    return " ".join(str(query).lower().split())
+
+def search_cache_stats():
+    return search_cache.stats()
+
+register_cache("search",search_cache_stats)
+
+def format_organic(items,limit=3):
+    formatted_results=[]
+    for result in items[:limit]:
+        title=result.get("title", "")
+        snippet=result.get("snippet", "")
+        link=result.get("link", "")
+        formatted_results.append(f" {title}\n{snippet}\n {link}")
+    return "\n\n".join(formatted_results)
+
+def format_results(data):
+    if "organic" not in data:
+        return "No web results found."
+    return format_organic(data["organic"])
+
+def _organic(data):
+    return [
+        {"title":item.get("title", ""),"snippet":item.get("snippet", ""),"link":item.get("link", "")}
+        for item in data.get("organic", [])
+    ]
+
+#raw organic results, raises on network errors so callers can tell failures from empty results
+def fetch_organic(query):
+    key=normalize_query(query)
+    cached=search_cache.get(key)
+    if cached is not None:
+        return cached
+    with span("serper.search",kind="external",service="serper",operation="search"):
+        response=get_session().post(SERPER_URL,json={"q":query},timeout=(SEARCH_CONNECT_TIMEOUT,SEARCH_READ_TIMEOUT))
         response.raise_for_status()
-        data=response.json()
-        if "organic" not in data:
-            return "No web results found."
-        top_results=data["organic"][:3]
-        formatted_results=[]
-        for result in top_results:
-            title=result.get("title", "")
-            snippet=result.get("snippet", "")
-            link=result.get("link", "")
-            formatted_results.append(f" {title}\n{snippet}\n {link}")
-        return "\n\n".join(formatted_results)
+    items=_organic(response.json())
+    search_cache.set(key,items)
+    return items
+
+async def fetch_organic_async(query):
+    key=normalize_query(query)
+    cached=await search_cache.aget(key)
+    if cached is not None:
+        return cached
+    with span("serper.search",kind="external",service="serper",operation="search"):
+        response=await get_async_client().post(SERPER_URL,json={"q":query})
+        response.raise_for_status()
+    items=_organic(response.json())
+    await search_cache.aset(key,items)
+    return items
+
+def search_web(query):
+    try:
+        items=fetch_organic(query)
+        return format_organic(items) if items else "No web results found."
+
+    except Exception as e:
+        return f"Web search failed: {e}"
+
+async def search_web_async(query):
+    try:
+        items=await fetch_organic_async(query)
+        return format_organic(items) if items else "No web results found."
 
     except Exception as e:
         return f"Web search failed: {e}"